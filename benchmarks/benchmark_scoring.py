@@ -0,0 +1,334 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Benchmarks of the scoring path of RBTransiNetTask, on synthetic data.
+
+Exposures and source catalogs are simulated with
+`lsst.meas.base.tests.TestDataset`, and each stage of scoring is timed
+separately with the 'dummy' model package stored in this repository:
+cold and warm model loading, per-source (``_make_cutouts``) and vectorized
+(``_make_cutouts_batch``) cutout extraction, ``prepare_input`` and
+``infer``.
+
+Results are written as JSON, and may be compared with those of an earlier
+run, e.g.::
+
+    python benchmarks/benchmark_scoring.py --output baseline.json
+    # ... change the code ...
+    python benchmarks/benchmark_scoring.py --baseline baseline.json
+
+which exits with a non-zero status if any benchmark is slower than its
+baseline by more than the tolerance. Benchmarks are compared by their
+median time per item (model load, or cutout), so runs capped at different
+numbers of cutouts remain comparable; comparisons are only meaningful on
+the same machine.
+
+MEAS_TRANSINET_DIR must point to this package, e.g. by setting it up with
+EUPS.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+import torch
+
+import lsst.geom
+import lsst.meas.base.tests
+
+from lsst.meas.transiNet import RBTransiNetInterface, RBTransiNetTask
+from lsst.meas.transiNet.modelPackages.modelCache import get_model_cache
+
+# Side of the simulated exposures, in pixels; about that of an LSSTCam
+# detector.
+EXPOSURE_SIZE = 4000
+
+
+def make_dataset(n_sources, seed):
+    """Simulate an exposure and a catalog of sources at random positions.
+
+    Parameters
+    ----------
+    n_sources : `int`
+        Number of sources.
+    seed : `int`
+        Seed of the random positions and fluxes.
+
+    Returns
+    -------
+    exposure : `lsst.afw.image.ExposureF`
+        The simulated exposure.
+    catalog : `lsst.afw.table.SourceCatalog`
+        The sources.
+    """
+    rng = np.random.default_rng(seed)
+    bbox = lsst.geom.Box2I(lsst.geom.Point2I(0, 0), lsst.geom.Extent2I(EXPOSURE_SIZE, EXPOSURE_SIZE))
+    dataset = lsst.meas.base.tests.TestDataset(bbox)
+    for x, y, flux in zip(rng.uniform(0, EXPOSURE_SIZE - 1, n_sources),
+                          rng.uniform(0, EXPOSURE_SIZE - 1, n_sources),
+                          rng.uniform(1000, 20000, n_sources)):
+        dataset.addSource(flux, lsst.geom.Point2D(x, y))
+    return dataset.realize(10.0, dataset.makeMinimalSchema(), randomSeed=seed)
+
+
+def make_task(cutout_size, **overrides):
+    """Return a task scoring cutouts of a size with the dummy package.
+    """
+    config = RBTransiNetTask.ConfigClass()
+    config.modelPackageName = "dummy"
+    config.modelPackageStorageMode = "local"
+    config.cutoutSize = cutout_size
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return RBTransiNetTask(config=config)
+
+
+def measure(function, repeats, setup=None):
+    """Time a function.
+
+    Parameters
+    ----------
+    function : callable
+        Function to time, called with no arguments.
+    repeats : `int`
+        Number of timed calls.
+    setup : callable, optional
+        Function called, untimed, before each call of ``function``.
+
+    Returns
+    -------
+    times : `list` [`float`]
+        Wall-clock time of each call, in seconds.
+    """
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(name, times, n_items, **parameters):
+    """Return the result of a benchmark.
+    """
+    return {"name": name,
+            "parameters": parameters,
+            "n_items": n_items,
+            "times": times,
+            "median": statistics.median(times),
+            "min": min(times),
+            "median_per_item": statistics.median(times) / max(n_items, 1)}
+
+
+def result_key(result):
+    """Return the key identifying a benchmark across runs.
+    """
+    parameters = ",".join(f"{name}={value}" for name, value in sorted(result["parameters"].items()))
+    return f"{result['name']}[{parameters}]"
+
+
+def benchmark_model_load(cutout_size, repeats):
+    """Time loading the model, with and without the process-wide cache.
+
+    Cold loads start from an empty model cache, but modules already
+    imported by this process, e.g. the architecture of the package, are
+    reused.
+    """
+    task = make_task(cutout_size)
+    cold = measure(lambda: RBTransiNetInterface(task), repeats, setup=get_model_cache().clear)
+    warm = measure(lambda: RBTransiNetInterface(task), repeats)
+    return [summarize("model_load_cold", cold, 1, cutout_size=cutout_size),
+            summarize("model_load_warm", warm, 1, cutout_size=cutout_size)]
+
+
+def benchmark_scoring(exposure, catalog, cutout_size, repeats, max_cutout_bytes, max_per_source):
+    """Time extracting and scoring the cutouts of a catalog.
+
+    Parameters
+    ----------
+    exposure : `lsst.afw.image.ExposureF`
+        Exposure used as science, template and difference image.
+    catalog : `lsst.afw.table.SourceCatalog`
+        Sources to score.
+    cutout_size : `int`
+        Size of the cutouts.
+    repeats : `int`
+        Number of timed calls of each stage.
+    max_cutout_bytes : `int`
+        Only the first sources whose cutouts fit in this many bytes are
+        extracted and scored at once.
+    max_per_source : `int`
+        Maximum number of sources to extract one by one.
+
+    Returns
+    -------
+    results : `list` [`dict`]
+        Result of each benchmark; inference is not timed if the cutouts are
+        not of the input size of the model.
+    """
+    task = make_task(cutout_size)
+    interface = RBTransiNetInterface(task)
+    n_sources = len(catalog)
+    parameters = dict(n_sources=n_sources, cutout_size=cutout_size)
+
+    n_batch = min(n_sources, max(1, max_cutout_bytes // (3 * cutout_size**2 * 4)))
+    subset = catalog[:n_batch].copy(deep=True)
+    blobs = task._make_cutouts_batch(exposure, exposure, exposure, subset)
+    times = measure(lambda: task._make_cutouts_batch(exposure, exposure, exposure, subset), repeats)
+    results = [summarize("make_cutouts_batch", times, n_batch, **parameters)]
+
+    n_single = min(n_sources, max_per_source)
+    records = list(catalog[:n_single])
+
+    def make_cutouts():
+        return [task._make_cutouts(exposure, exposure, exposure, record) for record in records]
+
+    cutouts = make_cutouts()
+    times = measure(make_cutouts, repeats)
+    results.append(summarize("make_cutouts", times, n_single, **parameters))
+
+    batch_size = interface.get_batch_size((cutout_size, cutout_size))
+
+    def prepare_input():
+        for batch in interface.input_to_batches(cutouts, batch_size):
+            interface.prepare_input(batch)
+
+    times = measure(prepare_input, repeats)
+    results.append(summarize("prepare_input", times, n_single, **parameters))
+
+    # The model only accepts cutouts of its own input size; other sizes
+    # still exercise extraction and normalization.
+    height, width, _ = interface.model_package.get_model_input_shape()
+    if (cutout_size, cutout_size) != (height, width):
+        print(f"Skipping inference of {cutout_size}x{cutout_size} cutouts: the model takes "
+              f"{height}x{width} cutouts.", file=sys.stderr)
+        return results
+
+    times = measure(lambda: interface.infer(blobs), repeats)
+    results.append(summarize("infer", times, n_batch, **parameters))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline.
+
+    Parameters
+    ----------
+    results : `list` [`dict`]
+        Results of this run.
+    baseline : `list` [`dict`]
+        Results of the baseline run.
+    tolerance : `float`
+        Largest allowed relative increase of the median time per item.
+
+    Returns
+    -------
+    regressions : `list` [`str`]
+        Keys of the benchmarks slower than their baseline by more than the
+        tolerance.
+    """
+    baseline = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if key not in baseline:
+            continue
+        ratio = result["median_per_item"] / baseline[key]["median_per_item"]
+        regressed = ratio > 1 + tolerance
+        if regressed:
+            regressions.append(key)
+        print(f"{key:60s} {ratio:6.2f}x baseline  {'REGRESSION' if regressed else 'ok'}", file=sys.stderr)
+    return regressions
+
+
+def environment():
+    """Return a description of the machine and software of the run.
+    """
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "numpy": np.__version__}
+
+
+def build_argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sources", type=int, nargs="+", default=[100, 1000, 10000, 100000],
+                        help="Numbers of sources per simulated exposure.")
+    parser.add_argument("--cutout-sizes", type=int, nargs="+", default=[51, 256],
+                        help="Cutout sizes; inference is only timed at the input size of the model "
+                             "(256 pixels for the dummy package).")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of timed calls of each stage.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the simulated sources.")
+    parser.add_argument("--max-cutout-bytes", type=int, default=2 << 30,
+                        help="Memory budget of the cutouts extracted and scored at once; larger "
+                             "catalogs are truncated.")
+    parser.add_argument("--max-per-source", type=int, default=1000,
+                        help="Maximum number of sources to extract one by one.")
+    parser.add_argument("--output", help="File to write the results to; standard output by default.")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Largest allowed relative slowdown with respect to the baseline.")
+    return parser
+
+
+def main(argv=None):
+    args = build_argument_parser().parse_args(argv)
+
+    results = []
+    for cutout_size in args.cutout_sizes:
+        results.extend(benchmark_model_load(cutout_size, args.repeats))
+    for n_sources in args.sources:
+        print(f"Simulating {n_sources} sources...", file=sys.stderr)
+        exposure, catalog = make_dataset(n_sources, args.seed)
+        for cutout_size in args.cutout_sizes:
+            print(f"Benchmarking {n_sources} sources with {cutout_size}x{cutout_size} cutouts...",
+                  file=sys.stderr)
+            results.extend(benchmark_scoring(exposure, catalog, cutout_size, args.repeats,
+                                             args.max_cutout_bytes, args.max_per_source))
+
+    report = {"environment": environment(), "arguments": vars(args), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
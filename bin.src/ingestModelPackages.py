@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+import sys
+
+from lsst.meas.transiNet.scripts.ingestModelPackages import main
+
+sys.exit(main())
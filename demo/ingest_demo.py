@@ -4,8 +4,15 @@
 
 from lsst.meas.transiNet.modelPackages.nnModelPackage import NNModelPackage
 from lsst.meas.transiNet.modelPackages.storageAdapterButler import StorageAdapterButler
+from lsst.meas.transiNet.modelPackages.storageAdapterLocal import StorageAdapterLocal
 
 from lsst.daf.butler import Butler
 butler = Butler("./workspace/repo/", writeable=True)
 local_model_package = NNModelPackage('dummy', 'local')
 StorageAdapterButler.ingest(local_model_package, butler)
+
+# Whole directories of model packages can be ingested at once; packages that
+# were already ingested this way are skipped. The same is available from the
+# command line, as ingestModelPackages.py. The 'dummy' package ingested above
+# is replaced, as it was not ingested with its digests.
+StorageAdapterButler.ingest_directory(StorageAdapterLocal.get_base_path(), butler, replace=True)
@@ -21,5 +21,7 @@
 
 from .version import *  # Generated by sconsUtils
 
+from .cpuSettings import *
+from .stageTimers import *
 from .rbTransiNetInterface import *
 from .rbTransiNetTask import *
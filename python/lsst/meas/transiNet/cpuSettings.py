@@ -0,0 +1,145 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["recommended_thread_settings", "apply_thread_settings"]
+
+import glob
+import os
+import re
+
+import torch
+
+
+def _parse_cpu_list(text):
+    """Parse a Linux CPU list, e.g. "0-3,8-11", into a list of CPU ids.
+    """
+    cpus = []
+    for part in text.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def _available_cpus_by_node():
+    """Return the CPUs this process may run on, grouped by NUMA node.
+
+    Returns
+    -------
+    nodes : `list` [`list` [`int`]]
+        Available CPU ids of each NUMA node that has any. A single group of
+        all available CPUs if the NUMA topology cannot be read.
+    """
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+        else list(range(os.cpu_count() or 1))
+
+    nodes = []
+    node_dirs = glob.glob('/sys/devices/system/node/node[0-9]*')
+    for node_dir in sorted(node_dirs, key=lambda d: int(re.search(r'(\d+)$', d).group(1))):
+        try:
+            with open(os.path.join(node_dir, 'cpulist')) as f:
+                cpus = set(_parse_cpu_list(f.read()))
+        except (OSError, ValueError):
+            return [available]
+        node_cpus = [cpu for cpu in available if cpu in cpus]
+        if node_cpus:
+            nodes.append(node_cpus)
+
+    return nodes or [available]
+
+
+def recommended_thread_settings(n_workers, worker_index=None):
+    """Return thread settings that share the CPUs of this node evenly among
+    a number of concurrent worker processes.
+
+    Parameters
+    ----------
+    n_workers : `int`
+        Number of processes running inference concurrently on this node.
+    worker_index : `int`, optional
+        Index of this process among the workers, in [0, ``n_workers``). If
+        given, a set of CPUs is also reserved for this worker, taken from as
+        few NUMA nodes as possible.
+
+    Returns
+    -------
+    settings : `dict`
+        Values for the ``numThreads``, ``numInteropThreads`` and
+        ``cpuAffinity`` fields of `RBTransiNetConfig`, e.g. to be passed to
+        ``config.update(**settings)``.
+    """
+    if n_workers < 1:
+        raise ValueError(f"Invalid number of workers: {n_workers}.")
+    if worker_index is not None and not 0 <= worker_index < n_workers:
+        raise ValueError(f"Invalid worker index {worker_index} for {n_workers} workers.")
+
+    # Listing the CPUs node by node makes each contiguous block of CPUs
+    # local to one node whenever the per-worker share divides the node size.
+    cpus = [cpu for node in _available_cpus_by_node() for cpu in node]
+    per_worker = max(1, len(cpus) // n_workers)
+
+    cpu_affinity = None
+    if worker_index is not None:
+        start = (worker_index * per_worker) % len(cpus)
+        cpu_affinity = cpus[start:start + per_worker]
+
+    return {'numThreads': per_worker,
+            # Our networks are sequential; one inter-op thread avoids
+            # spawning a second pool per process.
+            'numInteropThreads': 1,
+            'cpuAffinity': cpu_affinity}
+
+
+def apply_thread_settings(num_threads=0, num_interop_threads=0, cpu_affinity=None, log=None):
+    """Apply PyTorch thread settings and CPU pinning to this process.
+
+    Parameters
+    ----------
+    num_threads : `int`, optional
+        Number of intra-op threads; 0 keeps the current setting.
+    num_interop_threads : `int`, optional
+        Number of inter-op threads; 0 keeps the current setting.
+    cpu_affinity : `list` [`int`], optional
+        CPUs to restrict this process to; `None` or empty keeps the current
+        affinity.
+    log : `logging.Logger`, optional
+        Logger to report settings that could not be applied.
+    """
+    if cpu_affinity:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpu_affinity)
+        elif log is not None:
+            log.warning("CPU affinity is not supported on this platform; ignoring cpuAffinity.")
+
+    if num_threads > 0 and torch.get_num_threads() != num_threads:
+        torch.set_num_threads(num_threads)
+
+    if num_interop_threads > 0 and torch.get_num_interop_threads() != num_interop_threads:
+        # This can only be set once per process, before any inter-op
+        # parallel work has started.
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            if log is not None:
+                log.warning("Could not set the number of inter-op threads to %d: %s",
+                            num_interop_threads, e)
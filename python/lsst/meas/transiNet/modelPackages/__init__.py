@@ -20,5 +20,12 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from .nnModelPackage import *
+from .modelCache import *
+from .quantization import *
+from .inferenceBackends import *
+from .checkpointFiles import *
+from .sharedWeights import *
+from .packageCache import *
+from .packageIndex import *
 from .utils import *
 from .formatters import *
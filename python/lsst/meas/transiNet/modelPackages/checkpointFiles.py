@@ -0,0 +1,279 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["BufferReader", "map_file", "is_safetensors", "save_safetensors", "load_safetensors",
+           "read_safetensors_metadata", "load_checkpoint"]
+
+import io
+import json
+import mmap
+import struct
+
+import torch
+
+_safetensors_dtypes = {
+    'F64': torch.float64,
+    'F32': torch.float32,
+    'F16': torch.float16,
+    'BF16': torch.bfloat16,
+    'I64': torch.int64,
+    'I32': torch.int32,
+    'I16': torch.int16,
+    'I8': torch.int8,
+    'U8': torch.uint8,
+    'BOOL': torch.bool,
+}
+_safetensors_names = {dtype: name for name, dtype in _safetensors_dtypes.items()}
+
+
+class BufferReader(io.RawIOBase):
+    """A read-only file over an existing buffer.
+
+    Unlike `io.BytesIO`, the buffer is not copied, so that e.g. a memory
+    mapped file or a slice of a larger in-memory file can be read as a file
+    of its own. ``getbuffer`` and ``getvalue`` behave as those of
+    `io.BytesIO`.
+
+    Parameters
+    ----------
+    buffer : bytes-like object
+        The contents of the file.
+    """
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._position))
+        b[:n] = self._view[self._position:self._position + n]
+        self._position += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._position = offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def getbuffer(self):
+        return self._view
+
+    def getvalue(self):
+        return self._view.tobytes()
+
+
+def map_file(filename):
+    """Map a file into memory, copy-on-write.
+
+    All processes mapping the same file share its pages in the page cache,
+    as long as they do not write to them.
+
+    Parameters
+    ----------
+    filename : `str`
+        Path of the file.
+
+    Returns
+    -------
+    mapped : `BufferReader`
+        The mapped file; its buffer is writable, although writes never
+        reach the file.
+    """
+    with open(filename, 'rb') as f:
+        if f.seek(0, io.SEEK_END) == 0:
+            return BufferReader(b'')
+        return BufferReader(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+
+
+def is_safetensors(buffer):
+    """Return whether a buffer holds a safetensors file.
+
+    Parameters
+    ----------
+    buffer : bytes-like object
+        The start of the file, at least 9 bytes.
+    """
+    # An 8-byte header length, followed by the JSON header.
+    return bytes(memoryview(buffer)[8:9]) == b'{'
+
+
+def save_safetensors(tensors, f, metadata=None):
+    """Save tensors in the safetensors format.
+
+    Tensors are laid out by decreasing element size, after a header padded
+    to 8 bytes, so that every tensor is aligned when the file is mapped.
+
+    Parameters
+    ----------
+    tensors : `dict` [`str`, `torch.Tensor`]
+        Tensors to save, e.g. the state dict of a model.
+    f : file-like object
+        Binary file to write to.
+    metadata : `dict` [`str`, `str`], optional
+        Free-form metadata to store in the header.
+    """
+    tensors = {name: tensor.detach().cpu().contiguous() for name, tensor in tensors.items()}
+    names = sorted(tensors, key=lambda name: -tensors[name].element_size())
+
+    header = {}
+    offset = 0
+    for name in names:
+        tensor = tensors[name]
+        nbytes = tensor.numel() * tensor.element_size()
+        header[name] = {'dtype': _safetensors_names[tensor.dtype],
+                        'shape': list(tensor.shape),
+                        'data_offsets': [offset, offset + nbytes]}
+        offset += nbytes
+    if metadata:
+        header['__metadata__'] = {str(key): str(value) for key, value in metadata.items()}
+
+    encoded = json.dumps(header, separators=(',', ':')).encode()
+    encoded += b' ' * (-len(encoded) % 8)
+    f.write(struct.pack('<Q', len(encoded)))
+    f.write(encoded)
+    for name in names:
+        if tensors[name].numel() > 0:
+            f.write(tensors[name].reshape(-1).view(torch.uint8).numpy().data)
+
+
+def load_safetensors(buffer):
+    """Load tensors from a safetensors file, without copying their data.
+
+    Parameters
+    ----------
+    buffer : bytes-like object
+        The file contents, e.g. the buffer of a `map_file` result. It must
+        be writable, and outlive the returned tensors.
+
+    Returns
+    -------
+    tensors : `dict` [`str`, `torch.Tensor`]
+        Tensors sharing their memory with ``buffer``.
+    """
+    view = memoryview(buffer).cast('B')
+    header_size, = struct.unpack_from('<Q', view, 0)
+    header = json.loads(bytes(view[8:8 + header_size]))
+    header.pop('__metadata__', None)
+
+    start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        dtype = _safetensors_dtypes[info['dtype']]
+        begin, end = info['data_offsets']
+        if end == begin:
+            tensors[name] = torch.empty(info['shape'], dtype=dtype)
+            continue
+        count = (end - begin) // dtype.itemsize
+        tensors[name] = torch.frombuffer(view, dtype=dtype, count=count,
+                                         offset=start + begin).reshape(info['shape'])
+    return tensors
+
+
+def read_safetensors_metadata(buffer):
+    """Return the metadata of a safetensors file, after checking that its
+    header is consistent with its size.
+
+    Only the header is read, so this is cheap even for large files.
+
+    Parameters
+    ----------
+    buffer : bytes-like object
+        The file contents.
+
+    Returns
+    -------
+    metadata : `dict` [`str`, `str`] or `None`
+        The metadata of the file, or `None` if it is not a valid
+        safetensors file, e.g. because it was truncated.
+    """
+    view = memoryview(buffer).cast('B')
+    try:
+        header_size, = struct.unpack_from('<Q', view, 0)
+        header = json.loads(bytes(view[8:8 + header_size]))
+        metadata = header.pop('__metadata__', {})
+        data_size = len(view) - 8 - header_size
+        for info in header.values():
+            begin, end = info['data_offsets']
+            dtype = _safetensors_dtypes[info['dtype']]
+            count = 1
+            for dim in info['shape']:
+                count *= dim
+            if not 0 <= begin <= end <= data_size or end - begin != count * dtype.itemsize:
+                return None
+    except (struct.error, ValueError, TypeError, KeyError, AttributeError):
+        return None
+    return metadata
+
+
+def load_checkpoint(source, device='cpu'):
+    """Load a model checkpoint, sharing memory with its file when possible.
+
+    Safetensors files are used in place. PyTorch checkpoints given by path
+    are memory mapped; others are read into tensors, without decompression
+    if they were stored uncompressed.
+
+    Parameters
+    ----------
+    source : `str` or file-like object
+        Path of the checkpoint, or a file with a ``getbuffer`` method, e.g.
+        `io.BytesIO` or `BufferReader`.
+    device : `str`, optional
+        Device to load the weights on.
+
+    Returns
+    -------
+    network_data : `dict`
+        The checkpoint contents; safetensors checkpoints give a single
+        ``model_state_dict`` entry.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            start = f.read(9)
+        if not is_safetensors(start):
+            try:
+                return torch.load(source, map_location=device, weights_only=True, mmap=True)
+            except RuntimeError:
+                # Checkpoints in the legacy (non-zip) format cannot be mapped.
+                return torch.load(source, map_location=device, weights_only=True)
+        source = map_file(source)
+    elif not is_safetensors(source.getbuffer()):
+        source.seek(0)
+        return torch.load(source, map_location=device, weights_only=True)
+
+    state_dict = load_safetensors(source.getbuffer())
+    if device != 'cpu':
+        state_dict = {name: tensor.to(device) for name, tensor in state_dict.items()}
+    return {'model_state_dict': state_dict}
@@ -3,6 +3,8 @@ from lsst.resources import ResourcePath
 from io import BytesIO
 from typing import Any
 
+from .checkpointFiles import map_file
+
 __all__ = ["NNModelPackageFormatter", "NNModelPackagePayload"]
 
 
@@ -10,6 +12,9 @@ class NNModelPackagePayload():
     """A thin wrapper around the payload of a NNModelPackageFormatter,
     which simply carries an in-memory file between the formatter and the
     storage adapter of model pacakges.
+
+    The file is an `io.BytesIO`, or a `BufferReader` over a memory mapped
+    file.
     """
     def __init__(self):
         self.bytes = BytesIO()
@@ -39,7 +44,12 @@ class NNModelPackageFormatter(FormatterV2):
             The requested data as a Python object.
         """
         payload = NNModelPackagePayload()
-        payload.bytes = BytesIO(uri.read())
+        if uri.isLocal:
+            # Map local files, so that uncompressed members, e.g. the
+            # weights, are shared by all processes reading the package.
+            payload.bytes = map_file(uri.ospath)
+        else:
+            payload.bytes = BytesIO(uri.read())
         return payload
 
     def to_bytes(self, in_memory_dataset: Any) -> bytes:
@@ -0,0 +1,178 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["inference_backends", "register_inference_backend", "OnnxRuntimeModel", "export_onnx"]
+
+import logging
+import os
+
+import numpy as np
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+_log = logging.getLogger(__name__)
+
+inference_backends = {}
+"""Loaders of the inference backends other than PyTorch itself, keyed by
+backend name (`dict`).
+
+Each loader is called as ``loader(model_package, device)`` and returns a
+callable model that maps a (N, 3, height, width) float32 tensor of inputs
+to a tensor of N scores, and has an ``eval`` method. Models that are not
+a `torch.nn.Module` should have an ``nbytes`` attribute giving their size,
+e.g. for the limits of `ModelCache`. PyTorch (``torch``) is built into
+`NNModelPackage.load` and is the default.
+"""
+
+
+def register_inference_backend(name, loader):
+    """Make an inference backend available to `NNModelPackage.load`.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the backend, e.g. the value of a task config field.
+    loader : callable
+        Function creating the model of a package; see
+        ``inference_backends``.
+    """
+    if name == 'torch':
+        raise ValueError("The 'torch' backend is built in and cannot be replaced.")
+    inference_backends[name] = loader
+
+
+class OnnxRuntimeModel:
+    """A model run by ONNX Runtime, called like a PyTorch model.
+
+    Only CPU inference is supported. The model itself does not need
+    PyTorch: it scores numpy arrays as well as tensors.
+
+    Parameters
+    ----------
+    model_bytes : `bytes`
+        The serialized ONNX graph, e.g. as written by
+        `NNModelPackage.build_onnx`.
+    num_threads : `int`, optional
+        Number of intra-op threads of the session; chosen by ONNX Runtime
+        by default.
+
+    Attributes
+    ----------
+    nbytes : `int`
+        Size of the serialized graph, which holds the weights of the model,
+        as an estimate of the memory used by the session.
+    """
+
+    def __init__(self, model_bytes, num_threads=None):
+        if onnxruntime is None:
+            raise ImportError("The onnxruntime inference backend needs the onnxruntime package.")
+
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(model_bytes, sess_options=options,
+                                                    providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.nbytes = len(model_bytes)
+
+    def __call__(self, blob):
+        """Score a batch of inputs.
+
+        Parameters
+        ----------
+        blob : `numpy.ndarray` or `torch.Tensor`
+            Inputs, of shape (N, 3, height, width).
+
+        Returns
+        -------
+        scores : `numpy.ndarray` or `torch.Tensor`
+            Scores of the inputs, of the type of ``blob``.
+        """
+        if isinstance(blob, np.ndarray):
+            return self._run(blob)
+        # Tensors can only come from an existing PyTorch installation.
+        import torch
+        return torch.from_numpy(self._run(blob.detach().cpu().numpy()))
+
+    def _run(self, inputs):
+        return self.session.run(None, {self.input_name: inputs.astype(np.float32, copy=False)})[0]
+
+    def eval(self):
+        """Return the model, which is always in inference mode, as
+        `torch.nn.Module.eval` does.
+        """
+        return self
+
+
+def _load_onnxruntime_model(model_package, device):
+    """Create the ONNX Runtime model of a package, from its ``onnx``
+    component if it has one, or else by exporting its PyTorch model.
+    """
+    import torch
+
+    if device != 'cpu':
+        raise ValueError("The onnxruntime backend can only run on cpu, not %s" % device)
+
+    model_bytes = model_package.adapter.load_onnx()
+    if model_bytes is None:
+        _log.warning("Model package %s has no ONNX graph; exporting one from its PyTorch model on "
+                     "every load, which is slow. Store it in the package with export_onnx.",
+                     model_package.model_package_name)
+        model_bytes = model_package.build_onnx().getvalue()
+    # Use as many threads as PyTorch does, so that ``numThreads`` and
+    # related settings of the task apply to both backends.
+    return OnnxRuntimeModel(model_bytes, num_threads=torch.get_num_threads())
+
+
+register_inference_backend('onnxruntime', _load_onnxruntime_model)
+
+
+def export_onnx(model_package, filename=None):
+    """Export the model of a package to ONNX, and store it as the ``onnx``
+    component of that package.
+
+    Parameters
+    ----------
+    model_package : `NNModelPackage`
+        The model package to export.
+    filename : `str`, optional
+        Path of the ONNX file to write. Defaults to a ``<name>.onnx`` file in
+        the package directory. Ignored for butler packages, whose in-memory
+        copy gets the graph as an additional member, to be stored by
+        `StorageAdapterButler.to_payload` or ``ingest``.
+
+    Returns
+    -------
+    destination : `str` or `io.BytesIO`
+        Where the graph was written.
+    """
+    adapter = model_package.adapter
+    if hasattr(adapter, 'optional_files'):
+        adapter.optional_files['onnx'] = model_package.build_onnx()
+        return adapter.optional_files['onnx']
+
+    if filename is None:
+        filename = os.path.join(os.path.dirname(adapter.model_filename),
+                                model_package.model_package_name + '.onnx')
+    return model_package.build_onnx(filename)
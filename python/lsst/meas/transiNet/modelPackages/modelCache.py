@@ -0,0 +1,233 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["ModelCache", "get_model_cache"]
+
+import collections
+import itertools
+import threading
+
+# Default of the arguments of `ModelCache.configure`, which leaves a limit
+# unchanged; `None` removes it.
+_unchanged = object()
+
+
+class ModelCache:
+    """A process-wide registry of loaded neural network models.
+
+    Loading a model package (executing the architecture module, building the
+    network and reading the checkpoint) is often more expensive than scoring
+    the sources of a single quantum. This cache keeps already-loaded models,
+    in evaluation mode, so that repeated requests for the same model package
+    on the same device are served without reloading.
+
+    Models are keyed by package name, storage mode, checkpoint digest and
+    device. Requests are first looked up by a cheap identity of the
+    checkpoint (see `make_key`), and the checkpoint is only hashed when its
+    identity is not known yet, so that packages with the same weights share
+    one model. Models are evicted in least-recently-used order whenever either
+    the number of cached models or their total size exceeds the limits.
+
+    Parameters
+    ----------
+    max_entries : `int`, optional
+        Maximum number of models to keep. `None` means no limit.
+    max_bytes : `int`, optional
+        Maximum total size, in bytes, of the parameters and buffers of all
+        cached models. `None` means no limit.
+    """
+
+    def __init__(self, max_entries=2, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = collections.OrderedDict()
+        # Keys made by `make_key` of the models in `_entries`, mapped to
+        # their `make_digest_key`; evicted along with the models.
+        self._aliases = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._aliases.get(key, key) in self._entries
+
+    @property
+    def nbytes(self):
+        """Total size of all cached models, in bytes (`int`).
+        """
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    @staticmethod
+    def make_key(model_package, device, **load_options):
+        """Return the cache key of a model package loaded on a device.
+
+        The checkpoint is identified by the cheap
+        `~StorageAdapterBase.get_checkpoint_identity` of the package, e.g.
+        the size and CRC-32 of a butler payload member, so that it is not
+        read.
+
+        Parameters
+        ----------
+        model_package : `NNModelPackage`
+            The model package.
+        device : `str`
+            Device the model is loaded on, e.g. 'cpu' or 'cuda:0'.
+        **load_options
+            Additional arguments of `NNModelPackage.load` used to load
+            the model.
+
+        Returns
+        -------
+        key : `tuple`
+            Hashable key identifying the loaded model.
+        """
+        return (model_package.model_package_name,
+                model_package.package_storage_mode,
+                model_package.adapter.get_checkpoint_identity(),
+                device,
+                tuple(sorted(load_options.items())))
+
+    @staticmethod
+    def make_digest_key(model_package, device, **load_options):
+        """Return the cache key of a model package loaded on a device, with
+        the checkpoint identified by its digest.
+
+        Parameters are as for `make_key`.
+
+        Returns
+        -------
+        key : `tuple`
+            Hashable key identifying the loaded model.
+        """
+        return (model_package.model_package_name,
+                model_package.package_storage_mode,
+                model_package.adapter.get_checkpoint_digest(),
+                device,
+                tuple(sorted(load_options.items())))
+
+    @staticmethod
+    def model_nbytes(model):
+        """Return the memory footprint of a model's parameters and buffers.
+
+        Parameters
+        ----------
+        model : `torch.nn.Module` or callable
+            The model to measure; models of other inference backends report
+            their size in an ``nbytes`` attribute.
+
+        Returns
+        -------
+        nbytes : `int`
+            Size in bytes.
+        """
+        if hasattr(model, 'nbytes'):
+            return model.nbytes
+        return sum(t.numel() * t.element_size()
+                   for t in itertools.chain(model.parameters(), model.buffers()))
+
+    def configure(self, max_entries=_unchanged, max_bytes=_unchanged):
+        """Change the limits of the cache, evicting models if needed.
+
+        Parameters
+        ----------
+        max_entries : `int` or `None`, optional
+            New maximum number of models; `None` means no limit. Unchanged
+            if not given.
+        max_bytes : `int` or `None`, optional
+            New maximum total size in bytes; `None` means no limit.
+            Unchanged if not given.
+        """
+        with self._lock:
+            if max_entries is not _unchanged:
+                self.max_entries = max_entries
+            if max_bytes is not _unchanged:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, model_package, device='cpu', **load_options):
+        """Return the model of a package, loading it only if not cached.
+
+        Parameters
+        ----------
+        model_package : `NNModelPackage`
+            The model package to get the model of.
+        device : `str`, optional
+            Device to load the model on, e.g. 'cpu' or 'cuda:0'.
+        **load_options
+            Additional arguments passed to `NNModelPackage.load`.
+
+        Returns
+        -------
+        model : `torch.nn.Module`
+            The loaded model, in evaluation mode. It is shared with all other
+            clients of the cache and must not be modified.
+        """
+        key = self.make_key(model_package, device, **load_options)
+        with self._lock:
+            digest_key = self._aliases.get(key)
+            if digest_key is None:
+                # Only hash the checkpoint of a package not seen before.
+                digest_key = self.make_digest_key(model_package, device, **load_options)
+            if digest_key in self._entries:
+                self._entries.move_to_end(digest_key)
+                self._aliases[key] = digest_key
+                return self._entries[digest_key][0]
+
+            model = model_package.load(device, **load_options)
+            model.eval()
+
+            self._entries[digest_key] = (model, self.model_nbytes(model))
+            self._aliases[key] = digest_key
+            self._evict()
+            return model
+
+    def clear(self):
+        """Remove all models from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._aliases.clear()
+
+    def _evict(self):
+        """Drop least recently used models until the limits are satisfied.
+        """
+        while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            digest_key, _ = self._entries.popitem(last=False)
+            self._aliases = {key: value for key, value in self._aliases.items() if value != digest_key}
+
+
+_default_cache = ModelCache()
+
+
+def get_model_cache():
+    """Return the process-wide model cache.
+
+    Returns
+    -------
+    cache : `ModelCache`
+        The cache shared by `RBTransiNetTask`, `RBTransiNetInterface` and any
+        offline client within this process.
+    """
+    return _default_cache
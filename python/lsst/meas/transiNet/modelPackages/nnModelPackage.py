@@ -21,7 +21,13 @@
 
 __all__ = ["NNModelPackage"]
 
+from .storageAdapterBase import compiled_digest_file
 from .storageAdapterFactory import StorageAdapterFactory
+from .quantization import quantization_modes, quantize_model
+from .inferenceBackends import inference_backends
+from .sharedWeights import load_shared_weights, publish_shared_weights
+
+import io
 
 import torch
 
@@ -53,7 +59,8 @@ class NNModelPackage:
 
         self.metadata = self.adapter.load_metadata()
 
-    def load(self, device):
+    def load(self, device, prefer_compiled=True, compile=False, quantization=None, backend='torch',
+             shared_weights=False):
         """Load model architecture and pretrained weights.
         This method handles all different modes of storages.
 
@@ -62,35 +69,199 @@ class NNModelPackage:
         ----------
         device : `str`
             Device to create the model on, e.g. 'cpu' or 'cuda:0'.
+        prefer_compiled : `bool`, optional
+            Whether to load the compiled model stored in the package, if
+            there is one, instead of building the model from its
+            architecture module and checkpoint.
+        compile : `bool`, optional
+            Whether to compile an eagerly-built model with `torch.compile`.
+        quantization : `str`, optional
+            Post-training int8 quantization mode (one of
+            `quantization_modes`) for CPU inference, or `None` for the float
+            model. The precomputed quantized model of the package is used
+            when there is one; otherwise the model is quantized on load,
+            calibrated on the package's reference inputs if needed.
+        backend : `str`, optional
+            Inference backend to run the model with: 'torch', or one of
+            `inference_backends`. Other backends ignore the options above,
+            except ``quantization``, which they do not support.
+        shared_weights : `bool`, optional
+            Whether to take the weights of a model built from its
+            architecture and checkpoint from shared memory, publishing them
+            there first if no process on this node has; see
+            `publish_shared_weights`. All processes then share one copy of
+            the weights.
 
         Returns
         -------
         model : `torch.nn.Module`
             The neural network model, loaded with pretrained weights.
             Its type should be a subclass of nn.Module, defined by
-            the architecture module.
+            the architecture module, or a `torch.jit.ScriptModule` if the
+            compiled or a precomputed quantized model was loaded, or the
+            model class of another backend.
         """
 
         # Check if the specified device is valid.
         if device not in ['cpu'] + ['cuda:%d' % i for i in range(torch.cuda.device_count())]:
             raise ValueError("Invalid device: %s" % device)
 
+        if backend != 'torch':
+            if backend not in inference_backends:
+                raise ValueError("Invalid inference backend: %s" % backend)
+            if quantization is not None:
+                raise ValueError("Quantization is only supported by the torch backend, not %s" % backend)
+            return inference_backends[backend](self, device)
+
+        if quantization is not None:
+            if quantization not in quantization_modes:
+                raise ValueError("Invalid quantization mode: %s" % quantization)
+            if device != 'cpu':
+                raise ValueError("Quantized models can only run on cpu, not %s" % device)
+
+            model = self.adapter.load_quantized(quantization)
+            if model is None:
+                model = quantize_model(self.load(device, prefer_compiled=False), quantization,
+                                       calibration_inputs=self.adapter.load_reference_inputs())
+            return model
+
+        # A compiled model already carries its weights, and needs neither
+        # the architecture module nor the checkpoint.
+        if prefer_compiled:
+            model = self.adapter.load_compiled(device)
+            if model is not None:
+                return model
+
         # Load various components.
         # Note that because of the way the StorageAdapterButler works,
         # the model architecture and the pretrained weights are loaded
         # into the cpu memory, and only then moved to the target device.
         model = self.adapter.load_arch(device='cpu')
-        network_data = self.adapter.load_weights(device='cpu')
+        state_dict = load_shared_weights(self) if shared_weights else None
+        if state_dict is None:
+            state_dict = self.adapter.load_weights(device='cpu')['model_state_dict']
+            if shared_weights:
+                publish_shared_weights(self, state_dict)
+                # Keep the private copy if the shared one cannot be used.
+                shared = load_shared_weights(self)
+                if shared is not None:
+                    state_dict = shared
 
-        # Load pretrained weights into model
-        model.load_state_dict(network_data['model_state_dict'], strict=True)
+        # Load pretrained weights into model. Assigning the loaded tensors,
+        # rather than copying them into the model's own, keeps the weights
+        # in memory mapped checkpoints shared.
+        model.load_state_dict(state_dict, strict=True, assign=True)
 
         # Move model to the specified device, if it is not already there.
         if device != 'cpu':
             model = model.to(device)
 
+        if compile:
+            model = torch.compile(model)
+
         return model
 
+    def build_compiled(self, f=None):
+        """Build a compiled version of the model, to be stored as the
+        ``compiled`` component of a model package.
+
+        The model is traced on a blank input of the package's input shape
+        and frozen, so that its weights become constants of the graph. The
+        digest of the checkpoint is recorded along with it, so that a stale
+        compiled model is never loaded instead of an updated checkpoint.
+
+        Parameters
+        ----------
+        f : `str` or file-like object, optional
+            Where to save the compiled model, e.g. the path of a
+            ``*.torchscript`` file in the package directory.
+
+        Returns
+        -------
+        f : `str` or file-like object
+            ``f``, or a new `io.BytesIO` holding the compiled model if ``f``
+            was not given.
+        """
+        model = self.load('cpu', prefer_compiled=False)
+        model.eval()
+
+        height, width, channels = self.get_model_input_shape()
+        example = torch.zeros((1, channels, height, width), dtype=torch.float32)
+        with torch.no_grad():
+            compiled = torch.jit.freeze(torch.jit.trace(model, example))
+
+        if f is None:
+            f = io.BytesIO()
+        torch.jit.save(compiled, f,
+                       _extra_files={compiled_digest_file: self.adapter.get_checkpoint_digest()})
+        return f
+
+    def build_quantized(self, mode, f=None):
+        """Build a quantized version of the model, to be stored as the
+        ``quantized_<mode>`` component of a model package.
+
+        As for `build_compiled`, the digest of the checkpoint is recorded
+        along with it.
+
+        Parameters
+        ----------
+        mode : `str`
+            Quantization mode; one of `quantization_modes`.
+        f : `str` or file-like object, optional
+            Where to save the quantized model, e.g. the path of a
+            ``*.<mode>.qtorchscript`` file in the package directory.
+
+        Returns
+        -------
+        f : `str` or file-like object
+            ``f``, or a new `io.BytesIO` holding the quantized model if ``f``
+            was not given.
+        """
+        model = quantize_model(self.load('cpu', prefer_compiled=False), mode,
+                               calibration_inputs=self.adapter.load_reference_inputs())
+
+        height, width, channels = self.get_model_input_shape()
+        example = torch.zeros((1, channels, height, width), dtype=torch.float32)
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+
+        if f is None:
+            f = io.BytesIO()
+        torch.jit.save(traced, f, _extra_files={compiled_digest_file: self.adapter.get_checkpoint_digest()})
+        return f
+
+    def build_onnx(self, f=None):
+        """Export the model to ONNX, to be stored as the ``onnx`` component
+        of a model package.
+
+        The graph takes a float32 input of shape (N, 3, height, width), with
+        a variable batch size N.
+
+        Parameters
+        ----------
+        f : `str` or file-like object, optional
+            Where to save the graph, e.g. the path of a ``*.onnx`` file in
+            the package directory.
+
+        Returns
+        -------
+        f : `str` or file-like object
+            ``f``, or a new `io.BytesIO` holding the graph if ``f`` was not
+            given.
+        """
+        model = self.load('cpu', prefer_compiled=False)
+        model.eval()
+
+        height, width, channels = self.get_model_input_shape()
+        example = torch.zeros((1, channels, height, width), dtype=torch.float32)
+
+        if f is None:
+            f = io.BytesIO()
+        with torch.no_grad():
+            torch.onnx.export(model, (example,), f, input_names=['input'], output_names=['score'],
+                              dynamic_axes={'input': {0: 'batch'}, 'score': {0: 'batch'}}, dynamo=False)
+        return f
+
     def get_model_input_shape(self):
         """ Return the input shape of the model.
 
@@ -125,16 +296,16 @@ class NNModelPackage:
 
     def get_boost_factor(self):
         """
-        Return the boost factor to be applied to the output data.
+        Return the boost factor to be applied to the input data, on top of
+        the per-channel scale factors.
 
-        If the boost factor is not found in the metadata, return None.
         It is the responsibility of the client to know whether this type
         of model requires a boost factor or not.
 
         Returns
         -------
         boost_factor : `float`
-            The boost factor to be applied to the output data.
+            The boost factor to be applied to the input data.
 
         Raises
         ------
@@ -142,3 +313,19 @@ class NNModelPackage:
             If the boost factor is not found in the metadata.
         """
         return self.metadata['boost_factor']
+
+    def expects_normalized_input(self):
+        """
+        Return whether the model expects its input to be already scaled by
+        the input scale factors (and the boost factor, if any).
+
+        Models that declare ``expects_normalized_input: true`` in their
+        metadata leave the normalization to their client, instead of doing
+        it in their own ``forward`` method.
+
+        Returns
+        -------
+        expects_normalized_input : `bool`
+            `False` if not declared in the metadata.
+        """
+        return bool(self.metadata.get('expects_normalized_input', False))
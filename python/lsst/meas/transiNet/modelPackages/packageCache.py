@@ -0,0 +1,213 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["PackageCache", "get_default_package_cache"]
+
+import glob
+import hashlib
+import os
+import tempfile
+
+from .checkpointFiles import map_file
+from .formatters import NNModelPackagePayload
+
+
+class PackageCache:
+    """A local directory of model package payloads fetched from a butler
+    repository, shared by all processes using it.
+
+    Payloads are stored as ``<dataset id>.<sha256>.zip`` files, i.e. keyed
+    by the UUID of their dataset and the checksum of their contents. Files
+    are written atomically, so concurrent processes never see partial
+    payloads, and the least recently used payloads are evicted whenever the
+    total size of the cache exceeds its limit.
+
+    Parameters
+    ----------
+    directory : `str`
+        Directory of the cache; created if needed.
+    max_bytes : `int`, optional
+        Maximum total size of the cached payloads, in bytes. `None` means no
+        limit.
+    verify : `bool`, optional
+        Whether to check the checksum of payloads read from the cache, and
+        discard corrupted ones.
+    """
+
+    def __init__(self, directory, max_bytes=None, verify=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.verify = verify
+        os.makedirs(directory, exist_ok=True)
+
+    def find(self, dataset_id):
+        """Return the path of the cached payload of a dataset, if any.
+
+        Parameters
+        ----------
+        dataset_id : `uuid.UUID` or `str`
+            Dataset id of the model package.
+
+        Returns
+        -------
+        path : `str` or `None`
+            Path of the payload file, or `None` if it is not cached.
+        """
+        paths = glob.glob(os.path.join(self.directory, f'{dataset_id}.*.zip'))
+        for path in sorted(paths, key=self._mtime, reverse=True):
+            if not self.verify or self._checksum(path) == path.rsplit('.', 2)[-2]:
+                return path
+            self._remove(path)
+        return None
+
+    def get(self, dataset_id):
+        """Return the cached payload of a dataset, if any.
+
+        Parameters
+        ----------
+        dataset_id : `uuid.UUID` or `str`
+            Dataset id of the model package.
+
+        Returns
+        -------
+        payload : `NNModelPackagePayload` or `None`
+            The payload, memory mapped from the cache, or `None` if it is not
+            cached.
+        """
+        path = self.find(dataset_id)
+        if path is None:
+            return None
+        try:
+            payload = NNModelPackagePayload()
+            payload.bytes = map_file(path)
+            # Mark it as recently used.
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime.
+            return None
+        return payload
+
+    def put(self, dataset_id, payload):
+        """Add the payload of a dataset to the cache.
+
+        Parameters
+        ----------
+        dataset_id : `uuid.UUID` or `str`
+            Dataset id of the model package.
+        payload : `NNModelPackagePayload`
+            The payload, as returned by the butler.
+
+        Returns
+        -------
+        path : `str`
+            Path of the cached payload file.
+        """
+        data = payload.bytes.getbuffer()
+        path = os.path.join(self.directory, f'{dataset_id}.{hashlib.sha256(data).hexdigest()}.zip')
+        if not os.path.exists(path):
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+            except BaseException:
+                self._remove(tmp_path)
+                raise
+        else:
+            os.utime(path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """Remove the least recently used payloads until the cache fits in
+        ``max_bytes``.
+
+        Processes still reading an evicted payload are not affected.
+
+        Parameters
+        ----------
+        keep : `str`, optional
+            Path of a payload never to evict, e.g. the one just added.
+        """
+        if self.max_bytes is None:
+            return
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.zip')):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # Evicted by another process.
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                self._remove(path)
+                total -= size
+
+    def clear(self):
+        """Remove all payloads from the cache.
+        """
+        for path in glob.glob(os.path.join(self.directory, '*.zip')):
+            self._remove(path)
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except FileNotFoundError:
+            return 0.0
+
+    @staticmethod
+    def _checksum(path):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def get_default_package_cache():
+    """Return the package cache configured by the environment, if any.
+
+    The cache directory is given by ``MEAS_TRANSINET_PACKAGE_CACHE``, and
+    its optional size limit, in bytes, by
+    ``MEAS_TRANSINET_PACKAGE_CACHE_MAX_BYTES``.
+
+    Returns
+    -------
+    cache : `PackageCache` or `None`
+        The cache, or `None` if no cache directory is configured.
+    """
+    directory = os.environ.get('MEAS_TRANSINET_PACKAGE_CACHE')
+    if not directory:
+        return None
+    max_bytes = os.environ.get('MEAS_TRANSINET_PACKAGE_CACHE_MAX_BYTES')
+    return PackageCache(directory, max_bytes=int(max_bytes) if max_bytes else None)
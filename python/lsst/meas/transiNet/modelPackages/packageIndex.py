@@ -0,0 +1,299 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["index_filename", "scan_package", "indexed_sha256", "build_package_index", "write_package_index",
+           "read_package_index", "find_package_files", "list_packages"]
+
+import glob
+import hashlib
+import os
+import tempfile
+
+import yaml
+
+index_filename = 'index.yaml'
+"""Name of the package index file at the root of a model packages
+directory (`str`).
+"""
+
+_required_components = {
+    'architecture': ('arch*.py',),
+    'checkpoint': ('*.pt', '*.safetensors'),
+    'metadata': ('meta*.yaml',),
+}
+
+# Indexes already read, keyed by path, with the (size, modification time)
+# of the index file they were read from.
+_index_memo = {}
+
+
+def scan_package(dir_name, optional_components):
+    """Find the files of a model package by scanning its directory.
+
+    Parameters
+    ----------
+    dir_name : `str`
+        Directory of the model package.
+    optional_components : `dict` [`str`, `str`]
+        File name pattern of each optional component, e.g.
+        `StorageAdapterBase.optional_components`.
+
+    Returns
+    -------
+    files : `dict` [`str`, `str`]
+        Full path of the ``architecture``, ``checkpoint`` and ``metadata``
+        files, and of each optional component found.
+
+    Raises
+    ------
+    RuntimeError
+        If there is not exactly one file for each required component, or
+        more than one for an optional component.
+    """
+    # We do not assume default file names in directory-based modes.
+    # For now we rely on a hacky pattern matching approach:
+    # There should be one and only one file named arch*.py under the dir.
+    # There should be one and only one file named *.pt or *.safetensors
+    # under the dir.
+    # There should be one and only one file named meta*.yaml under the dir.
+    files = {}
+    for component, patterns in _required_components.items():
+        filenames = [filename for pattern in patterns
+                     for filename in glob.glob(os.path.join(dir_name, pattern))]
+        if len(filenames) != 1:
+            raise RuntimeError(f"Found {len(filenames)} {component} files, "
+                               f"expected 1 in {dir_name}.")
+        files[component] = filenames[0]
+
+    for component, pattern in optional_components.items():
+        filenames = glob.glob(os.path.join(dir_name, pattern))
+        if len(filenames) > 1:
+            raise RuntimeError(f"Found {len(filenames)} {component} files, "
+                               f"expected at most 1 in {dir_name}.")
+        if filenames:
+            files[component] = filenames[0]
+    return files
+
+
+def _sha256(filename):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _is_current(info, stat):
+    """Return whether an indexed file is unchanged since it was indexed,
+    judging by its size and modification time.
+
+    Parameters
+    ----------
+    info : `dict`
+        Index entry of the file; see `build_package_index`.
+    stat : `os.stat_result`
+        Status of the file.
+
+    Returns
+    -------
+    current : `bool`
+        Whether the digest recorded in ``info`` can be trusted.
+    """
+    return (stat.st_size, stat.st_mtime_ns) == (info.get('size'), info.get('mtime_ns'))
+
+
+def indexed_sha256(filename, info=None):
+    """Return the SHA-256 digest of a package file, from its index entry if
+    the file is unchanged since it was indexed.
+
+    Parameters
+    ----------
+    filename : `str`
+        Path of the file.
+    info : `dict`, optional
+        Index entry of the file, if any; see `build_package_index`.
+
+    Returns
+    -------
+    digest : `str`
+        Hexadecimal digest of the file; it is recomputed if the file was
+        modified after being indexed.
+    """
+    if info is not None and _is_current(info, os.stat(filename)):
+        return info['sha256']
+    return _sha256(filename)
+
+
+def build_package_index(root, optional_components):
+    """Scan all model packages under a directory.
+
+    Parameters
+    ----------
+    root : `str`
+        The model packages directory, holding one subdirectory per package.
+    optional_components : `dict` [`str`, `str`]
+        File name pattern of each optional component.
+
+    Returns
+    -------
+    index : `dict`
+        ``packages``, mapping each package name to its components, each
+        described by its ``file`` name (relative to the package directory),
+        ``size``, modification time ``mtime_ns`` and ``sha256`` digest. The
+        digest is only trusted while the size and modification time of the
+        file are unchanged. Directories that are not valid
+        packages are skipped.
+    """
+    packages = {}
+    for entry in sorted(os.scandir(root), key=lambda entry: entry.name):
+        if not entry.is_dir():
+            continue
+        try:
+            files = scan_package(entry.path, optional_components)
+        except RuntimeError:
+            continue
+        packages[entry.name] = {component: _index_file(filename) for component, filename in files.items()}
+    return {'packages': packages}
+
+
+def _index_file(filename):
+    """Return the index entry of a package file.
+    """
+    stat = os.stat(filename)
+    digest = _sha256(filename)
+    if os.stat(filename).st_mtime_ns != stat.st_mtime_ns:
+        # Never record a digest with the time of an earlier version.
+        raise RuntimeError(f"{filename} was modified while being indexed.")
+    return {'file': os.path.basename(filename), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha256': digest}
+
+
+def write_package_index(root, optional_components):
+    """Generate the index of a model packages directory.
+
+    The index must be regenerated whenever packages are added, removed or
+    modified; packages missing from it are still found by scanning.
+
+    Parameters
+    ----------
+    root : `str`
+        The model packages directory.
+    optional_components : `dict` [`str`, `str`]
+        File name pattern of each optional component.
+
+    Returns
+    -------
+    filename : `str`
+        Path of the index file.
+    """
+    filename = os.path.join(root, index_filename)
+    index = build_package_index(root, optional_components)
+    fd, tmp_filename = tempfile.mkstemp(dir=root, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            yaml.safe_dump(index, f, sort_keys=False)
+        os.chmod(tmp_filename, 0o644)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+    return filename
+
+
+def read_package_index(root):
+    """Read the index of a model packages directory, if it has one.
+
+    Parameters
+    ----------
+    root : `str`
+        The model packages directory.
+
+    Returns
+    -------
+    index : `dict` or `None`
+        The index, as written by `write_package_index`, or `None` if there
+        is none.
+    """
+    filename = os.path.join(root, index_filename)
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    memo_key = (stat.st_size, stat.st_mtime_ns)
+    if _index_memo.get(filename, (None, None))[0] != memo_key:
+        with open(filename) as f:
+            _index_memo[filename] = (memo_key, yaml.safe_load(f))
+    return _index_memo[filename][1]
+
+
+def find_package_files(root, model_package_name, optional_components):
+    """Return the files of a model package, from the index of its root
+    directory if possible.
+
+    Parameters
+    ----------
+    root : `str`
+        The model packages directory.
+    model_package_name : `str`
+        Name of the package.
+    optional_components : `dict` [`str`, `str`]
+        File name pattern of each optional component.
+
+    Returns
+    -------
+    files : `dict` [`str`, `str`]
+        Full path of each component file; see `scan_package`.
+    entry : `dict` or `None`
+        The index entry of the package, or `None` if it is not indexed and
+        its directory was scanned.
+
+    Raises
+    ------
+    RuntimeError
+        If the package is not indexed and its directory is not a valid
+        model package.
+    """
+    dir_name = os.path.join(root, model_package_name)
+    index = read_package_index(root)
+    entry = index['packages'].get(model_package_name) if index is not None else None
+    if entry is None:
+        return scan_package(dir_name, optional_components), None
+    return {component: os.path.join(dir_name, info['file']) for component, info in entry.items()}, entry
+
+
+def list_packages(root):
+    """Return the names of the model packages in a directory.
+
+    Parameters
+    ----------
+    root : `str`
+        The model packages directory.
+
+    Returns
+    -------
+    names : `list` [`str`]
+        Names of the packages: those of the index if there is one, or else
+        of all subdirectories.
+    """
+    index = read_package_index(root)
+    if index is not None:
+        return list(index['packages'])
+    return sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
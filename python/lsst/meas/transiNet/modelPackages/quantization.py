@@ -0,0 +1,130 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["quantization_modes", "quantize_model", "quantization_report"]
+
+import copy
+
+import numpy as np
+import torch
+import torch.ao.quantization
+import torch.ao.quantization.quantize_fx
+
+quantization_modes = ('dynamic', 'static')
+"""Supported post-training int8 quantization modes (`tuple` [`str`]).
+
+``dynamic``
+    Weights of the Linear layers are stored as int8, and activations are
+    quantized on the fly.
+``static``
+    Weights and activations of all supported layers are quantized, with
+    activation ranges calibrated on a set of representative inputs.
+"""
+
+
+def _quantized_engine():
+    """Return the best available quantized CPU kernel backend.
+    """
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in torch.backends.quantized.supported_engines:
+            return engine
+    raise RuntimeError("No quantized CPU backend is available in this PyTorch build.")
+
+
+def quantize_model(model, mode, calibration_inputs=None, batch_size=64):
+    """Return an int8-quantized copy of a model, for CPU inference.
+
+    Parameters
+    ----------
+    model : `torch.nn.Module`
+        The float model; it is left unchanged.
+    mode : `str`
+        One of ``quantization_modes``.
+    calibration_inputs : `numpy.ndarray`, (N, 3, height, width), optional
+        Representative inputs, used to calibrate the activation ranges.
+        Required in the ``static`` mode.
+    batch_size : `int`, optional
+        Number of calibration inputs to run through the model at once.
+
+    Returns
+    -------
+    quantized : `torch.nn.Module`
+        The quantized model, in evaluation mode.
+
+    Raises
+    ------
+    ValueError
+        If the mode is invalid, or calibration inputs are missing.
+    """
+    model = copy.deepcopy(model).eval()
+    engine = _quantized_engine()
+    torch.backends.quantized.engine = engine
+
+    if mode == 'dynamic':
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if mode != 'static':
+        raise ValueError(f"Invalid quantization mode: {mode}")
+    if calibration_inputs is None or len(calibration_inputs) == 0:
+        raise ValueError("Static quantization needs calibration inputs, e.g. the reference cutouts "
+                         "of the model package.")
+
+    qconfig_mapping = torch.ao.quantization.get_default_qconfig_mapping(engine)
+    example = torch.from_numpy(np.ascontiguousarray(calibration_inputs[:1], dtype=np.float32))
+    prepared = torch.ao.quantization.quantize_fx.prepare_fx(model, qconfig_mapping, example_inputs=(example,))
+    with torch.no_grad():
+        for start in range(0, len(calibration_inputs), batch_size):
+            batch = calibration_inputs[start:start + batch_size]
+            prepared(torch.from_numpy(np.ascontiguousarray(batch, dtype=np.float32)))
+    return torch.ao.quantization.quantize_fx.convert_fx(prepared).eval()
+
+
+def quantization_report(float_model, quantized_model, inputs, batch_size=64):
+    """Compare the scores of a quantized model with those of its float
+    version.
+
+    Parameters
+    ----------
+    float_model : `torch.nn.Module`
+        The original model.
+    quantized_model : `torch.nn.Module`
+        The quantized model.
+    inputs : `numpy.ndarray`, (N, 3, height, width)
+        Inputs to score with both models.
+    batch_size : `int`, optional
+        Number of inputs to score at once.
+
+    Returns
+    -------
+    report : `dict`
+        ``n_inputs`` (`int`), and the ``max_abs_delta`` and
+        ``mean_abs_delta`` (`float`) of the score differences.
+    """
+    deltas = []
+    with torch.no_grad():
+        for start in range(0, len(inputs), batch_size):
+            batch = torch.from_numpy(np.ascontiguousarray(inputs[start:start + batch_size],
+                                                          dtype=np.float32))
+            deltas.append((quantized_model(batch) - float_model(batch)).abs().numpy().ravel())
+    deltas = np.concatenate(deltas) if deltas else np.zeros(0)
+    return {'n_inputs': len(deltas),
+            'max_abs_delta': float(deltas.max()) if len(deltas) else 0.0,
+            'mean_abs_delta': float(deltas.mean()) if len(deltas) else 0.0}
@@ -0,0 +1,245 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["shared_weights_path", "publish_shared_weights", "load_shared_weights",
+           "release_shared_weights"]
+
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import stat
+import tempfile
+import time
+
+from . import utils
+from .checkpointFiles import BufferReader, load_checkpoint, read_safetensors_metadata, save_safetensors
+
+_log = logging.getLogger(__name__)
+
+stale_age = 3600.0
+"""Age in seconds after which shared weights that no process is attached to
+are removed by the next publisher of other weights (`float`).
+"""
+
+# Descriptors of the shared weights this process is attached to, keyed by
+# path. Each holds a shared lock on its file for the life of the process,
+# so that the file is not removed as stale while in use.
+_attached = {}
+
+
+def _shared_weights_dir():
+    """Return the directory holding shared weights: the POSIX shared memory
+    file system if there is one, or else the temporary directory.
+    """
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def _shared_weights_prefix():
+    return f'meas_transiNet-{os.getuid()}-'
+
+
+def _checkpoint_key(model_package):
+    """Return the key of the checkpoint of a package in the names of shared
+    weights, derived from its cheap identity so that the checkpoint is not
+    read.
+    """
+    identity = model_package.adapter.get_checkpoint_identity()
+    return hashlib.sha256(repr((model_package.model_package_name, identity)).encode()).hexdigest()
+
+
+def shared_weights_path(model_package):
+    """Return the path of the shared copy of the weights of a package.
+
+    Parameters
+    ----------
+    model_package : `NNModelPackage`
+        The model package.
+
+    Returns
+    -------
+    path : `str`
+        Path of the safetensors file, named after the user and the
+        identity of the checkpoint (see
+        `~StorageAdapterBase.get_checkpoint_identity`), so that all
+        processes of a user on a node agree on it without reading the
+        checkpoint. It may not exist yet.
+    """
+    name = f'{_shared_weights_prefix()}{_checkpoint_key(model_package)}.safetensors'
+    return os.path.join(_shared_weights_dir(), name)
+
+
+def _is_private(status):
+    """Return whether a file is a regular file owned by the current user and
+    not writable by others.
+    """
+    return stat.S_ISREG(status.st_mode) and utils._is_private(status)
+
+
+def _remove_stale_shared_weights(keep):
+    """Remove the shared weights of the current user that no process is
+    attached to, and that were published more than `stale_age` ago.
+
+    Parameters
+    ----------
+    keep : `str`
+        Path of shared weights to keep regardless.
+    """
+    now = time.time()
+    for entry in os.scandir(_shared_weights_dir()):
+        if (not entry.name.startswith(_shared_weights_prefix()) or not entry.name.endswith('.safetensors')
+                or entry.path == keep):
+            continue
+        try:
+            fd = os.open(entry.path, os.O_RDONLY | os.O_NOFOLLOW)
+        except OSError:
+            continue
+        try:
+            status = os.fstat(fd)
+            if not _is_private(status) or now - status.st_mtime < stale_age:
+                continue
+            # Attached processes hold a shared lock on the file.
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            os.remove(entry.path)
+            _log.info("Removed stale shared weights %s.", entry.path)
+        except FileNotFoundError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def publish_shared_weights(model_package, state_dict=None):
+    """Place the weights of a package in shared memory, unless they are
+    there already.
+
+    Calling this in a parent process, before starting a pool of workers,
+    means no worker has to read the checkpoint itself. The file is only
+    readable by the current user. Shared weights are kept while processes
+    are attached to them (see `load_shared_weights`), and are removed by
+    the next publisher once they have been unused for `stale_age`, or by
+    `release_shared_weights`.
+
+    Parameters
+    ----------
+    model_package : `NNModelPackage`
+        The model package.
+    state_dict : `dict` [`str`, `torch.Tensor`], optional
+        The weights, if already loaded; read from the package otherwise.
+
+    Returns
+    -------
+    path : `str`
+        Path of the shared weights; see `shared_weights_path`.
+    """
+    path = shared_weights_path(model_package)
+    if os.path.exists(path):
+        return path
+    _remove_stale_shared_weights(keep=path)
+
+    if state_dict is None:
+        state_dict = model_package.adapter.load_weights(device='cpu')['model_state_dict']
+
+    # Write to a private file first (created with O_EXCL and mode 0600 by
+    # mkstemp), then link it into place, so that readers never see a
+    # partial file and concurrent publishers do not replace each other's
+    # file.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            save_safetensors(state_dict, f, metadata={'checkpoint': os.path.basename(path)})
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+    finally:
+        os.remove(tmp_path)
+    return path
+
+
+def load_shared_weights(model_package):
+    """Attach to the shared weights of a package, if published.
+
+    The shared file is only used if it is a regular file owned by the
+    current user and not writable by others, and if its header is valid
+    and names this file; the weights themselves are not read. This process
+    stays attached, i.e. the file is not removed as stale, until it exits
+    or calls `release_shared_weights`.
+
+    Parameters
+    ----------
+    model_package : `NNModelPackage`
+        The model package.
+
+    Returns
+    -------
+    state_dict : `dict` [`str`, `torch.Tensor`] or `None`
+        Tensors backed by the shared memory, copy-on-write, so the shared
+        copy is never modified; `None` if the weights are not published,
+        or the shared file cannot be trusted.
+    """
+    path = shared_weights_path(model_package)
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    except FileNotFoundError:
+        return None
+    try:
+        status = os.fstat(fd)
+        if not _is_private(status):
+            _log.warning("Ignoring shared weights %s, which are not private to this user.", path)
+            return None
+        # Map the file that was checked, rather than opening its path again.
+        mapped = BufferReader(mmap.mmap(fd, 0, access=mmap.ACCESS_COPY)) if status.st_size else None
+        metadata = read_safetensors_metadata(mapped.getbuffer()) if mapped is not None else None
+        if metadata is None or metadata.get('checkpoint') != os.path.basename(path):
+            _log.warning("Ignoring shared weights %s, which are not valid.", path)
+            return None
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        previous = _attached.pop(path, None)
+        _attached[path], fd = fd, previous
+    finally:
+        if fd is not None:
+            os.close(fd)
+    return load_checkpoint(mapped)['model_state_dict']
+
+
+def release_shared_weights(model_package):
+    """Remove the shared weights of a package.
+
+    Processes already attached keep their mapping; the memory is freed
+    when the last of them exits.
+
+    Parameters
+    ----------
+    model_package : `NNModelPackage`
+        The model package.
+    """
+    path = shared_weights_path(model_package)
+    fd = _attached.pop(path, None)
+    if fd is not None:
+        os.close(fd)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -1,7 +1,20 @@
 from . import utils
+from .checkpointFiles import load_checkpoint
+from .packageIndex import _is_current, find_package_files, list_packages, write_package_index
+import glob
+import hashlib
+import logging
+import numpy as np
+import os
 import torch
 import yaml
 
+_log = logging.getLogger(__name__)
+
+# Name of the file of a compiled or quantized model recording the digest of
+# the checkpoint it was built from.
+compiled_digest_file = 'checkpoint_sha256'
+
 
 class StorageAdapterBase(object):
     """
@@ -17,9 +30,44 @@ class StorageAdapterBase(object):
     """Name of the model package (`str`).
     """
 
+    optional_components = {
+        'compiled': '*.torchscript',
+        'quantized_dynamic': '*.dynamic.qtorchscript',
+        'quantized_static': '*.static.qtorchscript',
+        'reference': '*.npy',
+        'onnx': '*.onnx',
+    }
+    """Optional components a model package may contain, mapped to the file
+    name pattern of each in directory-based storage modes (`dict`).
+
+    ``compiled``
+        A frozen TorchScript version of the model, with its pretrained
+        weights; see `NNModelPackage.build_compiled`.
+    ``quantized_dynamic``, ``quantized_static``
+        TorchScript versions of the model quantized in each mode; see
+        `NNModelPackage.build_quantized`.
+    ``reference``
+        A numpy array of representative model inputs, of shape
+        (N, 3, height, width), e.g. for calibrating quantization. They are
+        taken as passed to the model, i.e. already normalized if the model
+        expects normalized input.
+    ``onnx``
+        An ONNX graph of the model, with its pretrained weights, for the
+        onnxruntime inference backend; see `NNModelPackage.build_onnx`.
+    """
+
+    _digest_memo = {}
+    """Checkpoint digests already computed in this process, keyed by
+    (path, size, modification time) so unchanged files are hashed only once.
+    """
+
     def __init__(self, model_package_name):
         self.model_package_name = model_package_name
 
+        # Entry of the package in the index of its storage directory, if it
+        # was found there; see `get_filenames`.
+        self.index_entry = None
+
     def fetch(self):
         """
         Derived classes must implement any potentially
@@ -55,6 +103,206 @@ class StorageAdapterBase(object):
         model = utils.import_model(self.model_filename).to(device)
         return model
 
+    def get_filenames(self):
+        """
+        Find and return absolute paths to the architecture, checkpoint and
+        metadata files, in directory-based storage modes.
+
+        The package index of the storage directory is used if it lists the
+        package (see `write_index`); otherwise, the package directory is
+        scanned.
+
+        Returns
+        -------
+        model_filename : `str`
+            The full path to the .py file containing the model architecture.
+        checkpoint_filename : `str`
+            The full path to the file containing the saved checkpoint.
+        metadata_filename : `str`
+            The full path to the metadata file.
+
+        Raises
+        ------
+        RuntimeError
+            If the package is not indexed and there is not exactly one file
+            for each of the architecture, checkpoint and metadata in its
+            directory.
+        """
+        files, self.index_entry = find_package_files(self.get_base_path(), self.model_package_name,
+                                                     self.optional_components)
+        return files['architecture'], files['checkpoint'], files['metadata']
+
+    @classmethod
+    def list_packages(cls):
+        """
+        Return the names of the model packages available in this mode.
+
+        Returns
+        -------
+        names : `list` [`str`]
+            Names of the packages; see `packageIndex.list_packages`.
+        """
+        return list_packages(cls.get_base_path())
+
+    @classmethod
+    def write_index(cls):
+        """
+        Generate the package index of the storage directory of this mode,
+        listing the files, sizes and digests of all packages.
+
+        Returns
+        -------
+        filename : `str`
+            Path of the index file.
+        """
+        return write_package_index(cls.get_base_path(), cls.optional_components)
+
+    def find_optional_file(self, component):
+        """
+        Return the path to an optional component of the model package.
+
+        Parameters
+        ----------
+        component : `str`
+            Name of the component; a key of ``optional_components``.
+
+        Returns
+        -------
+        filename : `str` or `None`
+            The full path to the component file, or `None` if the package
+            does not contain this component.
+
+        Raises
+        ------
+        RuntimeError
+            If more than one file matches the component.
+
+        Notes
+        -----
+        Components listed in the index of the package are used while their
+        file exists. Others, e.g. compiled or exported models added after
+        the index was written, or files since removed, are looked up in the
+        package directory.
+        """
+        dir_name = os.path.dirname(self.model_filename)
+        if self.index_entry is not None and component in self.index_entry:
+            filename = os.path.join(dir_name, self.index_entry[component]['file'])
+            if os.path.isfile(filename):
+                return filename
+
+        filenames = glob.glob(os.path.join(dir_name, self.optional_components[component]))
+        if len(filenames) > 1:
+            raise RuntimeError(f"Found {len(filenames)} {component} files, "
+                               f"expected at most 1 in {dir_name}.")
+        return filenames[0] if filenames else None
+
+    def open_optional_component(self, component):
+        """
+        Return a source to read an optional component of the package from.
+
+        Parameters
+        ----------
+        component : `str`
+            Name of the component; a key of ``optional_components``.
+
+        Returns
+        -------
+        source : `str`, file-like object or `None`
+            A path or a file-like object that can be passed to the loader of
+            the component, or `None` if the package does not contain it.
+        """
+        return self.find_optional_file(component)
+
+    def load_compiled(self, device):
+        """
+        Load and return the compiled model, if the package contains one.
+
+        Parameters
+        ----------
+        device : `torch.device`
+            Device to load the model on.
+
+        Returns
+        -------
+        model : `torch.jit.ScriptModule` or `None`
+            The compiled model, with its pretrained weights, or `None` if
+            the package does not contain a compiled model, or one that was
+            not built from its checkpoint.
+        """
+        # The weights are frozen into constants of the graph, which are
+        # only placed on the device when loading.
+        return self._load_torchscript('compiled', device)
+
+    def load_quantized(self, mode):
+        """
+        Load and return a precomputed quantized model, if the package
+        contains one.
+
+        Parameters
+        ----------
+        mode : `str`
+            Quantization mode, e.g. 'dynamic' or 'static'.
+
+        Returns
+        -------
+        model : `torch.jit.ScriptModule` or `None`
+            The quantized model, for CPU inference, or `None` if the package
+            does not contain a model quantized in this mode, or one that was
+            not built from its checkpoint.
+        """
+        return self._load_torchscript(f'quantized_{mode}', 'cpu')
+
+    def _load_torchscript(self, component, device):
+        """Load a TorchScript component built from the checkpoint of the
+        package, i.e. recording its digest in ``compiled_digest_file``.
+        """
+        source = self.open_optional_component(component)
+        if source is None:
+            return None
+        extra_files = {compiled_digest_file: ''}
+        model = torch.jit.load(source, map_location=device, _extra_files=extra_files)
+        recorded = extra_files[compiled_digest_file]
+        recorded = recorded.decode() if isinstance(recorded, bytes) else recorded
+        if recorded != self.get_checkpoint_digest():
+            _log.warning("The %s model of package %s was not built from its checkpoint; "
+                         "ignoring it.", component, self.model_package_name)
+            return None
+        return model
+
+    def load_reference_inputs(self):
+        """
+        Load and return the reference inputs of the package, if any.
+
+        Returns
+        -------
+        inputs : `numpy.ndarray` or `None`
+            Array of shape (N, 3, height, width), or `None` if the package
+            does not contain reference inputs.
+        """
+        source = self.open_optional_component('reference')
+        if source is None:
+            return None
+        return np.load(source, allow_pickle=False)
+
+    def load_onnx(self):
+        """
+        Load and return the ONNX graph of the model, if the package contains
+        one.
+
+        Returns
+        -------
+        model_bytes : `bytes` or `None`
+            The serialized graph, or `None` if the package does not contain
+            one.
+        """
+        source = self.open_optional_component('onnx')
+        if source is None:
+            return None
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                return f.read()
+        return source.read()
+
     def load_weights(self, device):
         """
         Load and return a checkpoint of a neural network model.
@@ -69,15 +317,16 @@ class StorageAdapterBase(object):
         network_data : `dict`
             Dictionary containing a saved network state in PyTorch format,
             composed of the trained weights, optimizer state, and other
-            useful metadata.
+            useful metadata. The checkpoint file is memory mapped, so the
+            weights of models loaded on CPU share the page cache with other
+            processes; see `load_checkpoint`.
 
         See Also
         --------
         load_arch
         """
 
-        network_data = torch.load(self.checkpoint_filename, map_location=device,
-                                  weights_only=True)
+        network_data = load_checkpoint(self.checkpoint_filename, device=device)
         return network_data
 
     def load_metadata(self):
@@ -92,3 +341,48 @@ class StorageAdapterBase(object):
         with open(self.metadata_filename, 'r') as f:
             metadata = yaml.safe_load(f)
         return metadata
+
+    def get_checkpoint_identity(self):
+        """
+        Return a cheap identity of the pretrained weights of the model
+        package.
+
+        Unlike `get_checkpoint_digest`, the checkpoint is not read, so the
+        same weights may have several identities, e.g. in copies of a
+        package; but an identity always refers to the same weights.
+
+        Returns
+        -------
+        identity : `tuple`
+            Resolved path, size and modification time of the checkpoint file.
+        """
+        filename = os.path.realpath(self.checkpoint_filename)
+        stat = os.stat(filename)
+        return ('file', filename, stat.st_size, stat.st_mtime_ns)
+
+    def get_checkpoint_digest(self):
+        """
+        Return a digest of the pretrained weights of the model package.
+
+        The digest identifies the exact checkpoint a model would be loaded
+        from, e.g. for keying caches of loaded models.
+
+        Returns
+        -------
+        digest : `str`
+            Hexadecimal SHA-256 digest of the checkpoint file, as recorded
+            in the package index if the package is indexed and the file is
+            unchanged since.
+        """
+        stat = os.stat(self.checkpoint_filename)
+        if self.index_entry is not None and _is_current(self.index_entry['checkpoint'], stat):
+            return self.index_entry['checkpoint']['sha256']
+
+        memo_key = (self.checkpoint_filename, stat.st_size, stat.st_mtime_ns)
+        if memo_key not in StorageAdapterBase._digest_memo:
+            sha = hashlib.sha256()
+            with open(self.checkpoint_filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+            StorageAdapterBase._digest_memo[memo_key] = sha.hexdigest()
+        return StorageAdapterBase._digest_memo[memo_key]
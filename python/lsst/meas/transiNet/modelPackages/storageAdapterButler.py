@@ -1,15 +1,88 @@
 from .storageAdapterBase import StorageAdapterBase
-from lsst.meas.transiNet.modelPackages.formatters import NNModelPackagePayload
-from lsst.daf.butler import DatasetType
+from .checkpointFiles import BufferReader, is_safetensors, load_checkpoint, save_safetensors
+from lsst.meas.transiNet.modelPackages.formatters import NNModelPackageFormatter, NNModelPackagePayload
+from .packageCache import get_default_package_cache
+from .packageIndex import find_package_files, indexed_sha256, list_packages
+from lsst.daf.butler import DataCoordinate, DatasetRef, DatasetType, FileDataset
 from . import utils
 
-import torch
+import collections.abc
+import concurrent.futures
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import uuid
 import zipfile
 import io
+import struct
+import time
 import yaml
 
 __all__ = ["StorageAdapterButler"]
 
+_log = logging.getLogger(__name__)
+
+# Namespace of the dataset IDs of packages ingested by
+# `StorageAdapterButler.ingest_directory`, which are derived from their
+# names and contents.
+_dataset_id_namespace = uuid.UUID('5d0c7a52-3c1e-4f5b-9a43-6e2f0b8d71c4')
+
+
+def _lazy_member(name, doc):
+    """Return a property holding an in-memory file of a main member of the
+    package, read from the payload on first access.
+    """
+    def getter(self):
+        if name not in self._files and self._zip is not None:
+            self._files[name] = self._read_member(name)
+        return self._files.get(name)
+
+    def setter(self, value):
+        self._files[name] = value
+        self._checkpoint_digest = None
+        if name == 'checkpoint':
+            self._checkpoint_identity = None
+
+    return property(getter, setter, doc=doc)
+
+
+class _LazyComponents(collections.abc.MutableMapping):
+    """In-memory files of the optional components of a package, keyed by
+    component name, each read from the payload on first access.
+    """
+
+    def __init__(self, adapter, available=()):
+        self._adapter = adapter
+        self._available = set(available)
+        self._files = {}
+
+    def __getitem__(self, component):
+        if component not in self._files:
+            if component not in self._available:
+                raise KeyError(component)
+            self._files[component] = self._adapter._read_member(component)
+        return self._files[component]
+
+    def __setitem__(self, component, f):
+        self._files[component] = f
+
+    def __delitem__(self, component):
+        if component not in self:
+            raise KeyError(component)
+        self._files.pop(component, None)
+        self._available.discard(component)
+
+    def __contains__(self, component):
+        return component in self._files or component in self._available
+
+    def __iter__(self):
+        return iter(self._available | self._files.keys())
+
+    def __len__(self):
+        return len(self._available | self._files.keys())
+
 
 class StorageAdapterButler(StorageAdapterBase):
     """ An adapter for interfacing with butler model packages.
@@ -31,18 +104,34 @@ class StorageAdapterButler(StorageAdapterBase):
         This is a data blob representing a `pretrainedModelPackage` dataset
         directly loaded from the butler repository.
         It is only set when we are in the "online" mode of functionality.
+    cache : `PackageCache`, optional
+        Local cache of fetched payloads, used in the "offline" mode. Defaults
+        to the cache configured by the environment, if any; see
+        `get_default_package_cache`.
     """
 
     dataset_type_name = 'pretrainedModelPackage'
     packages_parent_collection = 'pretrained_models'
 
-    def __init__(self, model_package_name, butler=None, butler_loaded_package=None):
+    model_file = _lazy_member('architecture', "In-memory file of the architecture module.")
+    checkpoint_file = _lazy_member('checkpoint', "In-memory file of the checkpoint.")
+    metadata_file = _lazy_member('metadata', "In-memory file of the metadata.")
+
+    def __init__(self, model_package_name, butler=None, butler_loaded_package=None, cache=None):
         super().__init__(model_package_name)
 
         self.model_package_name = model_package_name
         self.butler = butler
+        self.cache = cache if cache is not None else get_default_package_cache()
 
-        self.model_file = self.checkpoint_file = self.metadata_file = None
+        # The open payload, and the members already read from it; members
+        # are only read when first needed.
+        self._payload = self._zip = None
+        self._files = {}
+        self._checkpoint_digest = self._checkpoint_identity = None
+        # In-memory files of the optional components present in the package,
+        # keyed by component name.
+        self.optional_files = _LazyComponents(self)
 
         # butler and butler_loaded_package are mutually exclusive.
         if butler is not None and butler_loaded_package is not None:
@@ -75,6 +164,7 @@ class StorageAdapterButler(StorageAdapterBase):
             instance.model_file = other.model_file
             instance.checkpoint_file = other.checkpoint_file
             instance.metadata_file = other.metadata_file
+            instance.optional_files = dict(other.optional_files)
         else:
             with open(other.model_filename, mode="rb") as f:
                 instance.model_file = io.BytesIO(f.read())
@@ -82,13 +172,21 @@ class StorageAdapterButler(StorageAdapterBase):
                 instance.checkpoint_file = io.BytesIO(f.read())
             with open(other.metadata_filename, mode="rb") as f:
                 instance.metadata_file = io.BytesIO(f.read())
+            for component in cls.optional_components:
+                filename = other.find_optional_file(component)
+                if filename is not None:
+                    with open(filename, mode="rb") as f:
+                        instance.optional_files[component] = io.BytesIO(f.read())
 
         return instance
 
     def from_payload(self, payload):
         """
-        Decompress the payload into the memory and save each component
-        as an in-memory file.
+        Open the payload, to read each component from it as an in-memory
+        file when first needed.
+
+        Only the zip directory is read here, so that e.g. querying the
+        metadata of a package never decompresses its weights.
 
         Parameters
         ----------
@@ -96,18 +194,103 @@ class StorageAdapterButler(StorageAdapterBase):
             The payload to create the instance from.
 
         """
-        with zipfile.ZipFile(payload.bytes, mode="r") as zf:
-            with zf.open('checkpoint') as f:
-                self.checkpoint_file = io.BytesIO(f.read())
-            with zf.open('architecture') as f:
-                self.model_file = io.BytesIO(f.read())
-            with zf.open('metadata') as f:
-                self.metadata_file = io.BytesIO(f.read())
-
-    def to_payload(self):
+        self._payload = payload.bytes
+        self._zip = zipfile.ZipFile(payload.bytes, mode="r")
+        self._files = {}
+        self._checkpoint_digest = None
+        names = set(self._zip.namelist())
+        for name in ('checkpoint', 'architecture', 'metadata'):
+            if name not in names:
+                raise KeyError(f"There is no item named '{name}' in the model package payload")
+        info = self._zip.getinfo('checkpoint')
+        self._checkpoint_identity = ('zip', info.CRC, info.file_size)
+        self.optional_files = _LazyComponents(self, names & self.optional_components.keys())
+
+    def _read_member(self, name):
+        """Read a member of the payload into an in-memory file.
+
+        Parameters
+        ----------
+        name : `str`
+            Name of the member.
+
+        Returns
+        -------
+        f : `io.BytesIO` or `BufferReader`
+            The member; uncompressed members are used in place, e.g. in a
+            memory mapped payload, rather than copied.
+        """
+        info = self._zip.getinfo(name)
+        if info.compress_type == zipfile.ZIP_STORED:
+            return BufferReader(self._member_buffer(self._payload, info))
+        with self._zip.open(info) as f:
+            return io.BytesIO(f.read())
+
+    @staticmethod
+    def _member_buffer(zip_file, info):
+        """Return a view of the data of an uncompressed zip member.
+
+        Parameters
+        ----------
+        zip_file : `io.BytesIO` or `BufferReader`
+            The zip file.
+        info : `zipfile.ZipInfo`
+            The member, stored with no compression.
+
+        Returns
+        -------
+        buffer : `memoryview`
+            The member data, sharing memory with ``zip_file``.
+        """
+        buffer = zip_file.getbuffer()
+        # The local header may have a different extra field than the
+        # central directory entry of the member.
+        name_length, extra_length = struct.unpack_from('<HH', buffer, info.header_offset + 26)
+        start = info.header_offset + 30 + name_length + extra_length
+        return buffer[start:start + info.file_size]
+
+    @staticmethod
+    def _write_stored(zf, name, data, alignment=64):
+        """Write an uncompressed zip member, with its data aligned in the
+        zip file so that the tensors in it can be used in place.
+
+        ``data`` is a bytes-like object, or the name of a file to copy into
+        the member in chunks.
+        """
+        info = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        info.file_size = os.path.getsize(data) if isinstance(data, str) else memoryview(data).nbytes
+        # zipfile appends a zip64 extra field to that of the local header
+        # of large members.
+        zip64 = info.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        # Pad the extra field of the local header, as zipalign does.
+        data_start = zf.fp.tell() + 30 + len(name.encode()) + 4 + (20 if zip64 else 0)
+        padding = -data_start % alignment
+        info.extra = struct.pack('<HH', 0xD935, padding) + bytes(padding)
+        with zf.open(info, mode='w') as dest:
+            if isinstance(data, str):
+                with open(data, 'rb') as src:
+                    shutil.copyfileobj(src, dest, 1 << 20)
+            else:
+                dest.write(data)
+
+    def to_payload(self, compress_checkpoint=True, safetensors=False):
         """
         Compress the model package into a payload.
 
+        Parameters
+        ----------
+        compress_checkpoint : `bool`, optional
+            Whether to compress the checkpoint. An uncompressed checkpoint
+            is larger, but it is loaded without inflating it, and if the
+            payload is read from a local file, it is memory mapped and
+            shared by all processes using the package.
+        safetensors : `bool`, optional
+            Whether to convert a PyTorch checkpoint to the safetensors
+            format, whose tensors are used in place instead of copied when
+            the checkpoint is uncompressed. Only the model state dict of the
+            checkpoint is kept.
+
         Returns
         -------
         payload : `NNModelPackagePayload`
@@ -116,10 +299,21 @@ class StorageAdapterButler(StorageAdapterBase):
 
         payload = NNModelPackagePayload()
 
+        checkpoint = self.checkpoint_file.getbuffer()
+        if safetensors and not is_safetensors(checkpoint):
+            converted = io.BytesIO()
+            save_safetensors(load_checkpoint(self.checkpoint_file)['model_state_dict'], converted)
+            checkpoint = converted.getbuffer()
+
         with zipfile.ZipFile(payload.bytes, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-            zf.writestr('checkpoint', self.checkpoint_file.read())
-            zf.writestr('architecture', self.model_file.read())
-            zf.writestr('metadata', self.metadata_file.read())
+            if compress_checkpoint:
+                zf.writestr('checkpoint', checkpoint)
+            else:
+                self._write_stored(zf, 'checkpoint', checkpoint)
+            zf.writestr('architecture', self.model_file.getvalue())
+            zf.writestr('metadata', self.metadata_file.getvalue())
+            for component, f in self.optional_files.items():
+                zf.writestr(component, f.getvalue())
 
         return payload
 
@@ -132,19 +326,81 @@ class StorageAdapterButler(StorageAdapterBase):
         """
 
         # If we have already loaded the package, there's nothing left to do.
-        if self.model_file is not None:
+        if self._zip is not None or self._files.get('architecture') is not None:
             return
 
         # Fetching needs a butler object.
         if self.butler is None:
             raise ValueError('The `butler` object is required for fetching the model package')
 
-        # Fetch the model package from the butler repository.
-        results = self.butler.registry.queryDatasets(StorageAdapterButler.dataset_type_name,
-                                                     collections=f'{StorageAdapterButler.packages_parent_collection}/{self.model_package_name}')  # noqa: E501
-        payload = self.butler.get(list(results)[0])
+        # Fetch the model package from the butler repository, unless it is
+        # cached already.
+        ref = self.find_dataset(self.butler, self.model_package_name)
+        payload = self.cache.get(ref.id) if self.cache is not None else None
+        if payload is None:
+            payload = self.butler.get(ref)
+            if self.cache is not None:
+                self.cache.put(ref.id, payload)
         self.from_payload(payload)
 
+    @staticmethod
+    def find_dataset(butler, model_package_name):
+        """Return the dataset of a model package in a butler repository.
+
+        Parameters
+        ----------
+        butler : `lsst.daf.butler.Butler`
+            The butler to query.
+        model_package_name : `str`
+            Name of the model package.
+
+        Returns
+        -------
+        ref : `lsst.daf.butler.DatasetRef`
+            The dataset holding the payload of the package.
+        """
+        results = butler.registry.queryDatasets(StorageAdapterButler.dataset_type_name,
+                                                collections=f'{StorageAdapterButler.packages_parent_collection}/{model_package_name}')  # noqa: E501
+        return list(results)[0]
+
+    @staticmethod
+    def warm_cache(butler, model_package_names, cache=None):
+        """Fetch model packages into a local cache ahead of time, e.g. before
+        starting a processing campaign.
+
+        Parameters
+        ----------
+        butler : `lsst.daf.butler.Butler`
+            The butler to fetch the packages from.
+        model_package_names : `list` [`str`]
+            Names of the model packages.
+        cache : `PackageCache`, optional
+            The cache to fill; defaults to that configured by the
+            environment.
+
+        Returns
+        -------
+        paths : `list` [`str`]
+            Paths of the cached payloads, in the order of
+            ``model_package_names``.
+
+        Raises
+        ------
+        ValueError
+            If no cache is given or configured.
+        """
+        cache = cache if cache is not None else get_default_package_cache()
+        if cache is None:
+            raise ValueError("No package cache given, and MEAS_TRANSINET_PACKAGE_CACHE is not set.")
+        paths = []
+        for name in model_package_names:
+            ref = StorageAdapterButler.find_dataset(butler, name)
+            path = cache.find(ref.id)
+            if path is None:
+                path = cache.put(ref.id, butler.get(ref))
+            paths.append(path)
+        return paths
+
     def load_arch(self, device):
         """
         Load and return the model architecture
@@ -170,6 +426,25 @@ class StorageAdapterButler(StorageAdapterBase):
         model = utils.import_model_from_module(module).to(device)
         return model
 
+    def open_optional_component(self, component):
+        """
+        Return a source to read an optional component of the package from.
+
+        Parameters
+        ----------
+        component : `str`
+            Name of the component; a key of ``optional_components``.
+
+        Returns
+        -------
+        source : `io.BytesIO` or `None`
+            An independent in-memory file holding the component, or `None`
+            if the package does not contain it.
+        """
+        if component not in self.optional_files:
+            return None
+        return io.BytesIO(self.optional_files[component].getbuffer())
+
     def load_weights(self, device):
         """
         Load and return a checkpoint of a neural network model.
@@ -194,8 +469,11 @@ class StorageAdapterButler(StorageAdapterBase):
         """
         if device != 'cpu':
             raise RuntimeError('storageAdapterButler only supports loading on CPU')
-        network_data = torch.load(self.checkpoint_file, map_location=device,
-                                  weights_only=True)
+        # Do not keep a decompressed checkpoint around after loading it.
+        checkpoint = self._files.get('checkpoint')
+        if checkpoint is None:
+            checkpoint = self._read_member('checkpoint')
+        network_data = load_checkpoint(checkpoint, device=device)
         return network_data
 
     def load_metadata(self):
@@ -208,11 +486,84 @@ class StorageAdapterButler(StorageAdapterBase):
             Dictionary containing the metadata associated with the model.
         """
 
-        metadata = yaml.safe_load(self.metadata_file)
+        metadata = yaml.safe_load(self.metadata_file.getvalue())
         return metadata
 
+    def get_checkpoint_identity(self):
+        """
+        Return a cheap identity of the pretrained weights of the model
+        package.
+
+        Returns
+        -------
+        identity : `tuple`
+            CRC-32 and size of the checkpoint, as recorded in the zip
+            directory of the payload; or the digest of the checkpoint if it
+            was not read from a payload.
+        """
+        if self._checkpoint_identity is None:
+            return ('sha256', self.get_checkpoint_digest())
+        return self._checkpoint_identity
+
+    def get_checkpoint_digest(self):
+        """
+        Return a digest of the pretrained weights of the model package.
+
+        Returns
+        -------
+        digest : `str`
+            Hexadecimal SHA-256 digest of the checkpoint.
+        """
+        if self._checkpoint_digest is None:
+            sha = hashlib.sha256()
+            if 'checkpoint' in self._files or self._zip is None:
+                sha.update(self.checkpoint_file.getbuffer())
+            else:
+                # Hash the compressed member as it is decompressed, rather
+                # than keeping it in memory.
+                with self._zip.open('checkpoint') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        sha.update(chunk)
+            self._checkpoint_digest = sha.hexdigest()
+        return self._checkpoint_digest
+
+    @staticmethod
+    def _register_package_run(butler, model_package_name):
+        """Register the run collection of a model package, and the dataset
+        type of model packages if needed.
+
+        Parameters
+        ----------
+        butler : `lsst.daf.butler.Butler`
+            The butler to register them in.
+        model_package_name : `str`
+            Name of the model package.
+
+        Returns
+        -------
+        dataset_type : `lsst.daf.butler.DatasetType`
+            The dataset type of model packages.
+        run_collection : `str`
+            Name of the run collection of the package.
+        """
+        # Create the destination run collection.
+        run_collection = f"{StorageAdapterButler.packages_parent_collection}/{model_package_name}"
+        butler.registry.registerRun(run_collection)
+
+        # Create the dataset type (and register it, just in case).
+        dataset_type = DatasetType(StorageAdapterButler.dataset_type_name,
+                                   dimensions=[],
+                                   storageClass="NNModelPackagePayload",
+                                   universe=butler.registry.dimensions)
+        try:  # Do nothing if the dataset type is already registered
+            butler.registry.getDatasetType(StorageAdapterButler.dataset_type_name)
+        except KeyError:
+            butler.registry.registerDatasetType(dataset_type)
+        return dataset_type, run_collection
+
     @staticmethod
-    def ingest(model_package, butler, model_package_name=None):
+    def ingest(model_package, butler, model_package_name=None, include_compiled=False,
+               include_quantized=(), include_onnx=False, compress_checkpoint=True, safetensors=False):
         """
         Ingest a model package to the butler repository.
 
@@ -224,6 +575,23 @@ class StorageAdapterButler(StorageAdapterBase):
             The butler instance to use for ingesting.
         model_package_name : `str`, optional
             The name of the model package to be ingested.
+        include_compiled : `bool`, optional
+            Whether to build a compiled version of the model (see
+            `NNModelPackage.build_compiled`) and store it in the package, if
+            it does not have one already.
+        include_quantized : `list` [`str`], optional
+            Quantization modes to build a quantized version of the model for
+            (see `NNModelPackage.build_quantized`) and store in the package,
+            if it does not have them already.
+        include_onnx : `bool`, optional
+            Whether to export the model to ONNX (see
+            `NNModelPackage.build_onnx`) and store it in the package, if it
+            does not have an ONNX graph already.
+        compress_checkpoint : `bool`, optional
+            Whether to compress the checkpoint; see `to_payload`.
+        safetensors : `bool`, optional
+            Whether to store the checkpoint in the safetensors format; see
+            `to_payload`.
         """
 
         # Check if the input model package is of a proper type.
@@ -236,28 +604,174 @@ class StorageAdapterButler(StorageAdapterBase):
         else:
             the_name = model_package_name
 
-        # Create the destination run collection.
-        run_collection = f"{StorageAdapterButler.packages_parent_collection}/{the_name}"
-        butler.registry.registerRun(run_collection)
-
-        # Create the dataset type (and register it, just in case).
+        dataset_type, run_collection = StorageAdapterButler._register_package_run(butler, the_name)
         data_id = {}
-        dataset_type = DatasetType(StorageAdapterButler.dataset_type_name,
-                                   dimensions=[],
-                                   storageClass="NNModelPackagePayload",
-                                   universe=butler.registry.dimensions)
-
-        # Register the dataset type.
-        def register_dataset_type(butler, dataset_type_name, dataset_type):
-            try:  # Do nothing if the dataset type is already registered
-                butler.registry.getDatasetType(dataset_type_name)
-            except KeyError:
-                butler.registry.registerDatasetType(dataset_type)
-        register_dataset_type(butler, StorageAdapterButler.dataset_type_name, dataset_type)
 
         # Create an instance of StorageAdapterButler, and ingest its payload.
-        payload = StorageAdapterButler.from_other(model_package.adapter).to_payload()
+        adapter = StorageAdapterButler.from_other(model_package.adapter)
+        if include_compiled and 'compiled' not in adapter.optional_files:
+            adapter.optional_files['compiled'] = model_package.build_compiled()
+        for mode in include_quantized:
+            if f'quantized_{mode}' not in adapter.optional_files:
+                adapter.optional_files[f'quantized_{mode}'] = model_package.build_quantized(mode)
+        if include_onnx and 'onnx' not in adapter.optional_files:
+            adapter.optional_files['onnx'] = model_package.build_onnx()
+        payload = adapter.to_payload(compress_checkpoint=compress_checkpoint, safetensors=safetensors)
         butler.put(payload,
                    dataset_type,
                    data_id,
                    run=run_collection)
+
+    @staticmethod
+    def ingest_directory(root, butler, model_package_names=None, n_workers=None,
+                         compress_checkpoint=True, replace=False, log=None):
+        """
+        Ingest the model packages of a directory to the butler repository,
+        building their payloads in parallel.
+
+        The files of each package are streamed into a temporary payload file,
+        which is then ingested, so that packages are never held in memory.
+        The SHA-256 digest of each component is recorded in the ``sha256``
+        entry of the package metadata, and the dataset ID of the payload is
+        derived from the package name and these digests. Packages whose
+        dataset is already in their run collection are skipped, which makes
+        re-running an ingest cheap.
+
+        Parameters
+        ----------
+        root : `str`
+            The model packages directory, holding one subdirectory per
+            package, e.g. `StorageAdapterLocal.get_base_path`. Digests are
+            taken from its package index, if it has one, for the files
+            unchanged since it was written.
+        butler : `lsst.daf.butler.Butler`
+            The butler instance to use for ingesting.
+        model_package_names : `list` [`str`], optional
+            Names of the packages to ingest; all those of ``root`` by
+            default.
+        n_workers : `int`, optional
+            Number of payloads to hash and build concurrently; defaults to
+            that of `concurrent.futures.ThreadPoolExecutor`.
+        compress_checkpoint : `bool`, optional
+            Whether to compress the checkpoints; see `to_payload`.
+        replace : `bool`, optional
+            Whether to replace packages ingested with different contents,
+            rather than raise. A package whose new payload fails to be
+            ingested keeps its previous one.
+        log : `logging.Logger`, optional
+            Logger to report progress to.
+
+        Returns
+        -------
+        status : `dict` [`str`, `str`]
+            Outcome for each package: ``ingested``, ``replaced`` or
+            ``skipped``.
+
+        Raises
+        ------
+        RuntimeError
+            If ``replace`` is `False` and any package was already ingested
+            with different contents. Nothing is ingested then.
+        """
+        log = log if log is not None else _log
+        if model_package_names is None:
+            model_package_names = list_packages(root)
+
+        with concurrent.futures.ThreadPoolExecutor(n_workers) as executor:
+            # Hashing is skipped for files unchanged since they were indexed.
+            packages = dict(zip(model_package_names,
+                                executor.map(lambda name: _package_digests(root, name),
+                                             model_package_names)))
+
+            status = {}
+            to_ingest = {}
+            for name, (files, digests) in packages.items():
+                dataset_type, run_collection = StorageAdapterButler._register_package_run(butler, name)
+                dataset_id = _package_dataset_id(name, digests)
+                existing = list(butler.registry.queryDatasets(dataset_type, collections=run_collection))
+                if existing and existing[0].id == dataset_id:
+                    status[name] = 'skipped'
+                    continue
+                status[name] = 'replaced' if existing else 'ingested'
+                ref = DatasetRef(dataset_type, DataCoordinate.make_empty(butler.registry.dimensions),
+                                 run=run_collection, id=dataset_id)
+                to_ingest[name] = (files, digests, existing, ref)
+
+            conflicts = [name for name, status_ in status.items() if status_ == 'replaced']
+            if conflicts and not replace:
+                raise RuntimeError(f"Model packages {conflicts} were already ingested with different "
+                                   "contents; use replace=True to replace them.")
+            log.info("Ingesting %d model packages; %d are already ingested.",
+                     len(to_ingest), len(status) - len(to_ingest))
+
+            with tempfile.TemporaryDirectory(prefix='model_packages_') as tmp_dir:
+                futures = {}
+                for name, (files, digests, existing, ref) in to_ingest.items():
+                    filename = os.path.join(tmp_dir, f'{name}.zip')
+                    future = executor.submit(_write_package, filename, files, digests, compress_checkpoint)
+                    futures[future] = (name, filename, existing, ref)
+
+                # Registry operations are serialized in this thread.
+                for future in concurrent.futures.as_completed(futures):
+                    name, filename, existing, ref = futures[future]
+                    future.result()
+                    if existing:
+                        # The run of a package holds a single dataset, so the
+                        # previous one is removed before the ingest, which
+                        # restores it from a copy if it fails.
+                        (previous,) = butler.retrieveArtifacts(existing,
+                                                               os.path.join(tmp_dir, 'previous', name),
+                                                               transfer='copy')
+                        butler.pruneDatasets(existing, disassociate=True, unstore=True, purge=True)
+                    try:
+                        butler.ingest(FileDataset(path=filename, refs=[ref],
+                                                  formatter=NNModelPackageFormatter),
+                                      transfer='move')
+                    except Exception:
+                        if existing:
+                            butler.ingest(FileDataset(path=previous.ospath, refs=existing,
+                                                      formatter=NNModelPackageFormatter),
+                                          transfer='move')
+                            log.warning("Restored the previous model package %s.", name)
+                        raise
+                    log.info("Ingested model package %s.", name)
+
+        return status
+
+
+def _package_digests(root, model_package_name):
+    """Return the files of a model package of a directory, with their
+    SHA-256 digests.
+    """
+    files, entry = find_package_files(root, model_package_name, StorageAdapterButler.optional_components)
+    digests = {component: indexed_sha256(filename, entry and entry.get(component))
+               for component, filename in files.items()}
+    return files, digests
+
+
+def _package_dataset_id(model_package_name, digests):
+    """Return the dataset ID of a model package, derived from its name and
+    the digests of its components.
+    """
+    contents = ','.join(f'{component}:{digest}' for component, digest in sorted(digests.items()))
+    return uuid.uuid5(_dataset_id_namespace, f'{model_package_name}/{contents}')
+
+
+def _write_package(filename, files, digests, compress_checkpoint):
+    """Write the payload of a model package to a file, copying the files
+    of its components in chunks.
+    """
+    with open(files['metadata']) as f:
+        metadata = yaml.safe_load(f) or {}
+    metadata['sha256'] = dict(digests)
+
+    with zipfile.ZipFile(filename, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        if compress_checkpoint:
+            zf.write(files['checkpoint'], 'checkpoint')
+        else:
+            StorageAdapterButler._write_stored(zf, 'checkpoint', files['checkpoint'])
+        zf.write(files['architecture'], 'architecture')
+        zf.writestr('metadata', yaml.safe_dump(metadata, sort_keys=False))
+        for component in StorageAdapterButler.optional_components:
+            if component in files:
+                zf.write(files[component], component)
@@ -21,16 +21,180 @@
 
 __all__ = ["import_model"]
 
+import hashlib
 import importlib
 import importlib.abc
 import importlib.machinery
 import importlib.util
+import marshal
+import logging
+import os
+import stat
+import sys
+import tempfile
+import threading
+import types
 import torch.nn
 
+_log = logging.getLogger(__name__)
+
+# Modules already executed in this process, keyed by module name and
+# source digest; see `_load_module_from_source`.
+_module_cache = {}
+_module_cache_lock = threading.Lock()
+
+
+def _bytecode_cache_dir():
+    """Return the directory of the on-disk bytecode cache of architecture
+    modules.
+
+    It is ``MEAS_TRANSINET_BYTECODE_CACHE`` if set, or else
+    ``meas_transiNet/bytecode`` in the user cache directory.
+    """
+    directory = os.environ.get('MEAS_TRANSINET_BYTECODE_CACHE')
+    if not directory:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        directory = os.path.join(base, 'meas_transiNet', 'bytecode')
+    return directory
+
+
+def _is_private(status):
+    """Return whether a file or directory is owned by the current user and
+    not writable by others.
+
+    Parameters
+    ----------
+    status : `os.stat_result`
+        Status of the file or directory.
+    """
+    return status.st_uid == os.getuid() and not status.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _with_filename(code, filename):
+    """Return a code object, and those nested in it, with another file name.
+    """
+    consts = tuple(_with_filename(const, filename) if isinstance(const, types.CodeType) else const
+                   for const in code.co_consts)
+    return code.replace(co_filename=filename, co_consts=consts)
+
+
+def _read_cached_code(path, digest):
+    """Read cached bytecode, if the file was written by the current user for
+    the source of a given digest.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    with os.fdopen(fd, 'rb') as f:
+        status = os.fstat(fd)
+        if not stat.S_ISREG(status.st_mode) or not _is_private(status):
+            _log.warning("Ignoring cached bytecode %s, which is not private to this user.", path)
+            return None
+        data = f.read()
+    header = importlib.util.MAGIC_NUMBER + bytes.fromhex(digest)
+    if data[:len(header)] != header:
+        return None
+    try:
+        return marshal.loads(data[len(header):])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def _compile_cached(source, digest, filename):
+    """Compile module source, reusing bytecode cached on disk by any
+    process of the current user.
+
+    The cache is only used if its directory is owned by the current user
+    and not writable by others, as is each cache file; otherwise the source
+    is compiled every time.
+
+    Parameters
+    ----------
+    source : `bytes`
+        Source of the module.
+    digest : `str`
+        SHA-256 digest of ``source``, which names the cache file.
+    filename : `str`
+        File name to report in tracebacks.
+
+    Returns
+    -------
+    code : `types.CodeType`
+        The compiled module.
+    """
+    directory = _bytecode_cache_dir()
+    path = os.path.join(directory, f'{digest}.{sys.implementation.cache_tag}.marshal')
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        usable = _is_private(os.stat(directory))
+    except OSError:
+        # The cache is an optimization only; ignore unusable locations.
+        usable = False
+    if not usable:
+        _log.debug("Not using the bytecode cache %s, which is not private to this user.", directory)
+
+    if usable:
+        code = _read_cached_code(path, digest)
+        if code is not None:
+            # The same source may have been compiled from another path.
+            return code if code.co_filename == filename else _with_filename(code, filename)
+
+    code = compile(source, filename, 'exec', dont_inherit=True)
+    if usable and not sys.dont_write_bytecode:
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        except OSError:
+            return code
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(importlib.util.MAGIC_NUMBER + bytes.fromhex(digest) + marshal.dumps(code))
+            os.replace(tmp_path, path)
+        except OSError:
+            os.remove(tmp_path)
+    return code
+
+
+def _load_module_from_source(source, name, filename=None):
+    """Return the module executed from some source, executing it only if no
+    module of the same name and source was loaded by this process.
+
+    Parameters
+    ----------
+    source : `bytes`
+        Source of the module.
+    name : `str`
+        Name to give to the module.
+    filename : `str`, optional
+        Path of the source file, if any.
+
+    Returns
+    -------
+    module : `module`
+        The module object, shared by all callers loading the same source.
+    """
+    digest = hashlib.sha256(source).hexdigest()
+    key = (name, digest)
+    with _module_cache_lock:
+        if key not in _module_cache:
+            code = _compile_cached(source, digest, filename or '<in-memory>')
+            if filename is not None:
+                spec = importlib.util.spec_from_file_location(name, filename)
+            else:
+                spec = importlib.machinery.ModuleSpec(name, None, origin='<in-memory>')
+            module = importlib.util.module_from_spec(spec)
+            exec(code, module.__dict__)
+            _module_cache[key] = module
+        return _module_cache[key]
+
 
 def load_module_from_memory(file_like_object, name='model'):
     """Load a module from the specified file-like object.
 
+    Modules are cached by their source digest: loading the same source
+    again returns the same module object, and its bytecode is cached on
+    disk, so that other processes do not compile it again.
+
     Parameters
     ----------
     file_like_object : `file-like object`
@@ -43,31 +207,15 @@ def load_module_from_memory(file_like_object, name='model'):
     module : `module`
         The module object.
     """
-
-    class InMemoryLoader(importlib.abc.SourceLoader):
-        def __init__(self, data):
-            self.data = data
-
-        def get_data(self, path):
-            # In this context, 'path' is not used as data is already in memory
-            return self.data
-
-        def get_filename(self, fullname):
-            # This method is required but the filename is not important here
-            return '<in-memory>'
-
-    content = file_like_object.getvalue()
-    loader = InMemoryLoader(content)
-    spec = importlib.util.spec_from_loader(name, loader)
-    module = importlib.util.module_from_spec(spec)
-    loader.exec_module(module)
-
-    return module
+    return _load_module_from_source(bytes(file_like_object.getvalue()), name)
 
 
 def load_module_from_file(path, name='model'):
     """Load a module from the specified path and return the module object.
 
+    Modules are cached by their source digest, as in
+    `load_module_from_memory`.
+
     Parameters
     ----------
     path : str
@@ -80,10 +228,9 @@ def load_module_from_file(path, name='model'):
     module : module
         The loaded module.
     """
-    spec = importlib.util.spec_from_file_location(name, path)
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
-    return module
+    with open(path, 'rb') as f:
+        source = f.read()
+    return _load_module_from_source(source, name, filename=path)
 
 
 def import_model_from_module(module):
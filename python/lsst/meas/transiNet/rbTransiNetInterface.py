@@ -23,6 +23,8 @@ __all__ = ["RBTransiNetInterface", "CutoutInputs"]
 
 import dataclasses
 import math
+import time
+import weakref
 
 import numpy as np
 import torch
@@ -30,6 +32,11 @@ import torch
 import lsst.utils.logging
 
 from .modelPackages.nnModelPackage import NNModelPackage
+from .modelPackages.modelCache import get_model_cache
+from .modelPackages.quantization import quantization_report
+from .modelPackages.inferenceBackends import OnnxRuntimeModel
+from .cpuSettings import apply_thread_settings
+from .stageTimers import StageTimers
 
 
 @dataclasses.dataclass(frozen=True, kw_only=True)
@@ -45,6 +52,24 @@ class CutoutInputs:
     """Known truth of whether this is a real or bogus object."""
 
 
+# Batch sizes already chosen for a model, keyed by the model object and then
+# by cutout shape and batching policy, so that interfaces sharing a cached
+# model do not probe it again.
+_chosen_batch_sizes = weakref.WeakKeyDictionary()
+
+# Accuracy of quantized models with respect to their float version, keyed
+# by the quantized model object, so that it is measured only once.
+_quantization_reports = weakref.WeakKeyDictionary()
+
+# Maximum score difference between reduced-precision and float32 inference
+# on the reference inputs, keyed by the model object and then by precision.
+_precision_checks = weakref.WeakKeyDictionary()
+
+_precision_dtypes = {'float32': torch.float32,
+                     'bfloat16': torch.bfloat16,
+                     'float16': torch.float16}
+
+
 class RBTransiNetInterface:
     """ The interface between the LSST AP pipeline and a trained pytorch-based
     RBTransiNet neural network model.
@@ -70,6 +95,19 @@ class RBTransiNetInterface:
 
         self.package_storage_mode = task.config.modelPackageStorageMode
         self.device = device
+
+        # Reusable (batch, 3, height, width) buffer that batches of
+        # `CutoutInputs` are assembled in; see `prepare_input`.
+        self._input_buffer = None
+
+        # Floating-point type of the inputs and of the autocast region of the
+        # forward pass; see `init_precision`.
+        self.dtype = torch.float32
+
+        # Timers and counters of the stages of the task run; see
+        # `RBTransiNetTask.run`.
+        self.timers = getattr(task, 'timers', None) or StageTimers(enabled=False)
+
         self.init_model()
 
     def init_model(self):
@@ -80,20 +118,224 @@ class RBTransiNetInterface:
             raise RuntimeError("RBTransiNetInterface is trying to load a butler-mode NN model package, "
                                "but the RBTransiNetTask has not passed down a preloaded payload.")
 
-        model_package = NNModelPackage(model_package_name=self.model_package_name,
-                                       package_storage_mode=self.package_storage_mode,
-                                       butler_loaded_package=self.task.butler_loaded_package)
-        self.model = model_package.load(self.device)
+        apply_thread_settings(num_threads=self.task.config.numThreads,
+                              num_interop_threads=self.task.config.numInteropThreads,
+                              cpu_affinity=self.task.config.cpuAffinity,
+                              log=self.task.log)
+
+        self.model_package = NNModelPackage(model_package_name=self.model_package_name,
+                                            package_storage_mode=self.package_storage_mode,
+                                            butler_loaded_package=self.task.butler_loaded_package)
+
+        load_options = dict(prefer_compiled=self.task.config.useCompiledModel,
+                            compile=self.task.config.torchCompile,
+                            quantization=self.task.config.quantization,
+                            backend=self.task.config.inferenceBackend,
+                            shared_weights=self.task.config.sharedMemoryWeights)
+        with self.timers.stage('modelLoad'):
+            if self.task.config.useModelCache:
+                # Reuse a model already loaded by this process, if any.
+                cache = get_model_cache()
+                cache.configure(max_entries=self.task.config.modelCacheMaxEntries,
+                                max_bytes=self.task.config.modelCacheMaxBytes)
+                self.model = cache.get(self.model_package, self.device, **load_options)
+            else:
+                self.model = self.model_package.load(self.device, **load_options)
+
+                # Put the model in evaluation mode instead of training model.
+                self.model.eval()
+
+        if self.task.config.quantization is not None:
+            self.report_quantization()
+
+        self.init_preprocessing()
+        self.init_precision()
+
+    def report_quantization(self):
+        """Log and record in the task metadata how much the scores of the
+        quantized model deviate from those of the float model, on the
+        reference inputs of the model package.
+        """
+        if self.model not in _quantization_reports:
+            inputs = self.model_package.adapter.load_reference_inputs()
+            if inputs is None:
+                self.task.log.warning("Model package %s has no reference inputs; cannot measure the "
+                                      "accuracy of its quantized model.", self.model_package_name)
+                return
+            float_model = self.model_package.load(self.device, prefer_compiled=False).eval()
+            _quantization_reports[self.model] = quantization_report(float_model, self.model, inputs)
+
+        report = _quantization_reports[self.model]
+        self.task.log.info("Quantized (%s) model scores deviate by up to %.3g (mean %.3g) on %d reference "
+                           "inputs.", self.task.config.quantization, report['max_abs_delta'],
+                           report['mean_abs_delta'], report['n_inputs'])
+        self.task.metadata["quantizationMaxScoreDelta"] = report['max_abs_delta']
+        self.task.metadata["quantizationMeanScoreDelta"] = report['mean_abs_delta']
+
+    def init_preprocessing(self):
+        """Set up the normalization of inputs described by the metadata of
+        the model package.
+
+        Only models whose metadata declare that they expect normalized input
+        are given scaled inputs; other models normalize in their own
+        ``forward``.
+        """
+        self._input_factors = None
+        if not self.model_package.expects_normalized_input():
+            return
+
+        factors = np.array(self.model_package.get_input_scale_factors(), dtype=np.float32)
+        try:
+            factors *= self.model_package.get_boost_factor()
+        except KeyError:
+            pass  # Not all models have a boost factor.
+        self._input_factors = torch.from_numpy(factors).reshape(1, -1, 1, 1).to(self.device)
+
+    def init_precision(self):
+        """Select the precision of the forward pass, after checking that the
+        scores it gives on the reference inputs of the model package are
+        within ``precisionTolerance`` of the float32 ones.
+
+        The largest score difference is recorded as
+        ``precisionMaxScoreDelta`` in the task metadata. Without reference
+        inputs the check cannot be made, and the ``precisionGuard`` of the
+        task config decides the precision; models that fail to run in the
+        reduced precision always fall back to float32.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if the check fails, or cannot be made, and the
+            ``precisionGuard`` of the task config is 'raise'.
+        """
+        config = self.task.config
+        self.dtype = torch.float32
+        if config.inferencePrecision == 'float32':
+            return
+        if config.inferenceBackend != 'torch':
+            self.task.log.warning("The %s backend only runs in float32; ignoring inferencePrecision.",
+                                  config.inferenceBackend)
+            return
+        dtype = _precision_dtypes[config.inferencePrecision]
+
+        checks = _precision_checks.setdefault(self.model, {})
+        delta = checks.get(dtype)
+        if delta is None:
+            try:
+                delta = self._check_precision(dtype)
+            except RuntimeError as e:
+                if config.precisionGuard == 'raise':
+                    raise RuntimeError(f"Cannot use {config.inferencePrecision} inference: the model of "
+                                       f"package {self.model_package_name} fails to run in it.") from e
+                self.task.log.warning("Falling back to float32 inference: the model of package %s "
+                                      "fails to run in %s: %s", self.model_package_name,
+                                      config.inferencePrecision, e)
+                return
+            if delta is not None:
+                checks[dtype] = delta
+
+        if delta is None:
+            problem = ("model package %s has no reference inputs to check %s scores against"
+                       % (self.model_package_name, config.inferencePrecision))
+        elif delta > config.precisionTolerance:
+            problem = ("%s scores deviate from float32 ones by up to %.3g, more than the tolerance of "
+                       "%.3g" % (config.inferencePrecision, delta, config.precisionTolerance))
+        else:
+            self.task.log.info("%s scores deviate from float32 ones by up to %.3g.",
+                               config.inferencePrecision, delta)
+            self.task.metadata["precisionMaxScoreDelta"] = delta
+            self.dtype = dtype
+            return
+
+        if delta is not None:
+            self.task.metadata["precisionMaxScoreDelta"] = delta
+        if config.precisionGuard == 'raise':
+            raise RuntimeError(f"Cannot use {config.inferencePrecision} inference: {problem}.")
+        if config.precisionGuard == 'warn':
+            self.task.log.warning("Using %s inference, although %s.", config.inferencePrecision, problem)
+            self.dtype = dtype
+        else:
+            self.task.log.warning("Falling back to float32 inference: %s.", problem)
+
+    def _check_precision(self, dtype, batch_size=64):
+        """Return the largest difference between the scores of the reference
+        inputs of the model package in float32 and in a reduced precision.
+
+        Parameters
+        ----------
+        dtype : `torch.dtype`
+            The reduced precision.
+        batch_size : `int`, optional
+            Number of inputs to score at once.
+
+        Returns
+        -------
+        delta : `float` or `None`
+            Maximum absolute score difference; `None` if the package has no
+            reference inputs.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if the model fails to run in ``dtype``.
+        """
+        inputs = self.model_package.adapter.load_reference_inputs()
+        if inputs is None or len(inputs) == 0:
+            return None
+
+        delta = 0.0
+        with torch.no_grad():
+            for start in range(0, len(inputs), batch_size):
+                batch = torch.from_numpy(np.ascontiguousarray(inputs[start:start + batch_size],
+                                                              dtype=np.float32)).to(self.device)
+                expected = self.model(batch).float()
+                with self._autocast(dtype):
+                    scores = self.model(batch.to(dtype)).float()
+                delta = max(delta, (scores - expected).abs().max().item())
+        return delta
+
+    def _autocast(self, dtype=None):
+        """Return a context manager running the forward pass in a precision.
+
+        Parameters
+        ----------
+        dtype : `torch.dtype`, optional
+            Precision; defaults to that selected by `init_precision`.
+            Autocast is disabled for float32.
+        """
+        dtype = dtype or self.dtype
+        return torch.autocast(self.device.split(':')[0], dtype=dtype, enabled=dtype != torch.float32)
+
+    def preprocess(self, blob):
+        """Normalize a batch of inputs in place, according to the model
+        package metadata.
+
+        Each channel is multiplied by its scale factor times the boost
+        factor, then non-finite values are replaced as in
+        `numpy.nan_to_num`.
+
+        Parameters
+        ----------
+        blob : `torch.Tensor`, (N, 3, height, width)
+            Batch of inputs, as returned by `prepare_input`.
 
-        # Put the model in evaluation mode instead of training model.
-        self.model.eval()
+        Returns
+        -------
+        blob : `torch.Tensor`
+            ``blob``, normalized; unchanged if the model does not expect
+            normalized input.
+        """
+        if self._input_factors is not None:
+            blob.mul_(self._input_factors)
+            blob.nan_to_num_()
+        return blob
 
     def input_to_batches(self, inputs, batchSize):
         """Convert a list of inputs to a generator of batches.
 
         Parameters
         ----------
-        inputs : `list` [`CutoutInputs`]
+        inputs : `list` [`CutoutInputs`] or `numpy.ndarray`
             Inputs to be scored.
 
         Returns
@@ -104,13 +346,176 @@ class RBTransiNetInterface:
         for i in range(0, len(inputs), batchSize):
             yield inputs[i:i + batchSize]
 
-    def prepare_input(self, inputs):
+    def estimate_sample_nbytes(self, shape):
+        """Estimate the memory needed to score a single cutout triplet.
+
+        The estimate is the size of the input plus the sum of the outputs of
+        every leaf module of the network, measured by running the model on a
+        single blank input. It is an upper bound of the peak activation
+        memory, as not all intermediate outputs are alive at the same time.
+        Compiled models have no modules to measure; the total memory they
+        allocate is profiled instead. Models run by ONNX Runtime are
+        estimated from the PyTorch model of their package.
+
+        Parameters
+        ----------
+        shape : `tuple` [`int`]
+            Shape of a single cutout, (height, width).
+
+        Returns
+        -------
+        nbytes : `int`
+            Estimated number of bytes per input object.
+        """
+        sample = torch.zeros((1, 3, *shape), dtype=torch.float32, device=self.device)
+        nbytes = sample.numel() * sample.element_size()
+
+        model = self.model
+        if isinstance(model, OnnxRuntimeModel):
+            model = self.model_package.load(self.device, prefer_compiled=False).eval()
+
+        if isinstance(model, torch.jit.ScriptModule):
+            if self.device.startswith('cuda'):
+                baseline = torch.cuda.memory_allocated(self.device)
+                torch.cuda.reset_peak_memory_stats(self.device)
+                with torch.no_grad():
+                    model(sample)
+                return nbytes + torch.cuda.max_memory_allocated(self.device) - baseline
+
+            profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                              profile_memory=True)
+            with torch.no_grad(), profiler as profile:
+                model(sample)
+            return nbytes + sum(max(0, event.self_cpu_memory_usage) for event in profile.events())
+
+        def count_output(module, args, output):
+            nonlocal nbytes
+            outputs = output if isinstance(output, (tuple, list)) else (output,)
+            nbytes += sum(t.numel() * t.element_size() for t in outputs if isinstance(t, torch.Tensor))
+
+        hooks = [module.register_forward_hook(count_output)
+                 for module in model.modules() if not any(module.children())]
+        try:
+            with torch.no_grad():
+                model(sample)
+        finally:
+            for hook in hooks:
+                hook.remove()
+        return nbytes
+
+    def _probe_batch_sizes(self, shape, candidates):
+        """Return the batch size with the highest measured throughput.
+
+        Parameters
+        ----------
+        shape : `tuple` [`int`]
+            Shape of a single cutout, (height, width).
+        candidates : `list` [`int`]
+            Batch sizes to try.
+
+        Returns
+        -------
+        batch_size : `int`
+            The fastest of ``candidates``, in cutouts per second.
+        """
+        best_size, best_rate = candidates[0], 0.0
+        for size in sorted(candidates):
+            blob = torch.zeros((size, 3, *shape), dtype=self.dtype, device=self.device)
+            with torch.no_grad(), self._autocast():
+                # The first pass includes one-off costs, e.g. allocator warmup.
+                self.model(blob)
+                start = time.perf_counter()
+                self.model(blob)
+                rate = size / (time.perf_counter() - start)
+            self.task.log.debug("Batch size %d: %.1f cutouts/s.", size, rate)
+            if rate > best_rate:
+                best_size, best_rate = size, rate
+        return best_size
+
+    def get_batch_size(self, shape):
+        """Return the number of cutouts to score per forward pass, following
+        the batching policy of the task config.
+
+        The chosen size is also recorded as ``batchSize`` in the task
+        metadata.
+
+        Parameters
+        ----------
+        shape : `tuple` [`int`]
+            Shape of a single cutout, (height, width).
+
+        Returns
+        -------
+        batch_size : `int`
+            Number of cutouts per batch.
+        """
+        config = self.task.config
+        if config.batchSizeMode == 'fixed':
+            self.task.metadata["batchSize"] = config.batchSize
+            return config.batchSize
+
+        policy = (tuple(shape), config.batchSizeMode, config.batchMaxBytes,
+                  tuple(config.batchAutoTuneSizes), self.dtype)
+        chosen = _chosen_batch_sizes.setdefault(self.model, {})
+        if policy not in chosen:
+            max_size = None
+            if config.batchMaxBytes is not None:
+                max_size = max(1, config.batchMaxBytes // self.estimate_sample_nbytes(shape))
+
+            if config.batchSizeMode == 'memory':
+                chosen[policy] = max_size
+            else:
+                candidates = [size for size in config.batchAutoTuneSizes
+                              if max_size is None or size <= max_size] or [max_size or 1]
+                chosen[policy] = self._probe_batch_sizes(shape, candidates)
+            self.task.log.info("Chose a batch size of %d for %s cutouts (%s mode).",
+                               chosen[policy], shape, config.batchSizeMode)
+        self.task.metadata["batchSize"] = chosen[policy]
+        return chosen[policy]
+
+    def _get_input_buffer(self, n, shape):
+        """Return a view of the reusable input buffer, allocating it if it is
+        missing or too small.
+
+        Parameters
+        ----------
+        n : `int`
+            Number of cutout triplets to hold.
+        shape : `tuple` [`int`]
+            Shape of a single cutout, (height, width).
+
+        Returns
+        -------
+        buffer : `torch.Tensor`, (n, 3, height, width)
+            View of the first ``n`` entries of the buffer.
+        """
+        if (self._input_buffer is None or self._input_buffer.shape[0] < n
+                or tuple(self._input_buffer.shape[2:]) != tuple(shape)
+                or self._input_buffer.dtype != self.dtype):
+            # Page-locked memory speeds up (and allows asynchronous) copies
+            # to the GPU, but is neither needed nor available on CPU only.
+            self._input_buffer = torch.empty((n, 3, *shape), dtype=self.dtype,
+                                             pin_memory=self.device.startswith('cuda'))
+        return self._input_buffer[:n]
+
+    def prepare_input(self, inputs, overwrite_inputs=False):
         """Convert inputs from numpy arrays, etc. to a torch.tensor blob.
 
+        The cutouts are copied, once, into a buffer that is allocated on the
+        first call and reused by subsequent calls, so the returned blob is
+        only valid until the next call. That copy also converts them to the
+        precision selected by `init_precision`.
+
         Parameters
         ----------
-        inputs : `list` [`CutoutInputs`]
-            Inputs to be scored.
+        inputs : `list` [`CutoutInputs`] or `numpy.ndarray`
+            Inputs to be scored; either a list of `CutoutInputs`, or an array
+            of shape (N, 3, height, width) holding the difference, science
+            and template cutouts of each object, in that order.
+        overwrite_inputs : `bool`, optional
+            Whether an array of inputs may be used as the blob itself, and
+            therefore be modified by `preprocess`. If `False`, such arrays
+            are copied whenever inputs are normalized.
 
         Returns
         -------
@@ -119,70 +524,126 @@ class RBTransiNetInterface:
         labels
             Truth labels, concatenated into a single list.
         """
-        cutoutsList = []
+        if isinstance(inputs, np.ndarray):
+            blob = torch.from_numpy(np.ascontiguousarray(inputs, dtype=np.float32))
+            if (blob.device.type != self.device.split(':')[0] or blob.dtype != self.dtype
+                    or (self._input_factors is not None and not overwrite_inputs)):
+                # Stage through the pinned buffer for a fast host to device
+                # copy, to convert to reduced precision, or to preserve the
+                # inputs.
+                blob = self._get_input_buffer(len(inputs), inputs.shape[2:]).copy_(blob)
+            return blob, [None]*len(inputs)
+
+        blob = self._get_input_buffer(len(inputs), inputs[0].science.shape)
         labelsList = []
-        for inp in inputs:
-            # Convert each cutout to a torch tensor
-            template = torch.from_numpy(inp.template)
-            science = torch.from_numpy(inp.science)
-            difference = torch.from_numpy(inp.difference)
-
-            # Stack the components to create a single blob
-            # dimensions should be 3 x width x height
-            singleBlob = torch.stack([difference, science, template], dim=0)
-
-            # And append them to the temporary list
-            cutoutsList.append(singleBlob)
-
-            labelsList.append(inp.label)
-
-        blob = torch.stack(cutoutsList)
+        if self.dtype == torch.float32:
+            # Numpy view of the same memory, to write the cutouts with no
+            # intermediate tensors.
+            array = blob.numpy()
+            for i, inp in enumerate(inputs):
+                # dimensions should be 3 x width x height
+                array[i, 0] = inp.difference
+                array[i, 1] = inp.science
+                array[i, 2] = inp.template
+
+                labelsList.append(inp.label)
+        else:
+            # Numpy has no reduced-precision types to view the buffer with;
+            # convert while copying instead.
+            for i, inp in enumerate(inputs):
+                blob[i, 0].copy_(torch.from_numpy(np.asarray(inp.difference)))
+                blob[i, 1].copy_(torch.from_numpy(np.asarray(inp.science)))
+                blob[i, 2].copy_(torch.from_numpy(np.asarray(inp.template)))
+
+                labelsList.append(inp.label)
 
         return blob, labelsList
 
-    def infer(self, inputs):
+    def infer(self, inputs, out=None, overwrite_inputs=False):
         """Return the score of this cutout.
 
         Parameters
         ----------
-        inputs : `list` [`CutoutInputs`]
-            Inputs to be scored.
+        inputs : `list` [`CutoutInputs`] or `numpy.ndarray`
+            Inputs to be scored, in any form accepted by `prepare_input`.
+        out : `numpy.ndarray`, optional
+            Array of length ``len(inputs)`` to write the scores into, e.g. the
+            score column of an output catalog. A new float32 array is
+            allocated if not provided.
+        overwrite_inputs : `bool`, optional
+            Whether an array of inputs may be normalized in place; see
+            `prepare_input`.
 
         Returns
         -------
         scores : `numpy.array`
-            Float scores for each element of ``inputs``.
+            Float scores for each element of ``inputs``; ``out`` if it was
+            provided.
         """
+        if out is None:
+            out = np.empty(len(inputs), dtype=np.float32)
+        elif len(out) != len(inputs):
+            raise ValueError(f"Output array has length {len(out)}, expected {len(inputs)}.")
 
         # Handle empty inputs gracefully.
-        if not inputs:
-            return np.array([])
+        if len(inputs) == 0:
+            return out
 
         # Convert the inputs to batches.
-        # TODO: The batch size is set to 64 for now. Later when
-        # deploying parallel instances of the task, memory limits
-        # should be taken into account, if necessary.
-        batch_size = 64
+        shape = inputs.shape[2:] if isinstance(inputs, np.ndarray) else inputs[0].science.shape
+        batch_size = self.get_batch_size(shape)
         batches = self.input_to_batches(inputs, batchSize=batch_size)
 
+        return self.infer_batches(batches, out, n_batches=math.ceil(len(inputs) / batch_size),
+                                  overwrite_inputs=overwrite_inputs)
+
+    def infer_batches(self, batches, out, n_batches=None, overwrite_inputs=False):
+        """Score a stream of batches, writing the scores consecutively.
+
+        Parameters
+        ----------
+        batches : iterable
+            Batches of inputs, each in any form accepted by `prepare_input`.
+            May be a generator that produces the batches while the previous
+            ones are being scored.
+        out : `numpy.ndarray`
+            Array to write the scores into; its length must be the total
+            number of inputs in ``batches``.
+        n_batches : `int`, optional
+            Number of batches, only used for progress logging.
+        overwrite_inputs : `bool`, optional
+            Whether arrays of inputs may be normalized in place; see
+            `prepare_input`.
+
+        Returns
+        -------
+        scores : `numpy.ndarray`
+            ``out``, filled in.
+        """
         # Log every 10 seconds as proof of liveness.
         logger = lsst.utils.logging.PeriodicLogger(self.task.log, interval=10.0)
-        n_batches = math.ceil(len(inputs) / batch_size)
 
         # Loop over the batches
+        start = 0
         for i, batch in enumerate(batches):
-            logger.log("%s/%s batches have been scored.", i, n_batches)
-            torchBlob, labelsList = self.prepare_input(batch)
-
-            # Run the model
-            with torch.no_grad():
-                output = self.model(torchBlob)
-
-            # And append the results to the list
-            if i == 0:
-                scores = output
-            else:
-                scores = torch.cat((scores, output.cpu()), dim=0)
-
-        npyScores = scores.detach().numpy().ravel()
-        return npyScores
+            logger.log("%s/%s batches have been scored.", i, n_batches or "?")
+            with self.timers.stage('assembly'):
+                torchBlob, labelsList = self.prepare_input(batch, overwrite_inputs=overwrite_inputs)
+                torchBlob = self.preprocess(torchBlob.to(self.device, non_blocking=True))
+
+            with self.timers.stage('forward'):
+                # Run the model
+                with torch.no_grad(), self._autocast():
+                    output = self.model(torchBlob)
+
+                # And write the results to their slice of the output.
+                out[start:start + len(batch)] = output.float().cpu().numpy().ravel()
+            start += len(batch)
+
+            self.timers.count('nBatches')
+            self.timers.count('nCutouts', len(batch))
+            self.timers.count('inputBytes', torchBlob.numel() * torchBlob.element_size())
+
+        if start != len(out):
+            raise ValueError(f"Scored {start} inputs, but the output array has length {len(out)}.")
+        return out
@@ -21,6 +21,12 @@
 
 __all__ = ["RBTransiNetTask", "RBTransiNetConfig"]
 
+import dataclasses
+import math
+import queue
+import threading
+
+from lsst.daf.butler import DeferredDatasetHandle
 import lsst.geom
 import lsst.pex.config
 import lsst.pipe.base
@@ -28,9 +34,123 @@ from lsst.utils.timer import timeMethod
 import numpy as np
 
 from . import rbTransiNetInterface
+from .stageTimers import StageTimers
 from lsst.meas.transiNet.modelPackages.storageAdapterButler import StorageAdapterButler
 
 
+def _prefetch(iterable, depth):
+    """Iterate over ``iterable`` in a background thread.
+
+    Up to ``depth`` items are produced ahead of the consumer, so that
+    producing the next items overlaps with processing the current one.
+
+    Parameters
+    ----------
+    iterable : iterable
+        Items to produce.
+    depth : `int`
+        Maximum number of items waiting to be consumed.
+
+    Yields
+    ------
+    item
+        The items of ``iterable``, in order.
+
+    Raises
+    ------
+    Exception
+        Any exception raised while producing the items is re-raised in the
+        consumer.
+    """
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(entry):
+        # Do not block forever if the consumer has gone away.
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((done, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _split_runs(starts, ends, gap):
+    """Split sorted intervals into runs of overlapping or nearby ones.
+
+    Parameters
+    ----------
+    starts, ends : `numpy.ndarray` [`int`]
+        First and last coordinate of each interval, sorted by ``starts``.
+    gap : `int`
+        Intervals separated by at most this much from the previous ones are
+        in the same run.
+
+    Returns
+    -------
+    runs : `list` [`numpy.ndarray`]
+        Indices of the intervals of each run.
+    """
+    reach = np.maximum.accumulate(ends)
+    breaks = np.flatnonzero(starts[1:] > reach[:-1] + gap) + 1
+    return np.split(np.arange(len(starts)), breaks)
+
+
+def _rebatch(chunks, batch_size):
+    """Regroup a stream of arrays into arrays of exactly ``batch_size`` rows.
+
+    Parameters
+    ----------
+    chunks : iterable [`numpy.ndarray`]
+        Arrays to regroup along their first axis.
+    batch_size : `int`
+        Number of rows per output array.
+
+    Yields
+    ------
+    batch : `numpy.ndarray`
+        The next ``batch_size`` rows of ``chunks``; the last batch may be
+        shorter.
+    """
+    pending, n_pending = [], 0
+    for chunk in chunks:
+        while len(chunk) > 0:
+            take = min(batch_size - n_pending, len(chunk))
+            pending.append(chunk[:take])
+            n_pending += take
+            chunk = chunk[take:]
+            if n_pending == batch_size:
+                yield pending[0] if len(pending) == 1 else np.concatenate(pending)
+                pending, n_pending = [], 0
+    if n_pending > 0:
+        yield pending[0] if len(pending) == 1 else np.concatenate(pending)
+
+
 class RBTransiNetConnections(lsst.pipe.base.PipelineTaskConnections,
                              dimensions=("instrument", "visit", "detector"),
                              defaultTemplates={"coaddName": "deep", "fakesType": ""}):
@@ -82,6 +202,12 @@ class RBTransiNetConnections(lsst.pipe.base.PipelineTaskConnections,
         if self.config.modelPackageStorageMode != "butler":
             del self.pretrainedModel
 
+        if self.config.inputReadMode != "exposure":
+            # The task reads the parts of the exposures it needs itself.
+            self.template = dataclasses.replace(self.template, deferLoad=True)
+            self.science = dataclasses.replace(self.science, deferLoad=True)
+            self.difference = dataclasses.replace(self.difference, deferLoad=True)
+
 
 class RBTransiNetConfig(lsst.pipe.base.PipelineTaskConfig, pipelineConnections=RBTransiNetConnections):
     modelPackageName = lsst.pex.config.Field(
@@ -103,8 +229,211 @@ class RBTransiNetConfig(lsst.pipe.base.PipelineTaskConfig, pipelineConnections=R
         doc="Width/height of square cutouts to send to classifier.",
         default=51,
     )
+    edgeCutouts = lsst.pex.config.ChoiceField(
+        dtype=str,
+        doc=("How to make the cutouts of sources whose centroid is in the science exposure, "
+             "but whose cutout box is partly outside of it."),
+        allowed={'skip': 'treat them as out of bounds; see outOfBoundsScore',
+                 'constant': 'pad the in-bounds part of the box with edgePadValue',
+                 'reflect': 'pad the in-bounds part of the box by reflecting the images about their edges',
+                 },
+        default='skip',
+    )
+    edgePadValue = lsst.pex.config.Field(
+        dtype=float,
+        doc="Value of the missing pixels of edge cutouts, in the 'constant' edgeCutouts mode.",
+        default=0.0,
+    )
+    outOfBoundsScore = lsst.pex.config.Field(
+        dtype=float,
+        doc=("Score given to sources whose cutouts do not fit in the science exposure (unless "
+             "padded; see edgeCutouts), or that have no finite centroid. Such sources are not "
+             "scored by the model, and are flagged with flag_outOfBounds in the output catalog."),
+        default=-1.0,
+    )
+    inputReadMode = lsst.pex.config.ChoiceField(
+        dtype=str,
+        doc="How much of the template, science and difference exposures to read from the butler.",
+        allowed={'exposure': 'the full exposures, with all their components',
+                 'image': 'only the image component of each exposure',
+                 'regions': ('only the image pixels within the cutout boxes of the sources, '
+                             'merged into a few regions; see regionMergeGap'),
+                 },
+        default='exposure',
+    )
+    regionMergeGap = lsst.pex.config.Field(
+        dtype=int,
+        doc=("Cutout boxes separated by at most this many pixels are read from the butler "
+             "together, in the 'regions' inputReadMode. Larger gaps mean fewer, larger reads."),
+        default=64,
+        check=lambda x: x >= 0,
+    )
+    batchSizeMode = lsst.pex.config.ChoiceField(
+        dtype=str,
+        doc="How to choose the number of cutouts scored together in one forward pass.",
+        allowed={'fixed': 'always use batchSize',
+                 'memory': ('the largest batch whose inputs and activations fit in '
+                            'batchMaxBytes'),
+                 'auto': ('the size among batchAutoTuneSizes with the best measured '
+                          'throughput, probed once per model and cutout shape'),
+                 },
+        default='fixed',
+    )
+    batchSize = lsst.pex.config.Field(
+        dtype=int,
+        doc="Number of cutouts per batch, in the 'fixed' batchSizeMode.",
+        default=64,
+        check=lambda x: x > 0,
+    )
+    batchMaxBytes = lsst.pex.config.Field(
+        dtype=int,
+        optional=True,
+        doc=("Memory budget, in bytes, for the inputs and activations of a single batch. "
+             "Required in the 'memory' batchSizeMode; caps the probed sizes in the 'auto' mode."),
+        default=None,
+    )
+    batchAutoTuneSizes = lsst.pex.config.ListField(
+        dtype=int,
+        doc="Candidate batch sizes probed in the 'auto' batchSizeMode.",
+        default=[8, 16, 32, 64, 128, 256],
+    )
+    streamCutouts = lsst.pex.config.Field(
+        dtype=bool,
+        doc=("Extract cutouts batch by batch in a background thread while the previous "
+             "batches are being scored, instead of extracting all cutouts up front. "
+             "Peak memory then scales with the batch size instead of the number of sources."),
+        default=False,
+    )
+    streamQueueDepth = lsst.pex.config.Field(
+        dtype=int,
+        doc="Maximum number of extracted batches waiting to be scored, when streaming cutouts.",
+        default=2,
+        check=lambda x: x > 0,
+    )
+    numThreads = lsst.pex.config.Field(
+        dtype=int,
+        doc=("Number of PyTorch intra-op threads used for CPU inference; 0 keeps the "
+             "PyTorch default of one thread per core, which oversubscribes the node when "
+             "several processes run on it. See "
+             "`lsst.meas.transiNet.recommended_thread_settings`."),
+        default=0,
+        check=lambda x: x >= 0,
+    )
+    numInteropThreads = lsst.pex.config.Field(
+        dtype=int,
+        doc="Number of PyTorch inter-op threads; 0 keeps the PyTorch default.",
+        default=0,
+        check=lambda x: x >= 0,
+    )
+    cpuAffinity = lsst.pex.config.ListField(
+        dtype=int,
+        optional=True,
+        doc="CPUs to pin the process to before inference; None keeps the current affinity.",
+        default=None,
+    )
+    useCompiledModel = lsst.pex.config.Field(
+        dtype=bool,
+        doc=("Load the compiled (TorchScript) model stored in the model package, when there "
+             "is one, instead of building the model from its architecture and checkpoint."),
+        default=True,
+    )
+    torchCompile = lsst.pex.config.Field(
+        dtype=bool,
+        doc="Compile models built from their architecture and checkpoint with torch.compile.",
+        default=False,
+    )
+    quantization = lsst.pex.config.ChoiceField(
+        dtype=str,
+        optional=True,
+        doc=("Post-training int8 quantization of the model, for CPU inference. The "
+             "quantized model stored in the model package is used if there is one. "
+             "None runs the float model."),
+        allowed={'dynamic': 'int8 weights for the Linear layers, activations quantized on the fly',
+                 'static': ('int8 weights and activations, calibrated on the reference inputs '
+                            'of the model package'),
+                 },
+        default=None,
+    )
+    inferenceBackend = lsst.pex.config.ChoiceField(
+        dtype=str,
+        doc=("Library running the forward pass. Non-torch backends run on CPU, "
+             "in float32, with no quantization."),
+        allowed={'torch': 'PyTorch',
+                 'onnxruntime': ('ONNX Runtime, on the ONNX graph stored in the model package '
+                                 '(see export_onnx), or else exported slowly from its PyTorch '
+                                 'model on every load; needs onnxruntime'),
+                 },
+        default='torch',
+    )
+    inferencePrecision = lsst.pex.config.ChoiceField(
+        dtype=str,
+        doc=("Floating-point precision of the forward pass. Reduced precisions run "
+             "under autocast, and are checked at load time against float32 on the "
+             "reference inputs of the model package; see precisionTolerance."),
+        allowed={'float32': 'full precision',
+                 'bfloat16': 'bfloat16 inputs and autocast, e.g. for CPUs with native bfloat16',
+                 'float16': 'float16 inputs and autocast, e.g. for GPUs',
+                 },
+        default='float32',
+    )
+    precisionTolerance = lsst.pex.config.Field(
+        dtype=float,
+        doc=("Maximum absolute score difference between reduced-precision and float32 "
+             "inference allowed on the reference inputs of the model package."),
+        default=0.01,
+    )
+    precisionGuard = lsst.pex.config.ChoiceField(
+        dtype=str,
+        doc=("What to do when reduced-precision scores exceed precisionTolerance, or "
+             "cannot be checked because the model package has no reference inputs. Models "
+             "that fail to run in reduced precision run in float32, unless this is 'raise'."),
+        allowed={'fallback': 'log a warning and run in float32',
+                 'warn': 'log a warning and run in reduced precision anyway',
+                 'raise': 'raise an exception',
+                 },
+        default='fallback',
+    )
+    sharedMemoryWeights = lsst.pex.config.Field(
+        dtype=bool,
+        doc=("Share the weights of models built from their architecture and checkpoint "
+             "among all processes of a user on a node, e.g. the workers of a multiprocessing "
+             "pool, through a private shared memory file published by the first process to "
+             "load them. The file is kept for later runs while any process is attached to it, "
+             "and is removed once it has been unused for an hour; see "
+             "lsst.meas.transiNet.modelPackages.sharedWeights."),
+        default=False,
+    )
+    recordStageTimings = lsst.pex.config.Field(
+        dtype=bool,
+        doc=("Record the time spent in each stage of a run (modelLoad, read, cutout, assembly, "
+             "forward, catalog and the whole scoring), and the number of cutouts, batches and "
+             "input bytes scored, the throughput and the peak resident set size, as numbers "
+             "in the task metadata. See `lsst.meas.transiNet.StageTimers`."),
+        default=False,
+    )
+    useModelCache = lsst.pex.config.Field(
+        dtype=bool,
+        doc=("Reuse models already loaded by this process instead of reloading "
+             "the model package on every run."),
+        default=True,
+    )
+    modelCacheMaxEntries = lsst.pex.config.Field(
+        dtype=int,
+        doc="Maximum number of models kept in the process-wide model cache.",
+        default=2,
+    )
+    modelCacheMaxBytes = lsst.pex.config.Field(
+        dtype=int,
+        optional=True,
+        doc=("Maximum total size, in bytes, of the models kept in the process-wide "
+             "model cache. None means no limit."),
+        default=None,
+    )
 
     def validate(self):
+        if self.batchSizeMode == 'memory' and self.batchMaxBytes is None:
+            raise ValueError("batchMaxBytes must be set when batchSizeMode is 'memory'.")
+
         # if we are in the butler mode, the user should not set
         # a modelPackageName as a config field.
         if self.modelPackageStorageMode == "butler":
@@ -127,33 +456,190 @@ class RBTransiNetTask(lsst.pipe.base.PipelineTask):
         super().__init__(**kwargs)
 
         self.butler_loaded_package = None
+        # Replaced at the start of every run; see `_record_stage_timings`.
+        self.timers = StageTimers(enabled=False)
 
     @timeMethod
     def run(self, template, science, difference, diaSources, pretrainedModel=None):
+        """Score the sources of a catalog.
+
+        Parameters
+        ----------
+        template : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+        science : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+        difference : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+            Exposures to cut images out of, or handles to read them from,
+            as configured by ``inputReadMode``.
+        diaSources : `lsst.afw.table.SourceCatalog`
+            Sources to score.
+        pretrainedModel : `NNModelPackagePayload`, optional
+            The pretrained model package, in the butler storage mode.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            ``classifications``
+                Catalog of the scores, element-wise aligned with
+                ``diaSources`` (`lsst.afw.table.BaseCatalog`).
+        """
+        self.timers = StageTimers(enabled=self.config.recordStageTimings)
 
         # Create the TransiNet interface object.
-        # Note: assuming each quanta creates one instance of this task, this is
-        # a proper place for doing this since loading of the model is run only
-        # once. However, if in the future we come up with a design in which one
-        # task instance is used for multiple quanta, this will need to be moved
-        # somewhere else -- e.g. to the __init__ method, or even to runQuantum.
+        # Note: the network itself is taken from the process-wide model cache
+        # (unless disabled in the config), so creating the interface on every
+        # run only reloads the model package the first time it is used by
+        # this process.
+        self.butler_loaded_package = pretrainedModel  # This will be used by the interface
+        self.interface = rbTransiNetInterface.RBTransiNetInterface(self)
+
+        with self.timers.stage('catalog'):
+            classifications = self._make_classifications(diaSources)
+        # Sources whose cutouts would be blank are left out of inference.
+        bbox = self._get_bbox(science)
+        valid = self._find_valid_cutouts(bbox, diaSources)
+        n_valid = np.count_nonzero(valid)
+        # Score straight into the output catalog's column, unless some
+        # sources are left out.
+        scores = classifications["score"] if n_valid == len(valid) else np.empty(n_valid, dtype=np.float32)
+        with self.timers.stage('scoring'):
+            if self.config.streamCutouts:
+                batch_size = self.interface.get_batch_size((self.config.cutoutSize, self.config.cutoutSize))
+                batches = self._iter_cutout_batches(template, science, difference, diaSources, batch_size,
+                                                    mask=valid, bbox=bbox)
+                self.interface.infer_batches(_prefetch(batches, self.config.streamQueueDepth),
+                                             out=scores, overwrite_inputs=True)
+            else:
+                cutouts = self._make_cutouts_batch(template, science, difference, diaSources, mask=valid,
+                                                   bbox=bbox)
+                self.log.info("Extracted %d cutouts.", len(cutouts))
+
+                self.interface.infer(cutouts, out=scores, overwrite_inputs=True)
+        if n_valid != len(valid):
+            with self.timers.stage('catalog'):
+                self._set_scores(classifications, valid, scores)
+        self.log.info("Scored %d cutouts; %d sources were out of bounds.", n_valid, len(valid) - n_valid)
+        self._record_stage_timings()
+
+        return lsst.pipe.base.Struct(classifications=classifications)
+
+    def runMany(self, inputs, pretrainedModel=None):
+        """Score the sources of many quanta (e.g. all the detectors of a
+        visit) together.
+
+        The cutouts of all quanta are pooled into full batches, scored with a
+        single instance of the model, and split back into one catalog per
+        quantum. Only the last batch of all quanta may be partial.
+
+        Parameters
+        ----------
+        inputs : `list` [`tuple`]
+            One (template, science, difference, diaSources) tuple per
+            quantum, with the same meaning as the arguments of `run`.
+        pretrainedModel : `NNModelPackagePayload`, optional
+            The pretrained model package, in the butler storage mode.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            ``classifications``
+                One catalog per element of ``inputs``, in the same order,
+                as returned by `run` (`list` [`lsst.afw.table.BaseCatalog`]).
+        """
+        self.timers = StageTimers(enabled=self.config.recordStageTimings)
         self.butler_loaded_package = pretrainedModel  # This will be used by the interface
         self.interface = rbTransiNetInterface.RBTransiNetInterface(self)
 
-        cutouts = [self._make_cutouts(template, science, difference, source) for source in diaSources]
-        self.log.info("Extracted %d cutouts.", len(cutouts))
-        scores = self.interface.infer(cutouts)
-        self.log.info("Scored %d cutouts.", len(scores))
+        with self.timers.stage('catalog'):
+            catalogs = [self._make_classifications(diaSources) for _, _, _, diaSources in inputs]
+        bboxes = [self._get_bbox(science) for _, science, _, _ in inputs]
+        masks = [self._find_valid_cutouts(bbox, diaSources)
+                 for bbox, (_, _, _, diaSources) in zip(bboxes, inputs)]
+        offsets = np.cumsum([0] + [np.count_nonzero(valid) for valid in masks])
+
+        batch_size = self.interface.get_batch_size((self.config.cutoutSize, self.config.cutoutSize))
+        chunks = (chunk
+                  for (template, science, difference, diaSources), valid, bbox in zip(inputs, masks, bboxes)
+                  for chunk in self._iter_cutout_batches(template, science, difference, diaSources,
+                                                         batch_size, mask=valid, bbox=bbox))
+        batches = _rebatch(chunks, batch_size)
+        if self.config.streamCutouts:
+            batches = _prefetch(batches, self.config.streamQueueDepth)
+
+        with self.timers.stage('scoring'):
+            scores = self.interface.infer_batches(batches, out=np.empty(offsets[-1], dtype=np.float32),
+                                                  n_batches=math.ceil(offsets[-1] / batch_size),
+                                                  overwrite_inputs=True)
+        with self.timers.stage('catalog'):
+            for catalog, valid, start, end in zip(catalogs, masks, offsets[:-1], offsets[1:]):
+                self._set_scores(catalog, valid, scores[start:end])
+        self.log.info("Scored %d cutouts from %d quanta; %d sources were out of bounds.", offsets[-1],
+                      len(inputs), sum(len(valid) for valid in masks) - offsets[-1])
+        self._record_stage_timings()
+
+        return lsst.pipe.base.Struct(classifications=catalogs)
+
+    def _record_stage_timings(self):
+        """Record the stage timers and counters of the last run in the task
+        metadata, along with the throughput of scoring as
+        ``cutoutsPerSecond``.
+        """
+        if not self.timers.enabled:
+            return
+        self.timers.to_metadata(self.metadata)
+        scoring_time = self.timers.times.get('scoring', 0.0)
+        if scoring_time > 0:
+            self.metadata["cutoutsPerSecond"] = self.timers.counters['nCutouts'] / scoring_time
+
+    def _make_classifications(self, diaSources):
+        """Create the output catalog of the scores of a set of sources.
+
+        Parameters
+        ----------
+        diaSources : `lsst.afw.table.SourceCatalog`
+            The sources to be scored.
+
+        Returns
+        -------
+        classifications : `lsst.afw.table.BaseCatalog`
+            Catalog element-wise aligned with ``diaSources``, with the ids
+            filled in and the scores left to be written.
+        """
         schema = lsst.afw.table.Schema()
         schema.addField(diaSources.schema["id"].asField())
         schema.addField("score", doc="real/bogus score of this source", type=np.float32)
+        schema.addField("flag_outOfBounds", type="Flag",
+                        doc="the cutout of this source is out of the bounds of the science exposure, "
+                            "so the source was not scored; its score is the configured "
+                            "outOfBoundsScore")
         classifications = lsst.afw.table.BaseCatalog(schema)
-        classifications.resize(len(scores))
+        classifications.resize(len(diaSources))
 
         classifications["id"] = diaSources["id"]
-        classifications["score"] = scores
+        return classifications
 
-        return lsst.pipe.base.Struct(classifications=classifications)
+    def _set_scores(self, classifications, valid, scores):
+        """Write the scores of the valid sources of a catalog, and flag the
+        others.
+
+        Parameters
+        ----------
+        classifications : `lsst.afw.table.BaseCatalog`
+            Catalog returned by `_make_classifications`.
+        valid : `numpy.ndarray` [`bool`]
+            Which sources of the catalog were scored.
+        scores : `numpy.ndarray`
+            Scores of the valid sources, in order.
+        """
+        if valid.all():
+            classifications["score"] = scores
+            return
+        column = classifications["score"]
+        column[valid] = scores
+        column[~valid] = self.config.outOfBoundsScore
+        classifications["flag_outOfBounds"] = ~valid
 
     def _make_cutouts(self, template, science, difference, source):
         """Return cutouts of each image centered at the source location.
@@ -182,6 +668,11 @@ class RBTransiNetTask(lsst.pipe.base.PipelineTask):
             science_cutout = np.nan_to_num(science.Factory(science, box).image.array)
             template_cutout = np.nan_to_num(template.Factory(template, box).image.array)
             difference_cutout = np.nan_to_num(difference.Factory(difference, box).image.array)
+        elif (self.config.edgeCutouts != 'skip'
+              and lsst.geom.Box2D(science.getBBox()).contains(source.getCentroid())):
+            science_cutout = self._make_edge_cutout(science, box, science.getBBox())
+            template_cutout = self._make_edge_cutout(template, box, science.getBBox())
+            difference_cutout = self._make_edge_cutout(difference, box, science.getBBox())
         else:
             science_cutout = np.zeros((self.config.cutoutSize, self.config.cutoutSize), dtype=np.float32)
             template_cutout = np.zeros_like(science_cutout)
@@ -190,3 +681,440 @@ class RBTransiNetTask(lsst.pipe.base.PipelineTask):
         return rbTransiNetInterface.CutoutInputs(science=science_cutout,
                                                  template=template_cutout,
                                                  difference=difference_cutout)
+
+    def _make_edge_cutout(self, exposure, box, bbox):
+        """Return the cutout of a box partly outside an exposure, padded as
+        configured by ``edgeCutouts``.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.ExposureF`
+            Exposure to cut the image out of.
+        box : `lsst.geom.Box2I`
+            The cutout box.
+        bbox : `lsst.geom.Box2I`
+            The part of the exposure usable for cutouts.
+
+        Returns
+        -------
+        cutout : `numpy.ndarray`
+            The padded cutout, with non-finite values replaced as in
+            `numpy.nan_to_num`.
+        """
+        inner = lsst.geom.Box2I(box)
+        inner.clip(bbox)
+        widths = ((inner.getMinY() - box.getMinY(), box.getMaxY() - inner.getMaxY()),
+                  (inner.getMinX() - box.getMinX(), box.getMaxX() - inner.getMaxX()))
+        return np.nan_to_num(self._pad(exposure.Factory(exposure, inner).image.array, widths))
+
+    def _pad(self, array, widths):
+        """Pad an array as configured by ``edgeCutouts``.
+
+        Parameters
+        ----------
+        array : `numpy.ndarray`
+            The array to pad.
+        widths : `int` or `tuple`
+            Widths of the padding; see `numpy.pad`.
+
+        Returns
+        -------
+        padded : `numpy.ndarray`
+            A padded copy of ``array``.
+        """
+        if self.config.edgeCutouts == 'reflect':
+            return np.pad(array, widths, mode='reflect')
+        return np.pad(array, widths, mode='constant', constant_values=self.config.edgePadValue)
+
+    def _make_cutouts_batch(self, template, science, difference, diaSources, mask=None, bbox=None):
+        """Return cutouts of each image centered at every source location.
+
+        This is the vectorized equivalent of calling `_make_cutouts` on each
+        source of ``diaSources``, and gives bit-identical pixel values.
+
+        Parameters
+        ----------
+        template : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+        science : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+        difference : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+            Exposures to cut images out of, or handles to read their images
+            from; see `_load_images`.
+        diaSources : `lsst.afw.table.SourceCatalog`
+            Sources to make cutouts of.
+        mask : `numpy.ndarray` [`bool`], optional
+            Only make cutouts of the sources where this is `True`, e.g.
+            those returned by `_find_valid_cutouts`.
+        bbox : `lsst.geom.Box2I`, optional
+            Bounding box of the science exposure, if already known; see
+            `_get_bbox`.
+
+        Returns
+        -------
+        blobs : `numpy.ndarray`, (N, 3, cutoutSize, cutoutSize)
+            Cutouts of each source, stacked as difference, science, template
+            along the second axis (the channel order expected by
+            `lsst.meas.transiNet.RBTransiNetInterface`).
+        """
+        x, y = self._get_centroids(diaSources)
+        if mask is not None:
+            x, y = x[mask], y[mask]
+        bbox, regions, labels = self._load_images(template, science, difference, x, y, bbox=bbox)
+        with self.timers.stage('cutout'):
+            return self._extract_region_cutouts(regions, labels, bbox, x, y)
+
+    def _iter_cutout_batches(self, template, science, difference, diaSources, batch_size, mask=None,
+                             bbox=None):
+        """Generate the cutouts of a catalog of sources, batch by batch.
+
+        Parameters
+        ----------
+        template : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+        science : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+        difference : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+            Exposures to cut images out of, or handles to read their images
+            from; see `_load_images`.
+        diaSources : `lsst.afw.table.SourceCatalog`
+            Sources to make cutouts of.
+        batch_size : `int`
+            Number of sources per batch.
+        mask : `numpy.ndarray` [`bool`], optional
+            Only make cutouts of the sources where this is `True`.
+        bbox : `lsst.geom.Box2I`, optional
+            Bounding box of the science exposure, if already known.
+
+        Yields
+        ------
+        blobs : `numpy.ndarray`, (batch_size, 3, cutoutSize, cutoutSize)
+            Cutouts of the next ``batch_size`` sources, as returned by
+            `_make_cutouts_batch`; the last batch may be shorter.
+        """
+        x, y = self._get_centroids(diaSources)
+        if mask is not None:
+            x, y = x[mask], y[mask]
+        bbox, regions, labels = self._load_images(template, science, difference, x, y, bbox=bbox)
+        for start in range(0, len(x), batch_size):
+            batch = slice(start, start + batch_size)
+            with self.timers.stage('cutout'):
+                blobs = self._extract_region_cutouts(regions, labels[batch], bbox, x[batch], y[batch])
+            yield blobs
+
+    @staticmethod
+    def _get_centroids(diaSources):
+        """Return the centroids of a catalog of sources as arrays.
+
+        Parameters
+        ----------
+        diaSources : `lsst.afw.table.SourceCatalog`
+            Sources to get the centroids of.
+
+        Returns
+        -------
+        x, y : `numpy.ndarray`
+            Slot centroid coordinates of each source.
+        """
+        if not diaSources.isContiguous():
+            diaSources = diaSources.copy(deep=True)
+        return diaSources.getX(), diaSources.getY()
+
+    def _load_images(self, template, science, difference, x, y, bbox=None):
+        """Return the images to cut out of, as configured by
+        ``inputReadMode``.
+
+        Parameters
+        ----------
+        template : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+        science : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+        difference : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+            Exposures to cut images out of, or handles to read them from.
+            Only the image component is read from handles, and in the
+            'regions' mode only the pixels in the cutout boxes.
+        x, y : `numpy.ndarray`
+            Centroids of the cutouts, in parent pixel coordinates.
+        bbox : `lsst.geom.Box2I`, optional
+            Bounding box of the science exposure, if already known; read
+            from its handle otherwise.
+
+        Returns
+        -------
+        bbox : `lsst.geom.Box2I`
+            Bounding box of the science exposure.
+        regions : `list` [`tuple` [`lsst.afw.image.ImageF`]]
+            Difference, science and template images of each region read.
+        labels : `numpy.ndarray` [`int`]
+            Index of the region of each cutout in ``regions``; -1 for
+            cutouts that are out of bounds.
+        """
+        if not isinstance(science, DeferredDatasetHandle):
+            return (science.getBBox(), [(difference.image, science.image, template.image)],
+                    np.zeros(len(x), dtype=int))
+
+        handles = (difference, science, template)
+        with self.timers.stage('read'):
+            if self.config.inputReadMode != 'regions':
+                images = tuple(handle.get(component='image') for handle in handles)
+                return images[1].getBBox(), [images], np.zeros(len(x), dtype=int)
+
+            if bbox is None:
+                bbox = science.get(component='bbox')
+            boxes, labels = self._merge_cutout_boxes(bbox, x, y)
+            regions = [tuple(handle.get(component='image', parameters={'bbox': box}) for handle in handles)
+                       for box in boxes]
+        self.log.debug("Read %d regions of %d pixels in total for %d cutouts.", len(boxes),
+                       sum(box.getArea() for box in boxes), len(x))
+        return bbox, regions, labels
+
+    def _merge_cutout_boxes(self, bbox, x, y):
+        """Merge the cutout boxes of sources into a few regions to read.
+
+        Boxes are grouped into horizontal strips of boxes that overlap or
+        are at most ``regionMergeGap`` apart in y, and each strip is split
+        the same way in x.
+
+        Parameters
+        ----------
+        bbox : `lsst.geom.Box2I`
+            Bounding box of the science exposure.
+        x, y : `numpy.ndarray`
+            Centroids of the cutouts, in parent pixel coordinates.
+
+        Returns
+        -------
+        boxes : `list` [`lsst.geom.Box2I`]
+            The regions, within ``bbox``.
+        labels : `numpy.ndarray` [`int`]
+            Index of the region of each cutout in ``boxes``; -1 for cutouts
+            that are out of bounds.
+        """
+        size = self.config.cutoutSize
+        gap = self.config.regionMergeGap
+        x0, y0, inside, edge = self._get_cutout_corners(bbox, x, y)
+        labels = np.full(len(x), -1)
+        valid = np.flatnonzero(inside | edge)
+
+        # Grow the boxes by a pixel, for the reflected pixels of edge cutouts
+        # of even size, and clip them to the exposure.
+        box_x0 = np.clip(x0 - 1, bbox.getMinX(), bbox.getMaxX())
+        box_x1 = np.clip(x0 + size, bbox.getMinX(), bbox.getMaxX())
+        box_y0 = np.clip(y0 - 1, bbox.getMinY(), bbox.getMaxY())
+        box_y1 = np.clip(y0 + size, bbox.getMinY(), bbox.getMaxY())
+
+        boxes = []
+        if len(valid) == 0:
+            return boxes, labels
+        by_y = valid[np.argsort(box_y0[valid], kind='stable')]
+        for strip in _split_runs(box_y0[by_y], box_y1[by_y], gap):
+            members = by_y[strip]
+            by_x = members[np.argsort(box_x0[members], kind='stable')]
+            for group in _split_runs(box_x0[by_x], box_x1[by_x], gap):
+                group = by_x[group]
+                labels[group] = len(boxes)
+                boxes.append(lsst.geom.Box2I(lsst.geom.Point2I(box_x0[group].min(), box_y0[group].min()),
+                                             lsst.geom.Point2I(box_x1[group].max(), box_y1[group].max())))
+        return boxes, labels
+
+    def _extract_region_cutouts(self, regions, labels, bbox, x, y):
+        """Gather square cutouts from the regions they are in.
+
+        Parameters
+        ----------
+        regions : `list` [`tuple` [`lsst.afw.image.ImageF`]]
+            Images of each region, as returned by `_load_images`.
+        labels : `numpy.ndarray` [`int`]
+            Index of the region of each cutout.
+        bbox : `lsst.geom.Box2I`
+            Bounding box of the science exposure.
+        x, y : `numpy.ndarray`
+            Centroids of the cutouts, in parent pixel coordinates.
+
+        Returns
+        -------
+        blobs : `numpy.ndarray`, (N, 3, cutoutSize, cutoutSize)
+            The cutouts, in the order of ``x`` and ``y``, as returned by
+            `_extract_cutouts`.
+        """
+        if len(regions) == 1:
+            return self._extract_cutouts(regions[0], bbox, x, y)
+
+        size = self.config.cutoutSize
+        blobs = np.zeros((len(x), 3, size, size), dtype=np.float32)
+        for label in np.unique(labels[labels >= 0]):
+            selected = labels == label
+            blobs[selected] = self._extract_cutouts(regions[label], bbox, x[selected], y[selected])
+        return blobs
+
+    def _get_bbox(self, science):
+        """Return the bounding box of the science exposure.
+
+        Parameters
+        ----------
+        science : `lsst.afw.image.ExposureF` or \
+                `lsst.daf.butler.DeferredDatasetHandle`
+            The exposure cutouts are made of, or a handle to read its
+            bounding box from.
+
+        Returns
+        -------
+        bbox : `lsst.geom.Box2I`
+            Bounding box of ``science``.
+        """
+        if isinstance(science, DeferredDatasetHandle):
+            with self.timers.stage('read'):
+                return science.get(component='bbox')
+        return science.getBBox()
+
+    def _find_valid_cutouts(self, bbox, diaSources):
+        """Return which sources have a cutout that fits in an exposure.
+
+        Parameters
+        ----------
+        bbox : `lsst.geom.Box2I`
+            Bounding box of the exposure cutouts are made of; see
+            `_get_bbox`.
+        diaSources : `lsst.afw.table.SourceCatalog`
+            The sources.
+
+        Returns
+        -------
+        valid : `numpy.ndarray` [`bool`]
+            Whether the cutout of each source is fully contained in
+            ``bbox``, or may be padded to be; see ``edgeCutouts``. Other
+            sources would have all-zero cutouts.
+        """
+        x, y = self._get_centroids(diaSources)
+        _, _, inside, edge = self._get_cutout_corners(bbox, x, y)
+        return inside | edge
+
+    def _get_cutout_corners(self, bbox, x, y):
+        """Return the corners of square cutouts centered at the given
+        positions.
+
+        Parameters
+        ----------
+        bbox : `lsst.geom.Box2I`
+            Box the cutouts must be contained in to be valid.
+        x, y : `numpy.ndarray`
+            Centroids of the cutouts, in parent pixel coordinates.
+
+        Returns
+        -------
+        x0, y0 : `numpy.ndarray` [`int`]
+            Minimum corner of each cutout; zero for sources with no finite
+            centroid.
+        inside : `numpy.ndarray` [`bool`]
+            Whether each cutout is fully contained in ``bbox``.
+        edge : `numpy.ndarray` [`bool`]
+            Whether each cutout is partly outside ``bbox`` and is to be
+            padded, i.e. its centroid is in ``bbox`` and ``edgeCutouts`` is
+            not 'skip'.
+        """
+        size = self.config.cutoutSize
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        # Same rounding as lsst.geom.Box2I.makeCenteredBox, so that the boxes
+        # are identical to the ones of the per-source path. Sources with a
+        # non-finite centroid are treated as being out of bounds.
+        finite = np.isfinite(x) & np.isfinite(y)
+        x0 = np.zeros(len(x), dtype=int)
+        y0 = np.zeros(len(y), dtype=int)
+        x0[finite] = np.floor(x[finite] + (-0.5 * size) + 0.5 + 0.5)
+        y0[finite] = np.floor(y[finite] + (-0.5 * size) + 0.5 + 0.5)
+
+        inside = (finite
+                  & (x0 >= bbox.getMinX()) & (x0 + size - 1 <= bbox.getMaxX())
+                  & (y0 >= bbox.getMinY()) & (y0 + size - 1 <= bbox.getMaxY()))
+        edge = np.zeros(len(x), dtype=bool)
+        if self.config.edgeCutouts != 'skip':
+            # Same test as lsst.geom.Box2D(bbox).contains.
+            edge[finite] = ((x[finite] >= bbox.getMinX() - 0.5) & (x[finite] < bbox.getMaxX() + 0.5)
+                            & (y[finite] >= bbox.getMinY() - 0.5) & (y[finite] < bbox.getMaxY() + 0.5))
+            edge &= ~inside
+        return x0, y0, inside, edge
+
+    def _edge_indices(self, starts, low, high):
+        """Return the pixel indices along one axis of cutouts partly outside
+        a range, mapped into it as configured by ``edgeCutouts``.
+
+        Parameters
+        ----------
+        starts : `numpy.ndarray` [`int`]
+            First index of each cutout.
+        low, high : `int`
+            First and last index of the range, inclusive.
+
+        Returns
+        -------
+        indices : `numpy.ndarray` [`int`], (len(starts), cutoutSize)
+            Indices of the pixels of each cutout, reflected about the ends of
+            the range in the 'reflect' mode, as `numpy.pad` does, or else
+            clipped to the range.
+        inside : `numpy.ndarray` [`bool`], (len(starts), cutoutSize)
+            Whether each index was in the range before mapping.
+        """
+        indices = starts[:, np.newaxis] + np.arange(self.config.cutoutSize)
+        inside = (indices >= low) & (indices <= high)
+        if self.config.edgeCutouts == 'reflect':
+            indices = np.where(indices < low, 2 * low - indices, indices)
+            indices = np.where(indices > high, 2 * high - indices, indices)
+        return np.clip(indices, low, high), inside
+
+    def _extract_cutouts(self, images, bbox, x, y):
+        """Gather square cutouts centered at the given positions.
+
+        Parameters
+        ----------
+        images : `list` [`lsst.afw.image.ImageF`]
+            Images to cut out of; one output channel per image.
+        bbox : `lsst.geom.Box2I`
+            Boxes that are not fully contained in this box result in an
+            all-zero cutout, unless they are padded; see ``edgeCutouts``.
+        x, y : `numpy.ndarray`
+            Centroids of the cutouts, in parent pixel coordinates.
+
+        Returns
+        -------
+        blobs : `numpy.ndarray`, (N, len(images), cutoutSize, cutoutSize)
+            The cutouts, with non-finite values replaced as in
+            `numpy.nan_to_num`.
+        """
+        size = self.config.cutoutSize
+        blobs = np.zeros((len(x), len(images), size, size), dtype=np.float32)
+
+        x0, y0, inside, edge = self._get_cutout_corners(bbox, x, y)
+        if not inside.any() and not edge.any():
+            return blobs
+
+        if edge.any():
+            # Pixel indices of every edge cutout, mapped into bbox, and which
+            # of them are out of it.
+            rows, row_inside = self._edge_indices(y0[edge], bbox.getMinY(), bbox.getMaxY())
+            cols, col_inside = self._edge_indices(x0[edge], bbox.getMinX(), bbox.getMaxX())
+            missing = ~(row_inside[:, :, np.newaxis] & col_inside[:, np.newaxis, :])
+
+        for channel, image in enumerate(images):
+            if inside.any():
+                # A zero-copy (rows, cols, size, size) view of every possible
+                # cutout position, indexed by the cutout's corner.
+                windows = np.lib.stride_tricks.sliding_window_view(image.array, (size, size))
+                blobs[inside, channel] = windows[y0[inside] - image.getY0(), x0[inside] - image.getX0()]
+
+            if edge.any():
+                # Gather all edge cutouts at once, at the cost of copying
+                # their pixels only.
+                cutouts = image.array[(rows - image.getY0())[:, :, np.newaxis],
+                                      (cols - image.getX0())[:, np.newaxis, :]]
+                if self.config.edgeCutouts == 'constant':
+                    cutouts[missing] = self.config.edgePadValue
+                blobs[edge, channel] = cutouts
+
+        np.nan_to_num(blobs, copy=False)
+        return blobs
@@ -0,0 +1,95 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Command-line tool to ingest a directory of model packages into a butler
+repository.
+"""
+
+__all__ = ["build_argument_parser", "main"]
+
+import argparse
+import logging
+import sys
+
+from lsst.daf.butler import Butler
+
+from ..modelPackages.storageAdapterButler import StorageAdapterButler
+
+
+def build_argument_parser():
+    """Return the argument parser of the command-line tool.
+
+    Returns
+    -------
+    parser : `argparse.ArgumentParser`
+        The parser.
+    """
+    parser = argparse.ArgumentParser(
+        description="Ingest the model packages of a directory into a butler repository. Packages "
+                    "already ingested with the same contents are skipped.")
+    parser.add_argument("repo", help="Butler repository to ingest the packages into.")
+    parser.add_argument("directory", help="Model packages directory, with one subdirectory per package.")
+    parser.add_argument("packages", nargs="*",
+                        help="Names of the packages to ingest; all those of the directory by default.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of packages to hash and build concurrently.")
+    parser.add_argument("--uncompressed-checkpoint", action="store_true",
+                        help="Store the checkpoints uncompressed, to be memory mapped when loaded.")
+    parser.add_argument("--replace", action="store_true",
+                        help="Replace packages already ingested with different contents.")
+    return parser
+
+
+def main(argv=None):
+    """Run the command-line tool.
+
+    Parameters
+    ----------
+    argv : `list` [`str`], optional
+        Command-line arguments; those of the process by default.
+
+    Returns
+    -------
+    status : `int`
+        Exit status of the tool.
+    """
+    args = build_argument_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    log = logging.getLogger("ingestModelPackages")
+
+    butler = Butler(args.repo, writeable=True)
+    try:
+        status = StorageAdapterButler.ingest_directory(args.directory, butler,
+                                                       model_package_names=args.packages or None,
+                                                       n_workers=args.jobs,
+                                                       compress_checkpoint=not args.uncompressed_checkpoint,
+                                                       replace=args.replace, log=log)
+    except RuntimeError as e:
+        log.error("%s", e)
+        return 1
+
+    for name, outcome in status.items():
+        print(f"{name}: {outcome}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__all__ = ["StageTimers"]
+
+import collections
+import contextlib
+import resource
+import sys
+import threading
+import time
+
+# Returned by disabled timers, so that timing a stage then costs a single
+# call that does nothing.
+_null_stage = contextlib.nullcontext()
+
+
+def _peak_rss():
+    """Return the peak resident set size of this process, in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kibibytes, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageTimers:
+    """Wall-clock timers and counters of the stages of a run.
+
+    Time spent in each stage and counters are accumulated across calls, and
+    may be updated from several threads, e.g. when cutouts are extracted in
+    the background. Disabled timers record nothing and cost next to nothing.
+
+    Parameters
+    ----------
+    enabled : `bool`, optional
+        Whether to record anything.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+        self.times = collections.defaultdict(float)
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """Return a context manager adding the time spent in it to a stage.
+
+        Parameters
+        ----------
+        name : `str`
+            Name of the stage, e.g. 'forward'.
+        """
+        if not self.enabled:
+            return _null_stage
+        return self._timed(name)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.times[name] += elapsed
+
+    def count(self, name, n=1):
+        """Add to a counter.
+
+        Parameters
+        ----------
+        name : `str`
+            Name of the counter, e.g. 'nBatches'.
+        n : `int`, optional
+            Amount to add.
+        """
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def to_metadata(self, metadata):
+        """Record the timers and counters, and the peak resident set size of
+        the process, in task metadata.
+
+        Each stage is recorded as ``<stage>Time``, in seconds, each counter
+        under its own name, and the peak resident set size as ``peakRss``,
+        in bytes. Keys are flat numbers, so that they can be aggregated
+        across quanta. Nothing is recorded if the timers are disabled.
+
+        Parameters
+        ----------
+        metadata : `lsst.pipe.base.TaskMetadata`
+            Metadata to record into, e.g. that of a task.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            for name, seconds in self.times.items():
+                metadata[f"{name}Time"] = seconds
+            for name, n in self.counters.items():
+                metadata[name] = n
+        metadata["peakRss"] = _peak_rss()
@@ -0,0 +1,67 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import unittest
+
+import torch
+
+from lsst.meas.transiNet import recommended_thread_settings, apply_thread_settings
+
+
+class TestCpuSettings(unittest.TestCase):
+    def test_recommended_single_worker(self):
+        """Test that a single worker gets all available CPUs.
+        """
+        settings = recommended_thread_settings(1)
+        self.assertEqual(settings["numThreads"], len(os.sched_getaffinity(0)))
+        self.assertEqual(settings["numInteropThreads"], 1)
+        self.assertIsNone(settings["cpuAffinity"])
+
+    def test_recommended_affinity(self):
+        """Test that workers are pinned to disjoint sets of CPUs.
+        """
+        n_workers = min(2, len(os.sched_getaffinity(0)))
+        affinities = [set(recommended_thread_settings(n_workers, i)["cpuAffinity"])
+                      for i in range(n_workers)]
+        for affinity in affinities:
+            self.assertTrue(affinity)
+            self.assertTrue(affinity <= os.sched_getaffinity(0))
+        self.assertFalse(set.intersection(*affinities) if n_workers > 1 else set())
+
+    def test_recommended_invalid(self):
+        with self.assertRaises(ValueError):
+            recommended_thread_settings(0)
+        with self.assertRaises(ValueError):
+            recommended_thread_settings(2, worker_index=2)
+
+    def test_apply(self):
+        """Test applying the number of intra-op threads.
+        """
+        original = torch.get_num_threads()
+        try:
+            apply_thread_settings(num_threads=1)
+            self.assertEqual(torch.get_num_threads(), 1)
+            # 0 leaves the setting unchanged.
+            apply_thread_settings(num_threads=0)
+            self.assertEqual(torch.get_num_threads(), 1)
+        finally:
+            torch.set_num_threads(original)
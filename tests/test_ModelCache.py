@@ -0,0 +1,109 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from unittest import mock
+
+from lsst.meas.transiNet import RBTransiNetTask, RBTransiNetInterface
+from lsst.meas.transiNet.modelPackages.nnModelPackage import NNModelPackage
+from lsst.meas.transiNet.modelPackages.modelCache import ModelCache, get_model_cache
+
+
+class TestModelCache(unittest.TestCase):
+    def setUp(self):
+        self.model_package = NNModelPackage('dummy', 'local')
+
+    def test_reuse(self):
+        """Test that a cached model is returned instead of being reloaded.
+        """
+        cache = ModelCache()
+        model = cache.get(self.model_package, 'cpu')
+        self.assertFalse(model.training)
+        self.assertIs(cache.get(NNModelPackage('dummy', 'local'), 'cpu'), model)
+        self.assertEqual(len(cache), 1)
+        self.assertIn(ModelCache.make_key(self.model_package, 'cpu'), cache)
+
+    def test_evict_by_count(self):
+        """Test least-recently-used eviction by the number of models.
+        """
+        cache = ModelCache(max_entries=1)
+        cache.get(self.model_package, 'cpu')
+        self.assertEqual(len(cache), 1)
+        cache.configure(max_entries=0)
+        self.assertEqual(len(cache), 0)
+
+    def test_digest_on_miss(self):
+        """Test that the checkpoint is only hashed for packages not seen
+        before.
+        """
+        cache = ModelCache()
+        model = cache.get(self.model_package, 'cpu')
+        other = NNModelPackage('dummy', 'local')
+        with mock.patch.object(other.adapter, 'get_checkpoint_digest', side_effect=AssertionError):
+            self.assertIs(cache.get(other, 'cpu'), model)
+
+    def test_failed_load(self):
+        """Test that packages failing to load are not remembered.
+        """
+        cache = ModelCache()
+        with mock.patch.object(self.model_package, 'load', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                cache.get(self.model_package, 'cpu')
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache._aliases, {})
+
+        cache.configure(max_entries=0)
+        cache.get(self.model_package, 'cpu')
+        self.assertEqual(cache._aliases, {})
+
+    def test_configure_no_limit(self):
+        """Test that limits can be removed, and are otherwise unchanged.
+        """
+        cache = ModelCache(max_entries=1, max_bytes=1)
+        cache.configure(max_bytes=None)
+        self.assertIsNone(cache.max_bytes)
+        self.assertEqual(cache.max_entries, 1)
+        cache.get(self.model_package, 'cpu')
+        self.assertEqual(len(cache), 1)
+
+    def test_evict_by_bytes(self):
+        """Test eviction of models exceeding the size budget.
+        """
+        cache = ModelCache(max_bytes=1)
+        model = cache.get(self.model_package, 'cpu')
+        self.assertGreater(ModelCache.model_nbytes(model), 1)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_shared_by_interfaces(self):
+        """Test that interfaces of separate tasks share the cached model.
+        """
+        get_model_cache().clear()
+        config = RBTransiNetTask.ConfigClass()
+        config.modelPackageName = "dummy"
+        config.modelPackageStorageMode = "local"
+        first = RBTransiNetInterface(RBTransiNetTask(config=config))
+        second = RBTransiNetInterface(RBTransiNetTask(config=config))
+        self.assertIs(first.model, second.model)
+
+        config.useModelCache = False
+        third = RBTransiNetInterface(RBTransiNetTask(config=config))
+        self.assertIsNot(third.model, first.model)
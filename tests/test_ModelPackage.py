@@ -20,12 +20,27 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import unittest
+import numpy as np
 import torch
+import io
 import os
 import shutil
+import stat
+import sys
 import tempfile
+from unittest import mock
 
 from lsst.meas.transiNet.modelPackages.nnModelPackage import NNModelPackage
+from lsst.meas.transiNet.modelPackages.quantization import quantization_report
+from lsst.meas.transiNet.modelPackages.checkpointFiles import (BufferReader, load_checkpoint, map_file,
+                                                               save_safetensors)
+from lsst.meas.transiNet.modelPackages import utils
+from lsst.meas.transiNet.modelPackages.packageCache import PackageCache
+from lsst.meas.transiNet.modelPackages.packageIndex import index_filename
+from lsst.meas.transiNet.modelPackages.sharedWeights import (load_shared_weights, release_shared_weights,
+                                                             shared_weights_path)
+from lsst.meas.transiNet.modelPackages.inferenceBackends import OnnxRuntimeModel, export_onnx, onnxruntime
+from lsst.meas.transiNet.modelPackages.modelCache import ModelCache
 from lsst.meas.transiNet.modelPackages.storageAdapterLocal import StorageAdapterLocal
 from lsst.meas.transiNet.modelPackages.storageAdapterNeighbor import StorageAdapterNeighbor
 from lsst.meas.transiNet.modelPackages.storageAdapterButler import StorageAdapterButler
@@ -103,6 +118,282 @@ class TestModelPackageLocal(unittest.TestCase):
             os.remove(model_package.adapter.model_filename)
             model_package.adapter.model_filename = model_filename_backup
 
+    def test_compiled(self):
+        """Test building and loading the compiled model of a local package.
+        """
+        model_package = NNModelPackage(self.model_package_name, self.package_storage_mode)
+        eager = model_package.load(device='cpu').eval()
+        self.assertIsNone(model_package.adapter.find_optional_file('compiled'))
+
+        compiled_filename = os.path.join(os.path.dirname(model_package.adapter.model_filename),
+                                         'compiled.torchscript')
+        try:
+            model_package.build_compiled(compiled_filename)
+            self.assertEqual(model_package.adapter.find_optional_file('compiled'), compiled_filename)
+
+            compiled = model_package.load(device='cpu')
+            self.assertIsInstance(compiled, torch.jit.ScriptModule)
+            # The eager model is still available on request.
+            self.assertNotIsInstance(model_package.load(device='cpu', prefer_compiled=False),
+                                     torch.jit.ScriptModule)
+
+            blob = torch.rand((2, 3, 256, 256))
+            with torch.no_grad():
+                torch.testing.assert_close(compiled(blob), eager(blob))
+
+            # A compiled model built from another checkpoint is ignored.
+            with mock.patch.object(model_package.adapter, 'get_checkpoint_digest', return_value='other'):
+                self.assertNotIsInstance(model_package.load(device='cpu'), torch.jit.ScriptModule)
+        finally:
+            os.remove(compiled_filename)
+
+    @unittest.skipIf(onnxruntime is None, "onnxruntime is not installed")
+    def test_onnx(self):
+        """Test exporting a local package to ONNX and running it with ONNX
+        Runtime.
+        """
+        model_package = NNModelPackage(self.model_package_name, self.package_storage_mode)
+        eager = model_package.load(device='cpu').eval()
+        self.assertIsNone(model_package.adapter.load_onnx())
+        # Exporting the graph on load is possible, but slow.
+        with self.assertLogs(level='WARNING'):
+            model_package.load(device='cpu', backend='onnxruntime')
+
+        onnx_filename = export_onnx(model_package)
+        try:
+            self.assertEqual(model_package.adapter.find_optional_file('onnx'), onnx_filename)
+            model = model_package.load(device='cpu', backend='onnxruntime')
+            self.assertIsInstance(model, OnnxRuntimeModel)
+            self.assertEqual(ModelCache.model_nbytes(model), os.path.getsize(onnx_filename))
+
+            blob = torch.rand((3, 3, 256, 256))
+            with torch.no_grad():
+                expected = eager(blob)
+            torch.testing.assert_close(model(blob), expected, rtol=1e-4, atol=1e-5)
+            np.testing.assert_allclose(model(blob.numpy()), expected.numpy(), rtol=1e-4, atol=1e-5)
+        finally:
+            os.remove(onnx_filename)
+
+        with self.assertRaises(ValueError):
+            model_package.load(device='cpu', backend='onnxruntime', quantization='dynamic')
+
+    def test_quantization(self):
+        """Test dynamic and static int8 quantization of a local package.
+        """
+        model_package = NNModelPackage(self.model_package_name, self.package_storage_mode)
+        float_model = model_package.load(device='cpu').eval()
+        inputs = np.random.default_rng(0).normal(size=(4, 3, 256, 256)).astype(np.float32)
+
+        quantized = model_package.load(device='cpu', quantization='dynamic')
+        report = quantization_report(float_model, quantized, inputs)
+        self.assertEqual(report['n_inputs'], 4)
+        self.assertLess(report['max_abs_delta'], 0.05)
+
+        # Static quantization needs the reference inputs of the package.
+        with self.assertRaises(ValueError):
+            model_package.load(device='cpu', quantization='static')
+
+        reference_filename = os.path.join(os.path.dirname(model_package.adapter.model_filename),
+                                          'reference.npy')
+        try:
+            np.save(reference_filename, inputs)
+            quantized = model_package.load(device='cpu', quantization='static')
+            report = quantization_report(float_model, quantized, inputs)
+            self.assertLess(report['max_abs_delta'], 0.05)
+        finally:
+            os.remove(reference_filename)
+
+        with self.assertRaises(ValueError):
+            model_package.load(device='cpu', quantization='invalid')
+
+        # Precomputed quantized models are only used with the checkpoint
+        # they were built from.
+        adapter = model_package.adapter
+        built = model_package.build_quantized('dynamic').getvalue()
+        with mock.patch.object(adapter, 'open_optional_component',
+                               side_effect=lambda component: io.BytesIO(built)):
+            self.assertIsNotNone(adapter.load_quantized('dynamic'))
+            with mock.patch.object(adapter, 'get_checkpoint_digest', return_value='other'), \
+                    self.assertLogs(level='WARNING'):
+                self.assertIsNone(adapter.load_quantized('dynamic'))
+
+    def test_safetensors(self):
+        """Test that safetensors checkpoints round-trip, and are mapped
+        rather than read.
+        """
+        state_dict = {'weight': torch.rand((4, 3)),
+                      'half': torch.rand(5).to(torch.bfloat16),
+                      'count': torch.tensor(7),
+                      'empty': torch.zeros((0, 2))}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'checkpoint.safetensors')
+            with open(filename, 'wb') as f:
+                save_safetensors(state_dict, f, metadata={'epoch': 3})
+            loaded = load_checkpoint(filename)['model_state_dict']
+            self.assertEqual(loaded.keys(), state_dict.keys())
+            for name, tensor in state_dict.items():
+                torch.testing.assert_close(loaded[name], tensor, rtol=0, atol=0)
+            del loaded
+
+    def test_shared_weights(self):
+        """Test publishing weights to, and loading them from, shared memory.
+        """
+        model_package = NNModelPackage(self.model_package_name, self.package_storage_mode)
+        expected = model_package.load(device='cpu', prefer_compiled=False).state_dict()
+        path = shared_weights_path(model_package)
+        release_shared_weights(model_package)
+        # Unused weights of another checkpoint, published long ago.
+        stale = path.rsplit('-', 1)[0] + '-stale.safetensors'
+        with open(stale, 'wb'):
+            pass
+        os.utime(stale, (0, 0))
+        try:
+            # The first load publishes the weights, later ones attach to them
+            # without reading the checkpoint.
+            for _ in range(2):
+                model = model_package.load(device='cpu', prefer_compiled=False, shared_weights=True)
+                self.assertTrue(os.path.exists(path))
+                for name, tensor in model.state_dict().items():
+                    torch.testing.assert_close(tensor, expected[name], rtol=0, atol=0)
+                model_package.adapter.get_checkpoint_digest = mock.Mock(side_effect=AssertionError)
+                model_package.adapter.load_weights = mock.Mock(side_effect=AssertionError)
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+            self.assertFalse(os.path.exists(stale))
+            model_package = NNModelPackage(self.model_package_name, self.package_storage_mode)
+
+            # Truncated or shared files are ignored in favor of the checkpoint.
+            os.truncate(path, os.path.getsize(path) - 1)
+            for mode in (0o666, 0o600):
+                os.chmod(path, mode)
+                with self.assertLogs(level='WARNING'):
+                    self.assertIsNone(load_shared_weights(model_package))
+                model = model_package.load(device='cpu', prefer_compiled=False, shared_weights=True)
+                for name, tensor in model.state_dict().items():
+                    torch.testing.assert_close(tensor, expected[name], rtol=0, atol=0)
+        finally:
+            release_shared_weights(model_package)
+            if os.path.exists(stale):
+                os.remove(stale)
+        self.assertFalse(os.path.exists(path))
+
+    def test_uncompressed_payload(self):
+        """Test loading the weights of a memory mapped butler payload, with
+        an uncompressed checkpoint in either format.
+        """
+        model_package = NNModelPackage(self.model_package_name, self.package_storage_mode)
+        expected = model_package.load(device='cpu', prefer_compiled=False).state_dict()
+        adapter = StorageAdapterButler.from_other(model_package.adapter)
+        for safetensors in (False, True):
+            with self.subTest(safetensors=safetensors), tempfile.TemporaryDirectory() as tmpdir:
+                filename = os.path.join(tmpdir, 'package.zip')
+                with open(filename, 'wb') as f:
+                    f.write(adapter.to_payload(compress_checkpoint=False,
+                                               safetensors=safetensors).bytes.getbuffer())
+                payload = adapter.to_payload()
+                payload.bytes = map_file(filename)
+
+                loaded = StorageAdapterButler(self.model_package_name, butler_loaded_package=payload)
+                self.assertIsInstance(loaded.checkpoint_file, BufferReader)
+                state_dict = loaded.load_weights('cpu')['model_state_dict']
+                for name, tensor in expected.items():
+                    torch.testing.assert_close(state_dict[name], tensor, rtol=0, atol=0)
+
+    def test_lazy_payload(self):
+        """Test that butler payloads are only decompressed as needed.
+        """
+        model_package = NNModelPackage(self.model_package_name, self.package_storage_mode)
+        payload = StorageAdapterButler.from_other(model_package.adapter).to_payload()
+
+        loaded = NNModelPackage(self.model_package_name, 'butler', butler_loaded_package=payload)
+        self.assertEqual(loaded.metadata, model_package.metadata)
+        self.assertEqual(set(loaded.adapter._files), {'metadata'})
+        self.assertEqual(loaded.adapter.get_checkpoint_digest(),
+                         model_package.adapter.get_checkpoint_digest())
+
+        model = loaded.load(device='cpu')
+        self.assertNotIn('checkpoint', loaded.adapter._files)
+        expected = model_package.load(device='cpu').state_dict()
+        for name, tensor in model.state_dict().items():
+            torch.testing.assert_close(tensor, expected[name], rtol=0, atol=0)
+
+    def test_package_index(self):
+        """Test finding local packages through the package index.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            shutil.copytree(StorageAdapterLocal.get_base_path(),
+                            os.path.join(tmpdir, 'model_packages'),
+                            ignore=shutil.ignore_patterns(index_filename))
+            with mock.patch.dict(os.environ, {'MEAS_TRANSINET_DIR': tmpdir}):
+                # Without an index, package directories are scanned.
+                self.assertIn(self.model_package_name, StorageAdapterLocal.list_packages())
+                scanned = NNModelPackage(self.model_package_name, self.package_storage_mode)
+                self.assertIsNone(scanned.adapter.index_entry)
+
+                StorageAdapterLocal.write_index()
+                self.assertIn(self.model_package_name, StorageAdapterLocal.list_packages())
+                with mock.patch('glob.glob', side_effect=AssertionError("unexpected scan")):
+                    indexed = NNModelPackage(self.model_package_name, self.package_storage_mode)
+                    self.assertIsNotNone(indexed.adapter.index_entry)
+                    self.assertEqual(indexed.adapter.checkpoint_filename, scanned.adapter.checkpoint_filename)
+                    self.assertEqual(indexed.adapter.get_checkpoint_digest(),
+                                     scanned.adapter.get_checkpoint_digest())
+                sanity_check_dummy_model(self, indexed.load(device='cpu'))
+
+                # Components missing from the index, or whose listed file was
+                # removed, are looked up in the package directory.
+                self.assertIsNone(indexed.adapter.find_optional_file('compiled'))
+                compiled = os.path.join(os.path.dirname(indexed.adapter.model_filename),
+                                        'model.torchscript')
+                open(compiled, 'wb').close()
+                self.assertEqual(indexed.adapter.find_optional_file('compiled'), compiled)
+                StorageAdapterLocal.write_index()
+                indexed = NNModelPackage(self.model_package_name, self.package_storage_mode)
+                self.assertIn('compiled', indexed.adapter.index_entry)
+                os.remove(compiled)
+                self.assertIsNone(indexed.adapter.find_optional_file('compiled'))
+
+                # Indexed digests are only trusted for unchanged files.
+                digest = scanned.adapter.get_checkpoint_digest()
+                indexed.adapter.index_entry['checkpoint']['sha256'] = 'stale'
+                self.assertEqual(indexed.adapter.get_checkpoint_digest(), 'stale')
+                stat = os.stat(indexed.adapter.checkpoint_filename)
+                os.utime(indexed.adapter.checkpoint_filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+                self.assertEqual(indexed.adapter.get_checkpoint_digest(), digest)
+
+    def test_module_cache(self):
+        """Test that architecture modules are executed once per process, and
+        compiled once per source.
+        """
+        model_package = NNModelPackage(self.model_package_name, self.package_storage_mode)
+        adapter = StorageAdapterButler.from_other(model_package.adapter)
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch.dict(os.environ, {'MEAS_TRANSINET_BYTECODE_CACHE': tmpdir}), \
+                mock.patch.dict(utils._module_cache, clear=True), \
+                mock.patch.object(sys, 'dont_write_bytecode', False):
+            module = utils.load_module_from_memory(adapter.model_file)
+            self.assertIs(utils.load_module_from_memory(adapter.model_file), module)
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+
+            # Another process finds the bytecode on disk.
+            utils._module_cache.clear()
+            with mock.patch('builtins.compile', side_effect=AssertionError("unexpected compile")):
+                other = utils.load_module_from_file(model_package.adapter.model_filename)
+            self.assertIsNot(other, module)
+            self.assertEqual(other.__file__, model_package.adapter.model_filename)
+            self.assertIsInstance(utils.import_model_from_module(other), torch.nn.Module)
+            # Tracebacks show the path the source was loaded from.
+            self.assertEqual(other.TestModel.forward.__code__.co_filename,
+                             model_package.adapter.model_filename)
+
+            # Cache files and directories others can write to are not used.
+            (cached,) = os.listdir(tmpdir)
+            for path, mode in ((os.path.join(tmpdir, cached), 0o666), (tmpdir, 0o777)):
+                os.chmod(path, mode)
+                utils._module_cache.clear()
+                with mock.patch('builtins.compile', wraps=compile) as compile_mock:
+                    utils.load_module_from_memory(adapter.model_file)
+                compile_mock.assert_called_once()
+
     def test_invalid_inputs(self):
         """Test invalid and missing inputs
         (of NNModelPackage constructor, as well as the load method)
@@ -277,3 +568,96 @@ class TestModelPackageButler(unittest.TestCase):
         model_package = self.load_from_butler()
         model = model_package.load(device='cpu')
         sanity_check_dummy_model(self, model)
+
+    def test_fetch_cached(self):
+        """Test that fetching a model package goes through the local cache.
+        """
+        self.ingest()
+        cache = PackageCache(os.path.join(self.repo_root, 'package_cache'))
+        paths = StorageAdapterButler.warm_cache(self.butler, [self.model_package_name], cache=cache)
+        self.assertEqual(len(paths), 1)
+
+        with mock.patch.object(self.butler, 'get', wraps=self.butler.get) as get:
+            model_package = NNModelPackage(model_package_name=self.model_package_name,
+                                           package_storage_mode='butler',
+                                           butler=self.butler, cache=cache)
+            get.assert_not_called()
+        sanity_check_dummy_model(self, model_package.load(device='cpu'))
+
+    def test_ingest_compiled(self):
+        """Test ingesting a model package along with its compiled model.
+        """
+        local_model_package = NNModelPackage('dummy', 'local')
+        StorageAdapterButler.ingest(local_model_package, self.butler,
+                                    model_package_name=self.model_package_name,
+                                    include_compiled=True)
+        model_package = self.load_from_butler()
+        compiled = model_package.load(device='cpu')
+        self.assertIsInstance(compiled, torch.jit.ScriptModule)
+        sanity_check_dummy_model(self, model_package.load(device='cpu', prefer_compiled=False))
+
+    def test_ingest_uncompressed(self):
+        """Test ingesting and loading a model package with an uncompressed
+        safetensors checkpoint.
+        """
+        local_model_package = NNModelPackage('dummy', 'local')
+        StorageAdapterButler.ingest(local_model_package, self.butler,
+                                    model_package_name=self.model_package_name,
+                                    compress_checkpoint=False, safetensors=True)
+        model_package = self.load_from_butler()
+        sanity_check_dummy_model(self, model_package.load(device='cpu'))
+
+    def test_ingest_directory(self):
+        """Test bulk ingestion of a directory of model packages, and that
+        re-running it skips packages already ingested.
+        """
+        root = StorageAdapterLocal.get_base_path()
+        status = StorageAdapterButler.ingest_directory(root, self.butler,
+                                                       model_package_names=[self.model_package_name],
+                                                       n_workers=2, compress_checkpoint=False)
+        self.assertEqual(status, {self.model_package_name: 'ingested'})
+        model_package = self.load_from_butler()
+        sanity_check_dummy_model(self, model_package.load(device='cpu'))
+        digests = model_package.adapter.load_metadata()['sha256']
+        self.assertEqual(digests['checkpoint'], model_package.adapter.get_checkpoint_digest())
+
+        with mock.patch.object(self.butler, 'ingest', wraps=self.butler.ingest) as ingest:
+            status = StorageAdapterButler.ingest_directory(root, self.butler,
+                                                           model_package_names=[self.model_package_name])
+            ingest.assert_not_called()
+        self.assertEqual(status, {self.model_package_name: 'skipped'})
+
+    def test_ingest_directory_replace(self):
+        """Test that bulk ingestion does not silently replace packages
+        ingested with different contents.
+        """
+        self.ingest()
+        root = StorageAdapterLocal.get_base_path()
+        with self.assertRaises(RuntimeError):
+            StorageAdapterButler.ingest_directory(root, self.butler,
+                                                  model_package_names=[self.model_package_name])
+
+        # A package whose new payload fails to be ingested keeps its
+        # previous one.
+        ingest = self.butler.ingest
+        calls = []
+
+        def failing_ingest(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OSError("ingest failed")
+            return ingest(*args, **kwargs)
+
+        with mock.patch.object(self.butler, 'ingest', side_effect=failing_ingest), \
+                self.assertRaises(OSError):
+            StorageAdapterButler.ingest_directory(root, self.butler,
+                                                  model_package_names=[self.model_package_name],
+                                                  replace=True)
+        self.assertEqual(len(calls), 2)
+        sanity_check_dummy_model(self, self.load_from_butler().load(device='cpu'))
+
+        status = StorageAdapterButler.ingest_directory(root, self.butler,
+                                                       model_package_names=[self.model_package_name],
+                                                       replace=True)
+        self.assertEqual(status, {self.model_package_name: 'replaced'})
+        sanity_check_dummy_model(self, self.load_from_butler().load(device='cpu'))
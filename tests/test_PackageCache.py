@@ -0,0 +1,88 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import time
+import unittest
+import uuid
+
+from lsst.meas.transiNet.modelPackages.formatters import NNModelPackagePayload
+from lsst.meas.transiNet.modelPackages.packageCache import PackageCache
+
+
+def make_payload(size):
+    payload = NNModelPackagePayload()
+    payload.bytes.write(os.urandom(size))
+    return payload
+
+
+class TestPackageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmpdir.name, 'cache')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_get(self):
+        """Test that payloads round-trip through the cache, keyed by dataset
+        id and checksum.
+        """
+        cache = PackageCache(self.directory)
+        dataset_id = uuid.uuid4()
+        self.assertIsNone(cache.get(dataset_id))
+
+        payload = make_payload(1000)
+        path = cache.put(dataset_id, payload)
+        self.assertTrue(os.path.basename(path).startswith(f'{dataset_id}.'))
+        self.assertEqual(cache.find(dataset_id), path)
+        self.assertEqual(cache.get(dataset_id).bytes.getvalue(), payload.bytes.getvalue())
+        # No temporary files are left behind.
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(path)])
+
+    def test_evict(self):
+        """Test least-recently-used eviction by total size.
+        """
+        cache = PackageCache(self.directory, max_bytes=2500)
+        ids = [uuid.uuid4() for _ in range(3)]
+        for i, dataset_id in enumerate(ids[:2]):
+            path = cache.put(dataset_id, make_payload(1000))
+            os.utime(path, (time.time() - 10 + i, time.time() - 10 + i))
+        # Using the oldest entry makes the other one the least recently used.
+        self.assertIsNotNone(cache.get(ids[0]))
+
+        cache.put(ids[2], make_payload(1000))
+        self.assertIsNotNone(cache.find(ids[0]))
+        self.assertIsNone(cache.find(ids[1]))
+        self.assertIsNotNone(cache.find(ids[2]))
+
+    def test_verify(self):
+        """Test that corrupted payloads are discarded when verifying.
+        """
+        cache = PackageCache(self.directory, verify=True)
+        dataset_id = uuid.uuid4()
+        path = cache.put(dataset_id, make_payload(1000))
+        self.assertEqual(cache.find(dataset_id), path)
+        with open(path, 'r+b') as f:
+            f.write(b'corrupted')
+        self.assertIsNone(cache.get(dataset_id))
+        self.assertFalse(os.path.exists(path))
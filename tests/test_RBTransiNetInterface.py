@@ -22,20 +22,29 @@
 import unittest
 
 import numpy as np
+import torch
 
 from lsst.meas.transiNet import RBTransiNetTask
 from lsst.meas.transiNet import RBTransiNetInterface, CutoutInputs
+from lsst.meas.transiNet.modelPackages.inferenceBackends import onnxruntime
 
 
 class TestInference(unittest.TestCase):
     def setUp(self):
 
         # Create a mock TransiNetTask.
+        self.task, self.interface = self.make_interface()
+
+    def make_interface(self, **overrides):
+        """Create a task and interface with the given config overrides.
+        """
         config = RBTransiNetTask.ConfigClass()
         config.modelPackageName = "dummy"
         config.modelPackageStorageMode = "local"
-        self.task = RBTransiNetTask(config=config)
-        self.interface = RBTransiNetInterface(self.task)
+        for name, value in overrides.items():
+            setattr(config, name, value)
+        task = RBTransiNetTask(config=config)
+        return task, RBTransiNetInterface(task)
 
     def test_infer_empty_inputs(self):
         """Test running infer on empty inputs to make sure it handles it
@@ -63,3 +72,127 @@ class TestInference(unittest.TestCase):
         result = self.interface.infer(inputs)
         self.assertTupleEqual(result.shape, (100,))
         self.assertAlmostEqual(result[0], 0.5011908)
+
+    def test_infer_array(self):
+        """Test that an (N, 3, H, W) array of inputs scores the same as the
+        equivalent list of `CutoutInputs`.
+        """
+        rng = np.random.default_rng(42)
+        blobs = rng.normal(size=(5, 3, 256, 256)).astype(np.single)
+        inputs = [CutoutInputs(difference=b[0], science=b[1], template=b[2]) for b in blobs]
+        np.testing.assert_array_equal(self.interface.infer(blobs), self.interface.infer(inputs))
+
+    def test_prepare_input_reuses_buffer(self):
+        """Test that consecutive batches are assembled in the same buffer.
+        """
+        data = np.ones((256, 256), dtype=np.single)
+        inputs = [CutoutInputs(science=data, difference=2*data, template=3*data) for _ in range(4)]
+        first, _ = self.interface.prepare_input(inputs)
+        second, _ = self.interface.prepare_input(inputs[:2])
+        self.assertEqual(first.data_ptr(), second.data_ptr())
+        self.assertTupleEqual(tuple(second.shape), (2, 3, 256, 256))
+        np.testing.assert_array_equal(second[:, 0].numpy(), 2*data[np.newaxis].repeat(2, 0))
+        np.testing.assert_array_equal(second[:, 2].numpy(), 3*data[np.newaxis].repeat(2, 0))
+
+    def test_infer_out(self):
+        """Test scoring into a caller-provided array.
+        """
+        data = np.zeros((256, 256), dtype=np.single)
+        inputs = [CutoutInputs(science=data, difference=data, template=data) for _ in range(70)]
+        out = np.full(70, np.nan, dtype=np.float32)
+        result = self.interface.infer(inputs, out=out)
+        self.assertIs(result, out)
+        np.testing.assert_array_equal(out, self.interface.infer(inputs))
+
+        with self.assertRaises(ValueError):
+            self.interface.infer(inputs, out=np.empty(3, dtype=np.float32))
+
+    def test_batch_size_fixed(self):
+        """Test the default, fixed, batch size and its record in the task
+        metadata.
+        """
+        data = np.zeros((256, 256), dtype=np.single)
+        self.interface.infer([CutoutInputs(science=data, difference=data, template=data)])
+        self.assertEqual(self.task.metadata["batchSize"], 64)
+
+    def test_batch_size_memory(self):
+        """Test choosing the batch size from a memory budget.
+        """
+        sample_nbytes = self.interface.estimate_sample_nbytes((256, 256))
+        # At least the input itself must be accounted for.
+        self.assertGreater(sample_nbytes, 3*256*256*4)
+
+        task, interface = self.make_interface(batchSizeMode="memory", batchMaxBytes=10*sample_nbytes + 1)
+        self.assertEqual(interface.get_batch_size((256, 256)), 10)
+
+        data = np.zeros((256, 256), dtype=np.single)
+        inputs = [CutoutInputs(science=data, difference=data, template=data) for _ in range(25)]
+        self.assertTupleEqual(interface.infer(inputs).shape, (25,))
+        self.assertEqual(task.metadata["batchSize"], 10)
+
+    def test_batch_size_auto(self):
+        """Test choosing the batch size by probing throughput.
+        """
+        task, interface = self.make_interface(batchSizeMode="auto", batchAutoTuneSizes=[2, 4])
+        self.assertIn(interface.get_batch_size((256, 256)), [2, 4])
+
+    def test_preprocess(self):
+        """Test normalizing inputs from the model package metadata.
+        """
+        # The dummy model normalizes its own input.
+        self.assertIsNone(self.interface._input_factors)
+
+        self.interface.model_package.metadata["expects_normalized_input"] = True
+        self.interface.model_package.metadata["boost_factor"] = 2.0
+        self.interface.init_preprocessing()
+
+        blobs = np.ones((2, 3, 256, 256), dtype=np.single)
+        blobs[0, 0, 0, 0] = np.nan
+        original = blobs.copy()
+        blob, _ = self.interface.prepare_input(blobs)
+        blob = self.interface.preprocess(blob).numpy()
+
+        # The caller's array is left untouched.
+        np.testing.assert_array_equal(blobs, original)
+        scale = self.interface.model_package.get_input_scale_factors()
+        for channel in range(3):
+            np.testing.assert_array_equal(blob[1, channel], np.float32(scale[channel]*2.0))
+        self.assertEqual(blob[0, 0, 0, 0], 0.0)
+
+    @unittest.skipIf(onnxruntime is None, "onnxruntime is not installed")
+    def test_onnxruntime_backend(self):
+        """Test that the onnxruntime backend gives the scores of the torch
+        one.
+        """
+        inputs = np.random.default_rng(0).normal(size=(5, 3, 256, 256)).astype(np.float32)
+        expected = self.interface.infer(inputs)
+        task, interface = self.make_interface(inferenceBackend="onnxruntime", batchSize=2)
+        np.testing.assert_allclose(interface.infer(inputs), expected, rtol=1e-4, atol=1e-5)
+
+    def test_reduced_precision(self):
+        """Test bfloat16 inference and its accuracy guard.
+        """
+        # The dummy package has no reference inputs to check against.
+        task, interface = self.make_interface(inferencePrecision="bfloat16", useModelCache=False)
+        self.assertEqual(interface.dtype, torch.float32)
+        with self.assertRaises(RuntimeError):
+            self.make_interface(inferencePrecision="bfloat16", precisionGuard="raise",
+                                useModelCache=False)
+        # Without reference inputs, 'warn' runs in reduced precision unchecked.
+        _, unchecked = self.make_interface(inferencePrecision="bfloat16", precisionGuard="warn",
+                                           useModelCache=False)
+        self.assertEqual(unchecked.dtype, torch.bfloat16)
+
+        rng = np.random.default_rng(42)
+        inputs = rng.normal(size=(4, 3, 256, 256)).astype(np.float32)
+        interface.model_package.adapter.load_reference_inputs = lambda: inputs
+        task.config.precisionTolerance = 1.0
+        interface.init_precision()
+        self.assertEqual(interface.dtype, torch.bfloat16)
+        self.assertLessEqual(task.metadata["precisionMaxScoreDelta"], 1.0)
+
+        blob, _ = interface.prepare_input(inputs)
+        self.assertEqual(blob.dtype, torch.bfloat16)
+        scores = interface.infer(inputs)
+        self.assertEqual(scores.dtype, np.float32)
+        self.assertTrue(np.all(np.isfinite(scores)))
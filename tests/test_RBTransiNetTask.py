@@ -20,24 +20,31 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import unittest
+from unittest import mock
+
 import numpy as np
 
+import lsst.afw.image
 import lsst.afw.table
-from lsst.geom import Point2I, Point2D, Box2I
+from lsst.daf.butler import DeferredDatasetHandle
+from lsst.geom import Point2I, Point2D, Box2I, Extent2I
 import lsst.meas.base.tests
 import lsst.utils.tests
 
 from lsst.meas.transiNet import RBTransiNetTask
+from lsst.meas.transiNet.rbTransiNetTask import RBTransiNetConnections
 
 
 class TestRBTransiNetTask(lsst.utils.tests.TestCase):
     def create_sample_datasets(self):
-        bbox = Box2I(Point2I(0, 0), Point2I(400, 400))
+        # Large enough for all but the border source to be in bounds with
+        # the dummy model's 256 pixel cutouts.
+        bbox = Box2I(Point2I(0, 0), Point2I(1000, 1000))
         dataset = lsst.meas.base.tests.TestDataset(bbox)
-        dataset.addSource(5000, Point2D(50, 50.))
+        dataset.addSource(5000, Point2D(300, 300.))
         # TODO: make one of these centered in a different corner of the pixel,
         # to test that the cutout is properly centered.
-        dataset.addSource(10000, Point2D(100, 50.))
+        dataset.addSource(10000, Point2D(350, 300.))
         dataset.addSource(20000, Point2D(1, 1))  # close-to-border source
         self.exposure, self.catalog = dataset.realize(10.0, dataset.makeMinimalSchema())
 
@@ -63,6 +70,58 @@ class TestRBTransiNetTask(lsst.utils.tests.TestCase):
                 self._check_empty_cutout(result.template)
                 self._check_empty_cutout(result.difference)
 
+    def test_make_cutouts_batch(self):
+        """Test that batched cutouts are identical to per-source cutouts.
+        """
+        # Small enough cutouts for all but the border source to be in bounds.
+        self.config.cutoutSize = 51
+        task = RBTransiNetTask(config=self.config)
+        # Put a few non-finite pixels under the first source.
+        self.exposure.image.array[290:295, 290:295] = np.nan
+        self.exposure.image.array[300, 300] = np.inf
+
+        blobs = task._make_cutouts_batch(self.exposure, self.exposure, self.exposure, self.catalog)
+        self.assertEqual(blobs.shape, (len(self.catalog), 3, task.config.cutoutSize, task.config.cutoutSize))
+        self.assertEqual(blobs.dtype, np.float32)
+        for blob, record in zip(blobs, self.catalog):
+            expected = task._make_cutouts(self.exposure, self.exposure, self.exposure, record)
+            np.testing.assert_array_equal(blob[0], expected.difference)
+            np.testing.assert_array_equal(blob[1], expected.science)
+            np.testing.assert_array_equal(blob[2], expected.template)
+
+    def test_make_cutouts_edge(self):
+        """Test that padded edge cutouts are identical in the batched and
+        per-source paths, and keep the in-bounds pixels.
+        """
+        size = self.config.cutoutSize
+        # The border source at (1, 1) is the only one partly out of bounds.
+        pad = -Box2I.makeCenteredBox(Point2D(1, 1), Extent2I(size)).getMinX()
+        for mode in ("constant", "reflect"):
+            self.config.edgeCutouts = mode
+            self.config.edgePadValue = 3.0
+            task = RBTransiNetTask(config=self.config)
+            blobs = task._make_cutouts_batch(self.exposure, self.exposure, self.exposure, self.catalog)
+            for blob, record in zip(blobs, self.catalog):
+                expected = task._make_cutouts(self.exposure, self.exposure, self.exposure, record)
+                np.testing.assert_array_equal(blob[0], expected.difference)
+                np.testing.assert_array_equal(blob[1], expected.science)
+                np.testing.assert_array_equal(blob[2], expected.template)
+
+            edge = blobs[2, 1]
+            image = self.exposure.image.array
+            np.testing.assert_array_equal(edge[pad:, pad:], image[:size - pad, :size - pad])
+            if mode == "constant":
+                np.testing.assert_array_equal(edge[:pad], 3.0)
+                np.testing.assert_array_equal(edge[:, :pad], 3.0)
+            else:
+                np.testing.assert_array_equal(edge[:pad, pad:], image[pad:0:-1, :size - pad])
+
+            # The padded border source is scored like the others.
+            result = task.run(self.exposure, self.exposure, self.exposure, self.catalog)
+            self.assertFalse(np.any(result.classifications["flag_outOfBounds"]))
+            scores = result.classifications["score"]
+            self.assertTrue(np.all((scores >= 0) & (scores <= 1)))
+
     def _check_cutout(self, image, size):
         """Test that the image cutout was made correctly.
 
@@ -104,6 +163,155 @@ class TestRBTransiNetTask(lsst.utils.tests.TestCase):
         result = task.run(self.exposure, self.exposure, self.exposure, self.catalog)
         self.assertIsInstance(result.classifications, lsst.afw.table.BaseCatalog)
         np.testing.assert_array_equal(self.catalog["id"], result.classifications["id"])
+        self.assertTrue(np.all(np.isfinite(result.classifications["score"])))
+        self._check_scored(result.classifications)
+
+    def _check_scored(self, classifications):
+        """Test that all but the border source were scored by the model.
+
+        Parameters
+        ----------
+        classifications : `lsst.afw.table.BaseCatalog`
+            Catalog of scores returned by the task.
+        """
+        flags = classifications["flag_outOfBounds"]
+        self.assertEqual(np.count_nonzero(flags), 1)
+        scores = classifications["score"][~flags]
+        self.assertTrue(np.all((scores >= 0) & (scores <= 1)))
+
+    def test_run_out_of_bounds(self):
+        """Test that out-of-bounds sources are flagged and given the sentinel
+        score without being scored, and that the other scores are unchanged.
+        """
+        self.config.outOfBoundsScore = -2.0
+        task = RBTransiNetTask(config=self.config)
+        result = task.run(self.exposure, self.exposure, self.exposure, self.catalog)
+
+        expected_flags = [record.getX() == 1 and record.getY() == 1 for record in self.catalog]
+        np.testing.assert_array_equal(result.classifications["flag_outOfBounds"], expected_flags)
+        scores = result.classifications["score"]
+        np.testing.assert_array_equal(scores[expected_flags], -2.0)
+
+        valid = ~np.array(expected_flags)
+        blobs = task._make_cutouts_batch(self.exposure, self.exposure, self.exposure, self.catalog)
+        np.testing.assert_array_equal(scores[valid], task.interface.infer(blobs[valid]))
+
+        self.config.streamCutouts = True
+        streamed = RBTransiNetTask(config=self.config).run(self.exposure, self.exposure, self.exposure,
+                                                           self.catalog)
+        np.testing.assert_array_equal(streamed.classifications["score"], scores)
+        np.testing.assert_array_equal(streamed.classifications["flag_outOfBounds"], expected_flags)
+
+    def _make_handle(self, exposure):
+        """Return a mock deferred handle of an exposure, which supports
+        reading its image and bbox components.
+        """
+        def get(component=None, parameters=None):
+            if component == "bbox":
+                return exposure.getBBox()
+            self.assertEqual(component, "image")
+            bbox = (parameters or {}).get("bbox", exposure.getBBox())
+            return lsst.afw.image.ImageF(exposure.image, bbox, deep=True)
+
+        handle = mock.Mock(spec=DeferredDatasetHandle)
+        handle.get.side_effect = get
+        return handle
+
+    def test_run_regions(self):
+        """Test that scoring from images or regions read through deferred
+        handles gives the same results as from full exposures.
+        """
+        self.config.edgeCutouts = "reflect"
+        expected = RBTransiNetTask(config=self.config).run(self.exposure, self.exposure, self.exposure,
+                                                           self.catalog)
+
+        for mode in ("image", "regions"):
+            self.config.inputReadMode = mode
+            self.assertTrue(RBTransiNetConnections(config=self.config).science.deferLoad)
+            handles = [self._make_handle(self.exposure) for _ in range(3)]
+            result = RBTransiNetTask(config=self.config).run(*handles, self.catalog)
+            np.testing.assert_array_equal(expected.classifications["score"],
+                                          result.classifications["score"])
+            # The science bbox is read once.
+            bbox_reads = [call for call in handles[1].get.call_args_list
+                          if call.kwargs.get("component") == "bbox"]
+            self.assertEqual(len(bbox_reads), 1)
+            if mode == "regions":
+                for handle in handles:
+                    reads = [call.kwargs for call in handle.get.call_args_list
+                             if call.kwargs.get("component") == "image"]
+                    self.assertTrue(reads)
+                    area = sum(read["parameters"]["bbox"].getArea() for read in reads)
+                    self.assertLess(area, self.exposure.getBBox().getArea())
+
+    def test_merge_cutout_boxes(self):
+        """Test that nearby cutout boxes are read together.
+        """
+        self.config.cutoutSize = 51
+        self.config.regionMergeGap = 0
+        task = RBTransiNetTask(config=self.config)
+        bbox = self.exposure.getBBox()
+        x = np.array([50., 100., 1., 300., -100.])
+        y = np.array([50., 50., 1., 300., 50.])
+        boxes, labels = task._merge_cutout_boxes(bbox, x, y)
+        self.assertEqual(len(boxes), 2)
+        np.testing.assert_array_equal(labels, [0, 0, 0, 1, -1])
+        for box, x_, y_ in zip([boxes[label] for label in labels[:4]], x, y):
+            cutout_box = Box2I.makeCenteredBox(Point2D(x_, y_), Extent2I(51))
+            cutout_box.clip(bbox)
+            self.assertTrue(box.contains(cutout_box))
+            self.assertTrue(bbox.contains(box))
+
+    def test_run_streaming(self):
+        """Test that streaming cutouts batch by batch gives the same scores as
+        extracting them all up front.
+        """
+        self.config.batchSize = 2
+        expected = RBTransiNetTask(config=self.config).run(self.exposure, self.exposure, self.exposure,
+                                                           self.catalog)
+
+        self.config.streamCutouts = True
+        result = RBTransiNetTask(config=self.config).run(self.exposure, self.exposure, self.exposure,
+                                                         self.catalog)
+        np.testing.assert_array_equal(expected.classifications["id"], result.classifications["id"])
+        np.testing.assert_array_equal(expected.classifications["score"], result.classifications["score"])
+        self._check_scored(result.classifications)
+
+    def test_run_many(self):
+        """Test that scoring several quanta together gives the same catalogs
+        as running each of them separately.
+        """
+        # Batches straddle the boundary between the two quanta.
+        self.config.batchSize = 2
+        task = RBTransiNetTask(config=self.config)
+        expected = task.run(self.exposure, self.exposure, self.exposure, self.catalog)
+
+        inputs = [(self.exposure, self.exposure, self.exposure, self.catalog)] * 2
+        result = task.runMany(inputs)
+        self.assertEqual(len(result.classifications), 2)
+        for classifications in result.classifications:
+            np.testing.assert_array_equal(expected.classifications["id"], classifications["id"])
+            np.testing.assert_array_equal(expected.classifications["score"], classifications["score"])
+            self._check_scored(classifications)
+
+    def test_run_stage_timings(self):
+        """Test that stage timings are recorded in the task metadata only
+        when enabled.
+        """
+        task = RBTransiNetTask(config=self.config)
+        task.run(self.exposure, self.exposure, self.exposure, self.catalog)
+        self.assertNotIn("forwardTime", task.metadata)
+
+        self.config.recordStageTimings = True
+        task = RBTransiNetTask(config=self.config)
+        task.run(self.exposure, self.exposure, self.exposure, self.catalog)
+        for stage in ("modelLoad", "cutout", "assembly", "forward", "catalog", "scoring"):
+            self.assertGreaterEqual(task.metadata[f"{stage}Time"], 0)
+        self.assertEqual(task.metadata["nCutouts"], len(self.catalog) - 1)
+        self.assertEqual(task.metadata["nBatches"], 1)
+        self.assertEqual(task.metadata["inputBytes"], (len(self.catalog) - 1) * 3 * 256**2 * 4)
+        self.assertGreater(task.metadata["cutoutsPerSecond"], 0)
+        self.assertGreater(task.metadata["peakRss"], 0)
 
     def test_config_butlerblock(self):
         config = RBTransiNetTask.ConfigClass()
@@ -0,0 +1,57 @@
+# This file is part of meas_transiNet.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import unittest
+
+from lsst.meas.transiNet import StageTimers
+
+
+class TestStageTimers(unittest.TestCase):
+    def test_record(self):
+        """Test that stage times and counters accumulate across calls and
+        threads.
+        """
+        timers = StageTimers()
+        for _ in range(2):
+            with timers.stage('forward'):
+                timers.count('nBatches')
+                timers.count('nCutouts', 10)
+        thread = threading.Thread(target=timers.count, args=('nCutouts', 5))
+        thread.start()
+        thread.join()
+
+        metadata = {}
+        timers.to_metadata(metadata)
+        self.assertGreater(metadata['forwardTime'], 0)
+        self.assertEqual(metadata['nBatches'], 2)
+        self.assertEqual(metadata['nCutouts'], 25)
+        self.assertGreater(metadata['peakRss'], 0)
+
+    def test_disabled(self):
+        """Test that disabled timers record nothing.
+        """
+        timers = StageTimers(enabled=False)
+        with timers.stage('forward'):
+            timers.count('nBatches')
+        metadata = {}
+        timers.to_metadata(metadata)
+        self.assertEqual(metadata, {})